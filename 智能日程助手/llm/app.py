@@ -1,21 +1,43 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, flash
-from schedule_manager import ScheduleManager
+from flask import Flask, Response, stream_with_context, render_template, request, jsonify, session, redirect, url_for, flash
+from schedule_manager import ScheduleManager, CALENDAR_MAX_RANGE_DAYS
 from datetime import datetime, timedelta
-import calendar
-import sqlite3
+import os
 import logging
-import re
+import threading
+import db
+import fts
+import cache
+import migrations
+import time_parser
+import llm_cache
+import chat_history
+import free_slots
+import recurrence
+import bulk_io
+import event_pages
+import json_stream
+from stats import StatisticsService
+from month_view import build_month_view
+from event_record import EventRecord
+from time_range import days_range, month_range, parse_iso_bound
 from functools import wraps
 from werkzeug.security import generate_password_hash, check_password_hash # type: ignore
-from typing import List, Dict
+from typing import Dict
 import json
 
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
+# 启动时执行一次数据库迁移；设为 0 时由部署流程单独执行 python migrations.py
+AUTO_MIGRATE = os.getenv("SCHEDULE_AUTO_MIGRATE", "1") == "1"
+# 同时进行的流式聊天上限：每条 SSE 连接在整个回复期间占用一个 worker 线程，超过上限的请求直接返回 503
+MAX_CHAT_STREAMS = int(os.getenv("SCHEDULE_MAX_CHAT_STREAMS", "16"))
+chat_streams = threading.BoundedSemaphore(MAX_CHAT_STREAMS)
+
 app = Flask(__name__)
 app.secret_key = 'your_secret_key'
 schedule_manager = ScheduleManager()
+statistics = StatisticsService()
 
 css = """
 <style>
@@ -82,30 +104,10 @@ css = """
 def parse_date_from_message(message):
     """从消息中解析日期"""
     try:
-        # 处理"今天"、"明天"、"后天"等相对日期
-        if "今天" in message:
-            return datetime.now()
-        elif "明天" in message:
-            return datetime.now() + timedelta(days=1)
-        elif "后天" in message:
-            return datetime.now() + timedelta(days=2)
-        
-        # 原有的日期格式处理
-        patterns = [
-            r'(\d{1,2})月(\d{1,2})日',    # 12月25日
-            r'(\d{1,2})月(\d{1,2})号',    # 12月25号
-            r'(\d{1,2})/(\d{1,2})',      # 12/25
-            r'(\d{1,2})-(\d{1,2})',      # 12-25
-            r'(\d{1,2})\.(\d{1,2})'      # 12.25
-        ]
-        
-        for pattern in patterns:
-            match = re.search(pattern, message)
-            if match:
-                month, day = map(int, match.groups())
-                year = datetime.now().year
-                return datetime(year, month, day)
-        return None
+        day, _, _ = time_parser.find_date(message)
+        if day is None:
+            return None
+        return datetime(day.year, day.month, day.day)
     except Exception as e:
         logger.error(f"解析日期出错: {str(e)}")
         return None
@@ -127,34 +129,46 @@ def format_events_message(events):
     return message
 
 def init_db():
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute('''
-        CREATE TABLE IF NOT EXISTS Users (
-            user_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL
-        )
-    ''')
-    cur.execute('''
-        CREATE TABLE IF NOT EXISTS Events (
-            event_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            title TEXT NOT NULL,
-            start_time DATETIME NOT NULL,
-            end_time DATETIME NOT NULL,
-            description TEXT,
-            location TEXT,
-            FOREIGN KEY (user_id) REFERENCES Users(user_id)
-        )
-    ''')
-    conn.commit()
-    conn.close()
+    """执行未应用的迁移；数据库已是最新版本时只读取一次版本号"""
+    try:
+        report = migrations.migrate()
+        if report['after_version'] != report['before_version']:
+            logger.info(f"数据库迁移完成 (schema v{report['before_version']} -> v{report['after_version']}, {report['journal_mode']})")
+    except Exception as e:
+        logger.error(f"初始化数据库时出错：{str(e)}")
+
+def sync_search_index():
+    """为应用未运行期间其他连接（sqlite3 命令行、脚本）写入的日程补上全文索引"""
+    try:
+        with db.transaction() as conn:
+            count = fts.sync(conn)
+        if count:
+            logger.info(f"已为 {count} 条日程补建全文索引")
+    except Exception as e:
+        logger.error(f"补建全文索引时出错：{str(e)}")
+
+if AUTO_MIGRATE:
+    init_db()
+sync_search_index()
 
 def get_db_connection():
-    conn = sqlite3.connect('schedule_manager.db')
-    conn.row_factory = sqlite3.Row
-    return conn
+    """从连接池借出连接，需配合 with 使用，退出时自动归还"""
+    return db.connection()
+
+def cached_json_response(cache_key, tags, build):
+    """返回带 ETag 的 JSON 响应，内容缓存在 month_cache 中；If-None-Match 命中时返回 304"""
+    def render():
+        body = json_stream.dumps(build())
+        return body, cache.make_etag(body)
+
+    body, etag = cache.month_cache.get_or_compute(cache_key, tags, render)
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
 def login_required(f):
     @wraps(f)
@@ -182,24 +196,21 @@ def register():
             return render_template('register.html')
         
         try:
-            conn = get_db_connection()
-            cur = conn.cursor()
-            
-            if cur.execute('SELECT 1 FROM Users WHERE username = ?', (username,)).fetchone():
-                flash('用户名已存在', 'danger')
-                return render_template('register.html')
-            
-            password_hash = generate_password_hash(password)
-            cur.execute('INSERT INTO Users (username, password_hash) VALUES (?, ?)',
-                       (username, password_hash))
-            conn.commit()
+            with db.transaction() as conn:
+                cur = conn.cursor()
+
+                if cur.execute('SELECT 1 FROM Users WHERE username = ?', (username,)).fetchone():
+                    flash('用户名已存在', 'danger')
+                    return render_template('register.html')
+
+                password_hash = generate_password_hash(password)
+                cur.execute('INSERT INTO Users (username, password_hash) VALUES (?, ?)',
+                           (username, password_hash))
             flash('注册成功！请登录', 'success')
             return redirect(url_for('login'))
         except Exception as e:
             flash('注册失败，请稍后重试', 'danger')
             logger.error(f"注册错误: {str(e)}")
-        finally:
-            conn.close()
             
     return render_template('register.html')
 
@@ -209,10 +220,9 @@ def login():
         username = request.form['username']
         password = request.form['password']
 
-        conn = get_db_connection()
-        cur = conn.cursor()
-        user = cur.execute('SELECT * FROM Users WHERE username = ?', (username,)).fetchone()
-        conn.close()
+        with get_db_connection() as conn:
+            cur = conn.cursor()
+            user = cur.execute('SELECT * FROM Users WHERE username = ?', (username,)).fetchone()
 
         if user and check_password_hash(user['password_hash'], password):
             session['user_id'] = user['user_id']
@@ -230,11 +240,49 @@ def logout():
     flash('您已成功退出登录', 'info')
     return redirect(url_for('login'))
 
-def get_chat_history() -> List[Dict[str, str]]:
-    """获取聊天历史记录"""
-    if 'chat_history' not in session:
-        session['chat_history'] = []
-    return session['chat_history']
+def get_chat_history(user_id, before_id=None, limit=chat_history.DEFAULT_PAGE_SIZE) -> Dict:
+    """获取一页聊天历史记录（保存在服务端，session 中只有登录信息）"""
+    return chat_history.page(user_id, before_id, limit)
+
+def sse_event(data, event=None):
+    """格式化一条 Server-Sent Events 消息"""
+    payload = json.dumps(data, ensure_ascii=False)
+    return (f"event: {event}\n" if event else "") + f"data: {payload}\n\n"
+
+def stream_chat_response(user_message, user_id):
+    """把 stream_message 产出的片段逐条推送给浏览器，结束后把完整回复写入聊天记录
+
+    流式连接数达到 MAX_CHAT_STREAMS 时不排队，直接返回 503，用户消息也不写入聊天记录；
+    名额在响应关闭时归还（包括客户端中途断开）。
+    """
+    if not chat_streams.acquire(blocking=False):
+        logger.warning(f"流式聊天连接数已达上限 {MAX_CHAT_STREAMS}，拒绝用户 {user_id} 的请求")
+        response = jsonify({'response': "当前对话人数较多，请稍后重试。"})
+        response.status_code = 503
+        response.headers['Retry-After'] = '5'
+        return response
+
+    chat_history.append(user_id, 'user', user_message)
+
+    def generate():
+        parts = []
+        try:
+            for chunk in schedule_manager.stream_message(user_message, user_id):
+                parts.append(chunk)
+                yield sse_event({'delta': chunk})
+        except Exception as e:
+            logger.error(f"流式聊天出错: {str(e)}")
+            parts.append("抱歉，系统暂时无法处理您的请求。请稍后重试或使用日历功能来管理日程。")
+            yield sse_event({'delta': parts[-1]})
+        chat_history.append(user_id, 'assistant', ''.join(parts))
+        yield sse_event({}, event='done')
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # 关闭 nginx 缓冲，片段立即到达浏览器
+    })
+    response.call_on_close(chat_streams.release)
+    return response
 
 @app.route('/chat', methods=['POST'])
 @login_required
@@ -245,24 +293,18 @@ def chat():
         user_id = session['user_id']
         logger.debug(f"收到用户 {user_id} 的消息: {user_message}")
 
+        # 浏览器请求流式响应时，用 Server-Sent Events 逐段推送（用户消息在获得流式名额后写入聊天记录）
+        if 'text/event-stream' in request.headers.get('Accept', ''):
+            return stream_chat_response(user_message, user_id)
+
         # 添加用户消息到历史记录
-        chat_history = get_chat_history()
-        chat_history.append({
-            "role": "user",
-            "content": user_message
-        })
+        chat_history.append(user_id, 'user', user_message)
 
         # 使用 schedule_manager 处理消息
         response = schedule_manager.process_message(user_message, user_id)
 
         # 添加助手回复到历史记录
-        chat_history.append({
-            "role": "assistant",
-            "content": response
-        })
-
-        # 保存聊天历史
-        session['chat_history'] = chat_history
+        chat_history.append(user_id, 'assistant', response)
 
         return jsonify({'response': response})
 
@@ -279,85 +321,59 @@ def get_calendar():
     year = int(data.get('year', datetime.now().year))
     month = int(data.get('month', datetime.now().month))
     
+    user_id = session['user_id']
+
     # 获取特定用户的日历数据
-    events = schedule_manager.get_month_events(year, month, session['user_id'])
-    
-    # 获取日历数据
-    cal = calendar.monthcalendar(year, month)
-    
-    # 构建日历数据
-    calendar_data = {
-        'year': year,
-        'month': month,
-        'days': []
-    }
-    
-    # 打印调试信息
-    print(f"获取到的原始事件: {events}")
-    
-    for week in cal:
-        for day in week:
-            if day != 0:
-                # 筛选当天的事件
-                day_events = []
-                for event in events:
-                    if isinstance(event['start_time'], datetime) and event['start_time'].day == day:
-                        day_events.append({
-                            'title': event['title'],
-                            'start_time': event['start_time'].strftime('%H:%M'),
-                            'end_time': event['end_time'].strftime('%H:%M'),
-                            'description': event['description'],
-                            'location': event['location']
-                        })
-                
-                calendar_data['days'].append({
-                    'date': day,
-                    'events': day_events
-                })
-                
-                # 打印调试信息
-                if day_events:
-                    print(f"{year}年{month}月{day}日的事件: {day_events}")
-    
-    return jsonify({
-        'calendar': calendar_data,
-        'events': [
-            {
-                'title': e['title'],
-                'start_time': e['start_time'].strftime('%Y-%m-%d %H:%M:%S'),
-                'end_time': e['end_time'].strftime('%Y-%m-%d %H:%M:%S'),
-                'description': e['description'],
-                'location': e['location']
-            } for e in events
-        ]
-    })
+    return cached_json_response(
+        ('calendar', user_id, year, month),
+        [cache.month_tag(user_id, year, month), recurrence.recurrence_tag(user_id)],
+        lambda: build_month_view(year, month, schedule_manager.get_month_events(year, month, user_id))
+    )
 
 @app.route('/check_events', methods=['GET'])
+@login_required
 def check_events():
+    """当前用户日程的第一页（调试用）；完整列表通过 /api/events 分页读取"""
     try:
-        conn = sqlite3.connect('schedule_manager.db')
-        cursor = conn.cursor()
-        
-        # 查询所有事件
-        cursor.execute('SELECT * FROM Events')
-        events = cursor.fetchall()
-        
-        # 打印查询结果
-        print("数据库中的事件：", events)
-        
+        rows, next_cursor = event_pages.fetch(session['user_id'])
         return jsonify({
             'status': 'success',
-            'events': events
+            'events': [EventRecord.from_event_row(row).to_json() for row in rows],
+            'next_cursor': next_cursor
         })
     except Exception as e:
-        print(f"查询事件时出错：{str(e)}")
+        logger.error(f"查询事件时出错：{str(e)}")
         return jsonify({
             'status': 'error',
             'message': str(e)
         })
-    finally:
-        if conn:
-            conn.close()
+
+@app.route('/api/events')
+@login_required
+def api_events():
+    """键集分页列出当前用户的日程：?cursor=<next_cursor>&limit=50&start=YYYY-MM-DD&end=YYYY-MM-DD&q=关键词
+
+    按 (start_time, event_id) 排序，每页最多 event_pages.MAX_PAGE_SIZE 条；
+    响应中的 next_cursor 传给下一次请求继续读取，没有更多数据时为 null。
+    """
+    try:
+        start = request.args.get('start')
+        end = request.args.get('end')
+        limit = request.args.get('limit', event_pages.DEFAULT_PAGE_SIZE, type=int)
+        rows, next_cursor = event_pages.fetch(
+            session['user_id'],
+            request.args.get('cursor'),
+            limit,
+            days_range(start, start)[0] if start else None,
+            days_range(end, end)[1] if end else None,
+            request.args.get('q', '').split()
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"分页读取日程时出错：{str(e)}")
+        return jsonify({'error': str(e)}), 500
+    return Response(event_pages.iter_json(rows, next_cursor), mimetype='application/json')
 
 @app.route('/delete_test_events', methods=['GET'])
 def delete_test_events():
@@ -378,50 +394,59 @@ def delete_test_events():
             'message': str(e)
         })
 
+@app.route('/api/calendar/events')
 @app.route('/get_events')
+@login_required
 def get_events():
-    # 从 schedule_manager 获取事件数据
-    events = schedule_manager.get_all_events()
-    return jsonify(events)
+    """FullCalendar 事件源：?start=...&end=...（ISO 8601，end 不含），默认本月
+
+    响应按页读取数据库并逐段编码为 JSON 数组，多个月的视图也不会在内存中构建完整列表。
+    """
+    try:
+        start = request.args.get('start')
+        end = request.args.get('end')
+        if start and end:
+            start, end = parse_iso_bound(start), parse_iso_bound(end)
+        else:
+            now = datetime.now()
+            start, end = month_range(now.year, now.month)
+        span = datetime.strptime(end, '%Y-%m-%d %H:%M:%S') - datetime.strptime(start, '%Y-%m-%d %H:%M:%S')
+        if span <= timedelta(0):
+            raise ValueError("结束时间必须晚于开始时间")
+        if span > timedelta(days=CALENDAR_MAX_RANGE_DAYS):
+            raise ValueError(f"查询范围不能超过 {CALENDAR_MAX_RANGE_DAYS} 天")
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    events = schedule_manager.get_all_events(session['user_id'], start, end)
+    return Response(json_stream.iter_array(events), mimetype='application/json')
 
 @app.route('/index')
 @login_required
 def index():
     return render_template('index.html')
 
+@app.route('/chat_history')
+@login_required
+def get_chat_history_page():
+    """分页读取聊天记录：?before=<message_id>&limit=20，返回比 before 更早的一页"""
+    before = request.args.get('before', type=int)
+    limit = request.args.get('limit', chat_history.DEFAULT_PAGE_SIZE, type=int)
+    return jsonify(get_chat_history(session['user_id'], before, limit))
+
 @app.route('/clear_chat_history', methods=['POST'])
 @login_required
 def clear_chat_history():
+    # 旧版本保存在 cookie 中的聊天记录一并移除
     session.pop('chat_history', None)
+    chat_history.clear(session['user_id'])
+    schedule_manager.memory.clear(session['user_id'])
     return jsonify({'status': 'success'})
 
 @app.route('/day_events/<int:year>/<int:month>/<int:day>')
 @login_required
 def day_events(year, month, day):
     try:
-        start_date = datetime(year, month, day).strftime('%Y-%m-%d 00:00:00')
-        end_date = datetime(year, month, day).strftime('%Y-%m-%d 23:59:59')
-        
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute('''
-            SELECT title, start_time, end_time, location, description
-            FROM Events
-            WHERE date(start_time) = date(?)
-            AND user_id = ?
-            ORDER BY start_time
-        ''', (start_date, session['user_id']))
-        
-        events = []
-        for row in cur.fetchall():
-            events.append({
-                'title': row[0],
-                'start_time': datetime.strptime(row[1], '%Y-%m-%d %H:%M:%S'),
-                'end_time': datetime.strptime(row[2], '%Y-%m-%d %H:%M:%S'),
-                'location': row[3],
-                'description': row[4]
-            })
-        
+        events = schedule_manager.get_day_events(datetime(year, month, day), session['user_id'])
         return render_template('day_events.html',
                              year=year,
                              month=month,
@@ -431,83 +456,173 @@ def day_events(year, month, day):
         logger.error(f"获取日程详情时出错: {str(e)}")
         flash('获取日程详情时出错', 'danger')
         return redirect(url_for('index'))
-    finally:
-        if conn:
-            conn.close()
+
+@app.route('/api/day/<day>')
+@login_required
+def api_day(day):
+    """某一天的日程 JSON（YYYY-MM-DD），时间字段直接使用数据库中的字符串，带 ETag"""
+    try:
+        target = datetime.strptime(day, '%Y-%m-%d')
+    except ValueError:
+        return jsonify({'error': f"无效的日期：{day}"}), 400
+    user_id = session['user_id']
+    return cached_json_response(
+        ('day', user_id, day),
+        [cache.month_tag(user_id, target.year, target.month), recurrence.recurrence_tag(user_id)],
+        lambda: {
+            'date': day,
+            'events': [event.to_json() for event in schedule_manager.get_day_events(target, user_id)]
+        }
+    )
 
 @app.route('/get_chart_data')
 @login_required
 def get_chart_data():
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
         user_id = session['user_id']
-        
-        # 获取当前月份的第一天和最后一天
-        today = datetime.now()
-        first_day = today.replace(day=1)
-        if today.month == 12:
-            last_day = today.replace(year=today.year + 1, month=1, day=1) - timedelta(days=1)
-        else:
-            last_day = today.replace(month=today.month + 1, day=1) - timedelta(days=1)
-        
-        # 获取本月每天的日程数量数据
-        line_data = []
-        current_date = first_day
-        while current_date <= last_day:
-            cursor.execute('''
-                SELECT COUNT(*) 
-                FROM Events 
-                WHERE user_id = ? 
-                AND date(start_time) = date(?)
-            ''', (user_id, current_date.strftime('%Y-%m-%d')))
-            count = cursor.fetchone()[0]
-            line_data.append({
-                'date': current_date.strftime('%Y-%m-%d'),
-                'count': count
-            })
-            current_date += timedelta(days=1)
-        
-        # 获取最近7天的数据用于柱状图
-        bar_data = []
-        total_events = 0
-        for i in range(7):
-            date = today - timedelta(days=i)
-            cursor.execute('''
-                SELECT COUNT(*) 
-                FROM Events 
-                WHERE user_id = ? 
-                AND date(start_time) = date(?)
-            ''', (user_id, date))
-            count = cursor.fetchone()[0]
-            total_events += count
-            bar_data.append({
-                'date': date.strftime('%m-%d'),
-                'count': count
-            })
-        
-        # 计算百分比
-        if total_events > 0:
-            for item in bar_data:
-                item['percentage'] = round((item['count'] / total_events) * 100, 2)
-        else:
-            for item in bar_data:
-                item['percentage'] = 0
-                
-        return jsonify({
-            'line_data': line_data,
-            'bar_data': bar_data
-        })
-        
+        today = datetime.now().date()
+
+        # 两个图表的数据来自同一次按天汇总查询，窗口覆盖的月份有日程变更时缓存失效
+        return cached_json_response(
+            ('chart', user_id, today),
+            [cache.month_tag(user_id, y, m) for y, m in cache.months_between(*statistics.chart_window(today))]
+            + [recurrence.recurrence_tag(user_id)],
+            lambda: statistics.chart_data(user_id, today)
+        )
+
     except Exception as e:
         logger.error(f"获取图表数据时出错：{str(e)}")
         return jsonify({'error': str(e)}), 500
-    finally:
-        if conn:
-            conn.close()
+
+@app.route('/free_slots')
+@login_required
+def get_free_slots():
+    """当前用户的空闲时段：?start=YYYY-MM-DD&end=YYYY-MM-DD&hours=09:00-18:00&min_minutes=30"""
+    try:
+        now = datetime.now()
+        start = request.args.get('start')
+        first_day = datetime.strptime(start, '%Y-%m-%d').date() if start else now.date()
+        end = request.args.get('end')
+        last_day = datetime.strptime(end, '%Y-%m-%d').date() if end else first_day
+        hours = request.args.get('hours')
+        hours = free_slots.parse_hours(hours) if hours else None
+        min_minutes = request.args.get('min_minutes', type=int)
+        slots = free_slots.find_free_slots([session['user_id']], first_day, last_day, hours, min_minutes, now)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"计算空闲时间时出错：{str(e)}")
+        return jsonify({'error': str(e)}), 500
+    return jsonify({
+        'start': first_day.isoformat(),
+        'end': last_day.isoformat(),
+        'slots': free_slots.to_json(slots[session['user_id']])
+    })
+
+@app.route('/api/occurrences/<occurrence_id>', methods=['PATCH', 'DELETE'])
+@login_required
+def api_occurrence(occurrence_id):
+    """取消（DELETE）或修改（PATCH，JSON 字段 title/start_time/end_time/location）重复日程的某一次
+
+    occurrence_id 即日历事件源中重复日程各次发生的 id；其余各次不受影响。
+    """
+    user_id = session['user_id']
+    if not recurrence.parse_occurrence_id(occurrence_id) or not schedule_manager.get_event(occurrence_id, user_id):
+        return jsonify({'error': '未找到指定的日程'}), 404
+    if request.method == 'DELETE':
+        if not schedule_manager.delete_event(occurrence_id, user_id):
+            return jsonify({'error': '取消日程失败'}), 500
+        return jsonify({'status': 'success'})
+
+    data = request.get_json(silent=True) or {}
+    try:
+        updated_data = {key: data.get(key) for key in ('title', 'location')}
+        for key in ('start_time', 'end_time'):
+            updated_data[key] = datetime.fromisoformat(data[key]) if data.get(key) else None
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': f"无效的时间：{str(e)}"}), 400
+    if updated_data['end_time'] and updated_data['start_time'] and updated_data['end_time'] < updated_data['start_time']:
+        return jsonify({'error': '结束时间不能早于开始时间'}), 400
+    success, message = schedule_manager.update_event(occurrence_id, updated_data, user_id)
+    if not success:
+        return jsonify({'error': message}), 500
+    event = EventRecord.from_event_row(schedule_manager.get_event(occurrence_id, user_id))
+    return jsonify({'status': 'success', 'event': event.to_json()})
+
+@app.route('/api/recurrences/<int:recurrence_id>', methods=['DELETE'])
+@login_required
+def api_delete_recurrence(recurrence_id):
+    """删除整条重复日程：规则和它的全部例外"""
+    if not recurrence.delete_rule(recurrence_id, session['user_id']):
+        return jsonify({'error': '未找到指定的重复日程'}), 404
+    return jsonify({'status': 'success'})
+
+@app.route('/import_events', methods=['POST'])
+@login_required
+def import_events():
+    """上传 .ics 或 .csv 文件批量导入日程，返回导入条数和吞吐量"""
+    upload = request.files.get('file')
+    if upload is None or not upload.filename:
+        return jsonify({'error': '请选择要导入的文件'}), 400
+    try:
+        result = bulk_io.import_file(session['user_id'], upload.stream, upload.filename)
+    except Exception as e:
+        logger.error(f"导入日程时出错：{str(e)}")
+        return jsonify({'error': str(e)}), 500
+    return jsonify(result)
+
+@app.route('/export_events.<fmt>')
+@login_required
+def export_events(fmt):
+    """流式导出当前用户的全部日程：/export_events.ics 或 /export_events.csv"""
+    user_id = session['user_id']
+    if fmt == 'ics':
+        body, mimetype = bulk_io.export_ics(user_id, request.host), 'text/calendar'
+    elif fmt == 'csv':
+        body, mimetype = bulk_io.export_csv(user_id), 'text/csv'
+    else:
+        return jsonify({'error': f'不支持的导出格式：{fmt}'}), 404
+    return Response(stream_with_context(body), mimetype=f'{mimetype}; charset=utf-8', headers={
+        'Content-Disposition': f'attachment; filename=schedule.{fmt}'
+    })
+
+@app.route('/db_pool_stats')
+@login_required
+def db_pool_stats():
+    """数据库连接池运行指标"""
+    return jsonify(db.pool.stats())
+
+@app.route('/cache_stats')
+@login_required
+def cache_stats():
+    """月视图和图表缓存的命中率等指标"""
+    return jsonify(cache.month_cache.stats())
+
+@app.route('/state_stats')
+@login_required
+def state_stats():
+    """多轮操作会话状态：当前会话数、过期和淘汰次数"""
+    return jsonify(schedule_manager.states.stats())
+
+@app.route('/parser_stats')
+@login_required
+def parser_stats():
+    """本地解析命中次数与跳过 AI 的比例"""
+    return jsonify(time_parser.stats.snapshot())
+
+@app.route('/llm_cache_stats')
+@login_required
+def llm_cache_stats():
+    """AI 响应缓存的命中率、容量和淘汰次数"""
+    return jsonify(llm_cache.responses.stats())
+
+@app.route('/llm_stats')
+@login_required
+def llm_stats():
+    """大模型调用网关：并发、熔断状态以及各类调用的结果和延迟分布"""
+    return jsonify(schedule_manager.gateway.stats())
 
 if __name__ == '__main__':
-    init_db()  # 初始化数据库
     app.run(debug=True)
 
 # 打印所有路由（用于调试）
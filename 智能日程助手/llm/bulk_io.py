@@ -0,0 +1,504 @@
+import io
+import re
+import csv
+import sys
+import time
+import logging
+from datetime import datetime, timedelta, timezone
+
+import db
+import fts
+import stats
+import cache
+import recurrence
+from time_range import TIME_FORMAT
+
+logger = logging.getLogger(__name__)
+
+# 批量导入每个事务写入的行数，以及导出时每次从数据库读取的行数
+IMPORT_CHUNK_SIZE = 500
+EXPORT_PAGE_SIZE = 500
+
+# CSV 的列；导入时也接受中文表头
+CSV_COLUMNS = ('title', 'start_time', 'end_time', 'location', 'description')
+_CSV_ALIASES = {
+    '标题': 'title', '开始时间': 'start_time', '结束时间': 'end_time',
+    '地点': 'location', '描述': 'description', '备注': 'description',
+}
+_CSV_TIME_FORMATS = (TIME_FORMAT, '%Y-%m-%d %H:%M', '%Y/%m/%d %H:%M:%S', '%Y/%m/%d %H:%M', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M')
+
+_ICS_WEEKDAYS = ('MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU')
+
+
+class RecordError(ValueError):
+    """单条记录无法导入（格式错误、缺少必填字段）"""
+
+
+def _parse_csv_time(value):
+    value = (value or '').strip()
+    for fmt in _CSV_TIME_FORMATS:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    raise RecordError(f"无法解析时间：{value!r}")
+
+
+def iter_csv_events(lines):
+    """逐行解析 CSV，产出日程字典；格式错误的行产出 RecordError 实例，由调用方计数
+
+    lines 可以是文件对象或任意产出文本行的可迭代对象，不会一次读入整个文件。
+    """
+    reader = csv.reader(lines)
+    header = next(reader, None)
+    if header is None:
+        return
+    columns = [_CSV_ALIASES.get(name.strip().lstrip('\ufeff'), name.strip().lstrip('\ufeff').lower()) for name in header]
+    for line_no, values in enumerate(reader, start=2):
+        if not any(value.strip() for value in values):
+            continue
+        row = dict(zip(columns, values))
+        try:
+            title = (row.get('title') or '').strip()
+            if not title:
+                raise RecordError("缺少标题")
+            start = _parse_csv_time(row.get('start_time'))
+            end = _parse_csv_time(row['end_time']) if (row.get('end_time') or '').strip() else start + timedelta(hours=1)
+            if end < start:
+                raise RecordError("结束时间早于开始时间")
+        except RecordError as e:
+            yield RecordError(f"第 {line_no} 行：{e}")
+            continue
+        yield {
+            'title': title,
+            'start_time': start,
+            'end_time': end,
+            'location': (row.get('location') or '').strip() or None,
+            'description': (row.get('description') or '').strip(),
+            'is_all_day': False,
+        }
+
+
+def _unfold(lines):
+    """iCalendar 折行：以空格或制表符开头的行接在上一行后面"""
+    current = None
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if line[:1] in (' ', '\t') and current is not None:
+            current += line[1:]
+            continue
+        if current is not None:
+            yield current
+        current = line
+    if current:
+        yield current
+
+
+_ICS_ESCAPE = re.compile(r'\\([\\;,nN])')
+
+
+def _unescape(value):
+    return _ICS_ESCAPE.sub(lambda match: '\n' if match.group(1) in 'nN' else match.group(1), value)
+
+
+def _escape(value):
+    return (str(value or '').replace('\\', '\\\\').replace(';', '\\;')
+            .replace(',', '\\,').replace('\n', '\\n'))
+
+
+def _parse_ics_time(value, params):
+    """返回 (datetime, 是否全天)；UTC 时间换算为本地时间，带 TZID 的按墙上时间处理"""
+    if params.get('VALUE') == 'DATE' or len(value) == 8:
+        return datetime.strptime(value[:8], '%Y%m%d'), True
+    if value.endswith('Z'):
+        utc = datetime.strptime(value[:-1], '%Y%m%dT%H%M%S').replace(tzinfo=timezone.utc)
+        return utc.astimezone().replace(tzinfo=None), False
+    return datetime.strptime(value[:15], '%Y%m%dT%H%M%S'), False
+
+
+def _parse_duration(value):
+    """ICS DURATION，只支持 PnDTnHnMnS / PnW"""
+    sign = -1 if value.startswith('-') else 1
+    value = value.lstrip('+-')[1:]
+    total, number = timedelta(), ''
+    units = {'W': timedelta(weeks=1), 'D': timedelta(days=1), 'H': timedelta(hours=1),
+             'M': timedelta(minutes=1), 'S': timedelta(seconds=1)}
+    for char in value:
+        if char.isdigit():
+            number += char
+        elif char in units:
+            total += units[char] * int(number or 0)
+            number = ''
+    return total * sign
+
+
+def _parse_rrule(value, start):
+    """把 RRULE 映射到 EventRecurrences 支持的子集；不支持的规则返回 None"""
+    parts = dict(part.split('=', 1) for part in value.split(';') if '=' in part)
+    freq = parts.get('FREQ')
+    if freq not in recurrence.FREQUENCIES:
+        return None
+    weekdays = None
+    if 'BYDAY' in parts:
+        if freq != 'WEEKLY':
+            return None
+        try:
+            weekdays = [_ICS_WEEKDAYS.index(day[-2:]) for day in parts['BYDAY'].split(',')]
+        except ValueError:
+            return None
+    until = None
+    if 'UNTIL' in parts:
+        until, _ = _parse_ics_time(parts['UNTIL'], {})
+        if len(parts['UNTIL']) == 8:
+            until = until.replace(hour=23, minute=59, second=59)
+    return {
+        'freq': freq,
+        'interval': int(parts.get('INTERVAL', 1)),
+        'weekdays': weekdays or ([start.weekday()] if freq == 'WEEKLY' else None),
+        'until': until,
+        'count': int(parts['COUNT']) if 'COUNT' in parts else None,
+    }
+
+
+def iter_ics_events(lines):
+    """逐行解析 iCalendar，每遇到一个 VEVENT 结束就产出一个日程字典
+
+    带 RRULE 的事件产出重复规则（字典中有 freq 字段），由导入时写入 EventRecurrences；
+    无法解析的事件产出 RecordError 实例。
+    """
+    event = None
+    for line in _unfold(lines):
+        if line == 'BEGIN:VEVENT':
+            event = {}
+            continue
+        if event is None:
+            continue
+        if line == 'END:VEVENT':
+            yield _build_ics_event(event)
+            event = None
+            continue
+        name, _, value = line.partition(':')
+        name, *raw_params = name.split(';')
+        params = dict(param.split('=', 1) for param in raw_params if '=' in param)
+        if name.upper() == 'EXDATE':
+            # EXDATE 可以出现多行，每行又可以用逗号列出多个时间
+            event.setdefault('EXDATE', []).extend((item, params) for item in value.split(',') if item)
+            continue
+        event[name.upper()] = (value, params)
+
+
+def _parse_exdates(values, start):
+    """EXDATE 转为被取消的各次发生的开始时间；只写日期的按 DTSTART 的时刻补齐"""
+    exdates = []
+    for value, params in values:
+        moment, all_day = _parse_ics_time(value, params)
+        exdates.append(datetime.combine(moment.date(), start.time()) if all_day else moment)
+    return exdates
+
+
+def _build_ics_event(props):
+    summary = props.get('SUMMARY', ('',))[0]
+    try:
+        if 'RECURRENCE-ID' in props:
+            # 单次修改需要按 UID 找到所属的重复规则，可能跨批次，暂不支持，整条跳过而不是当作独立日程导入
+            raise RecordError("不支持单次修改（RECURRENCE-ID）")
+        if 'DTSTART' not in props:
+            raise RecordError("缺少 DTSTART")
+        start, all_day = _parse_ics_time(*props['DTSTART'])
+        if 'DTEND' in props:
+            end, _ = _parse_ics_time(*props['DTEND'])
+        elif 'DURATION' in props:
+            end = start + _parse_duration(props['DURATION'][0])
+        else:
+            end = start + (timedelta(days=1) if all_day else timedelta(hours=1))
+        if end < start:
+            raise RecordError("结束时间早于开始时间")
+        rule = None
+        if 'RRULE' in props:
+            rule = _parse_rrule(props['RRULE'][0], start)
+            if rule is None:
+                raise RecordError(f"不支持的重复规则 {props['RRULE'][0]}")
+            rule['exdates'] = _parse_exdates(props.get('EXDATE', []), start)
+    except (RecordError, ValueError) as e:
+        return RecordError(f"事件 {summary!r}：{e}")
+
+    record = {
+        'title': _unescape(summary or '未命名日程') or '未命名日程',
+        'start_time': start,
+        'end_time': end,
+        'location': _unescape(props['LOCATION'][0]) if 'LOCATION' in props else None,
+        'description': _unescape(props['DESCRIPTION'][0]) if 'DESCRIPTION' in props else '',
+        'is_all_day': all_day,
+    }
+    if rule:
+        record.update(rule)
+    return record
+
+
+def _chunks(records, size):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def import_events(user_id, records, chunk_size=IMPORT_CHUNK_SIZE):
+    """把 iter_csv_events / iter_ics_events 产出的记录写入数据库
+
+    每 chunk_size 条一个事务，用 executemany 批量插入，汇总表按天合并后更新；
+    某个批次失败时回滚该批次并计入 failed，其余批次照常导入。
+    返回 {'imported', 'recurring', 'skipped', 'failed', 'errors', 'seconds', 'rows_per_second'}。
+    """
+    started = time.perf_counter()
+    result = {'imported': 0, 'recurring': 0, 'skipped': 0, 'failed': 0, 'errors': []}
+    first_start = last_end = None
+
+    def valid(records):
+        for record in records:
+            if isinstance(record, RecordError):
+                result['skipped'] += 1
+                if len(result['errors']) < 20:
+                    result['errors'].append(str(record))
+                continue
+            yield record
+
+    for chunk in _chunks(valid(records), chunk_size):
+        events = [record for record in chunk if 'freq' not in record]
+        rules = [record for record in chunk if 'freq' in record]
+        try:
+            with db.transaction() as conn:
+                cursor = conn.cursor()
+                cursor.executemany('''
+                    INSERT INTO Events (user_id, title, start_time, end_time, location, description, is_all_day)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', [(
+                    user_id,
+                    event['title'],
+                    event['start_time'].strftime(TIME_FORMAT),
+                    event['end_time'].strftime(TIME_FORMAT),
+                    event['location'],
+                    event['description'],
+                    event['is_all_day']
+                ) for event in events])
+                per_day = {}
+                for event in events:
+                    day = event['start_time'].strftime('%Y-%m-%d')
+                    per_day[day] = per_day.get(day, 0) + 1
+                for day, count in per_day.items():
+                    stats.adjust_daily_count(cursor, user_id, day, count)
+                fts.sync(cursor)
+                # 与外层事务共用连接，重复规则和普通日程在同一批次中提交；缓存在提交后统一失效
+                for rule in rules:
+                    recurrence_id = recurrence.add_rule(user_id, rule, invalidate=False)
+                    if recurrence_id is None:
+                        raise RuntimeError(f"保存重复日程失败：{rule['title']}")
+                    for exdate in rule.get('exdates', ()):
+                        if not recurrence.set_exception(recurrence_id, user_id, exdate, cancelled=True, invalidate=False):
+                            raise RuntimeError(f"保存重复日程例外失败：{rule['title']}")
+        except Exception as e:
+            logger.error(f"导入日程批次失败: {str(e)}")
+            result['failed'] += len(chunk)
+            if len(result['errors']) < 20:
+                result['errors'].append(str(e))
+            continue
+
+        result['imported'] += len(events)
+        result['recurring'] += len(rules)
+        for event in events:
+            if first_start is None or event['start_time'] < first_start:
+                first_start = event['start_time']
+            if last_end is None or event['end_time'] > last_end:
+                last_end = event['end_time']
+
+    if first_start is not None:
+        cache.invalidate_event_span(user_id, first_start, last_end)
+    if result['recurring']:
+        cache.month_cache.invalidate_tag(recurrence.recurrence_tag(user_id))
+
+    elapsed = time.perf_counter() - started
+    total = result['imported'] + result['recurring']
+    result['seconds'] = round(elapsed, 3)
+    result['rows_per_second'] = round(total / elapsed) if elapsed > 0 else total
+    logger.info(f"用户 {user_id} 导入 {total} 条日程，跳过 {result['skipped']} 条，"
+                f"失败 {result['failed']} 条，耗时 {elapsed:.3f}s（{result['rows_per_second']} 条/秒）")
+    return result
+
+
+def import_file(user_id, stream, filename='', chunk_size=IMPORT_CHUNK_SIZE):
+    """导入上传的二进制文件流；按扩展名（或内容开头）区分 ICS 和 CSV"""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    first = text.readline()
+    lines = _prepend(first, text)
+    if filename.lower().endswith('.ics') or first.strip().upper() == 'BEGIN:VCALENDAR':
+        return import_events(user_id, iter_ics_events(lines), chunk_size)
+    return import_events(user_id, iter_csv_events(lines), chunk_size)
+
+
+def _prepend(first, lines):
+    yield first
+    yield from lines
+
+
+# 导出时按 (start_time, event_id) 键集分页，参数为 (user_id, 上一页最后的开始时间, 同前, 上一页最后的 event_id, 页大小)
+EXPORT_PAGE_SQL = '''
+    SELECT event_id, title, start_time, end_time, location, description, is_all_day
+    FROM Events
+    WHERE user_id = ? AND start_time >= ? AND (start_time > ? OR event_id > ?)
+    ORDER BY start_time, event_id
+    LIMIT ?
+'''
+
+
+def iter_user_events(user_id, page_size=EXPORT_PAGE_SIZE):
+    """按 (start_time, event_id) 键集分页逐页读取用户的全部日程，每页单独借出连接"""
+    last = ('', 0)
+    while True:
+        with db.connection() as conn:
+            rows = conn.execute(EXPORT_PAGE_SQL, (user_id, last[0], last[0], last[1], page_size)).fetchall()
+        if not rows:
+            return
+        yield from rows
+        last = (rows[-1][2], rows[-1][0])
+        if len(rows) < page_size:
+            return
+
+
+def _iter_rules(user_id):
+    with db.connection() as conn:
+        rows = conn.execute('''
+            SELECT recurrence_id, user_id, title, start_time, end_time, location, description,
+                   freq, repeat_interval, by_weekday, until, occurrence_count
+            FROM EventRecurrences
+            WHERE user_id = ?
+            ORDER BY start_time
+        ''', (user_id,)).fetchall()
+    return [recurrence.RecurrenceRule.from_row(row) for row in rows]
+
+
+def _iter_exceptions(user_id):
+    """{recurrence_id: [(occurrence_start, cancelled, title, start_time, end_time, location, description), ...]}"""
+    with db.connection() as conn:
+        rows = conn.execute('''
+            SELECT x.recurrence_id, x.occurrence_start, x.cancelled, x.title, x.start_time, x.end_time,
+                   x.location, x.description
+            FROM RecurrenceExceptions x
+            JOIN EventRecurrences r ON r.recurrence_id = x.recurrence_id
+            WHERE r.user_id = ?
+            ORDER BY x.occurrence_start
+        ''', (user_id,)).fetchall()
+    exceptions = {}
+    for row in rows:
+        exceptions.setdefault(row[0], []).append(row[1:])
+    return exceptions
+
+
+def export_csv(user_id):
+    """逐行产出用户全部日程的 CSV 文本（不含重复规则）"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    for row in iter_user_events(user_id):
+        writer.writerow((row[1], row[2], row[3], row[4] or '', row[5] or ''))
+        if buffer.tell() >= 8192:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _ics_time(value, all_day=False):
+    if isinstance(value, str):
+        value = datetime.strptime(value, TIME_FORMAT)
+    return value.strftime('%Y%m%d') if all_day else value.strftime('%Y%m%dT%H%M%S')
+
+
+def _fold(line):
+    """按 RFC 5545 每行不超过 75 个字节折行"""
+    data = line.encode('utf-8')
+    if len(data) <= 75:
+        return line + '\r\n'
+    parts, current, size = [], '', 0
+    for char in line:
+        width = len(char.encode('utf-8'))
+        if size + width > (75 if not parts else 74):
+            parts.append(current)
+            current, size = '', 0
+        current += char
+        size += width
+    parts.append(current)
+    return '\r\n '.join(parts) + '\r\n'
+
+
+def _ics_rrule(rule):
+    value = f"FREQ={rule.freq};INTERVAL={rule.interval}"
+    if rule.freq == 'WEEKLY':
+        value += ';BYDAY=' + ','.join(_ICS_WEEKDAYS[day] for day in rule.weekdays)
+    if rule.count:
+        value += f";COUNT={rule.count}"
+    if rule.until:
+        value += f";UNTIL={_ics_time(rule.until)}"
+    return value
+
+
+def export_ics(user_id, host='schedule-assistant'):
+    """逐个产出用户全部日程（含重复规则）的 iCalendar 文本"""
+    stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    yield 'BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//智能日程助手//CN\r\nCALSCALE:GREGORIAN\r\n'
+    for row in iter_user_events(user_id):
+        event_id, title, start_time, end_time, location, description, all_day = row
+        lines = ['BEGIN:VEVENT', f"UID:event-{event_id}@{host}", f"DTSTAMP:{stamp}"]
+        if all_day:
+            lines += [f"DTSTART;VALUE=DATE:{_ics_time(start_time, True)}", f"DTEND;VALUE=DATE:{_ics_time(end_time, True)}"]
+        else:
+            lines += [f"DTSTART:{_ics_time(start_time)}", f"DTEND:{_ics_time(end_time)}"]
+        lines.append(f"SUMMARY:{_escape(title)}")
+        if location:
+            lines.append(f"LOCATION:{_escape(location)}")
+        if description:
+            lines.append(f"DESCRIPTION:{_escape(description)}")
+        lines.append('END:VEVENT')
+        yield ''.join(_fold(line) for line in lines)
+    exceptions = _iter_exceptions(user_id)
+    for rule in _iter_rules(user_id):
+        lines = ['BEGIN:VEVENT', f"UID:recurrence-{rule.recurrence_id}@{host}", f"DTSTAMP:{stamp}",
+                 f"DTSTART:{_ics_time(rule.start)}", f"DTEND:{_ics_time(rule.end)}",
+                 f"RRULE:{_ics_rrule(rule)}", f"SUMMARY:{_escape(rule.title)}"]
+        if rule.location:
+            lines.append(f"LOCATION:{_escape(rule.location)}")
+        if rule.description:
+            lines.append(f"DESCRIPTION:{_escape(rule.description)}")
+        rule_exceptions = exceptions.get(rule.recurrence_id, [])
+        # 取消和修改过的那几次都从规则中排除；修改过的再作为独立日程导出，导入时不需要 RECURRENCE-ID
+        lines += [f"EXDATE:{_ics_time(exception[0])}" for exception in rule_exceptions]
+        lines.append('END:VEVENT')
+        yield ''.join(_fold(line) for line in lines)
+        for occurrence_start, cancelled, title, start_time, end_time, location, description in rule_exceptions:
+            if cancelled:
+                continue
+            start = datetime.strptime(start_time or occurrence_start, TIME_FORMAT)
+            end = datetime.strptime(end_time, TIME_FORMAT) if end_time else start + rule.duration
+            location = location or rule.location
+            description = description if description is not None else rule.description
+            lines = ['BEGIN:VEVENT', f"UID:recurrence-{rule.recurrence_id}-{_ics_time(occurrence_start)}@{host}",
+                     f"DTSTAMP:{stamp}", f"DTSTART:{_ics_time(start)}", f"DTEND:{_ics_time(end)}",
+                     f"SUMMARY:{_escape(title or rule.title)}"]
+            if location:
+                lines.append(f"LOCATION:{_escape(location)}")
+            if description:
+                lines.append(f"DESCRIPTION:{_escape(description)}")
+            lines.append('END:VEVENT')
+            yield ''.join(_fold(line) for line in lines)
+    yield 'END:VCALENDAR\r\n'
+
+
+if __name__ == '__main__':
+    # python bulk_io.py <user_id> <文件.csv|文件.ics>：导入文件并打印吞吐量
+    if len(sys.argv) != 3:
+        print("用法: python bulk_io.py <user_id> <文件.csv|文件.ics>")
+        sys.exit(1)
+    with open(sys.argv[2], 'rb') as f:
+        print(import_file(int(sys.argv[1]), f, sys.argv[2]))
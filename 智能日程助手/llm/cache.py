@@ -0,0 +1,492 @@
+import os
+import json
+import socket
+import threading
+import time
+import hashlib
+import logging
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+import db
+from event_record import EventRecord
+
+logger = logging.getLogger(__name__)
+
+CACHE_MAX_ENTRIES = int(os.getenv("SCHEDULE_CACHE_MAX_ENTRIES", "1024"))
+CACHE_TTL = float(os.getenv("SCHEDULE_CACHE_TTL", "300"))
+# 进程内后端最多保留的版本号计数器个数
+CACHE_MAX_COUNTERS = int(os.getenv("SCHEDULE_CACHE_MAX_COUNTERS", "65536"))
+# memory（默认，仅限单进程）、sqlite[:///路径] 或 redis://host:port/db
+CACHE_BACKEND = os.getenv("SCHEDULE_CACHE_BACKEND", "memory")
+KEY_PREFIX = "schedule"
+
+_MISSING = object()
+
+
+def _key_str(key):
+    """把元组形式的键转换为后端统一使用的字符串键"""
+    if isinstance(key, str):
+        return f"{KEY_PREFIX}:{key}"
+    return KEY_PREFIX + ":" + ":".join(str(part) for part in key)
+
+
+def _json_default(value):
+    if isinstance(value, EventRecord):
+        return {'__event__': value.to_json()}
+    raise TypeError(f"无法序列化的缓存值类型: {type(value).__name__}")
+
+
+def _json_object(data):
+    if len(data) == 1 and '__event__' in data:
+        return EventRecord(**data['__event__'])
+    return data
+
+
+def dumps(value):
+    """共享后端（sqlite/redis）中的值一律存为 JSON，不使用 pickle
+
+    其他进程写入的数据反序列化时不会执行任何代码。元组读回后是列表，EventRecord 按字段重建。
+    """
+    return json.dumps(value, default=_json_default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def loads(data):
+    """反序列化共享后端中的值；无法解析（例如旧版本写入的 pickle 数据）时按未命中处理"""
+    try:
+        return json.loads(data, object_hook=_json_object)
+    except (ValueError, TypeError) as e:
+        logger.warning(f"丢弃无法解析的缓存值: {str(e)}")
+        return None
+
+
+class LRUCache:
+    """带容量上限和过期时间的进程内 LRU 缓存"""
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._data = OrderedDict()   # key -> (expires_at, value)
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                return default
+            if entry[0] < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (time.monotonic() + (ttl or self.ttl), value)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class CacheBackend:
+    """缓存/状态后端接口
+
+    get/set/delete 操作普通条目（可能被淘汰或过期）；
+    incr/get_counter 操作版本号计数器，计数器不会被淘汰，保证版本只增不减。
+    """
+
+    name = 'base'
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def incr(self, key):
+        raise NotImplementedError
+
+    def get_counter(self, key):
+        raise NotImplementedError
+
+    def stats(self):
+        return {'backend': self.name}
+
+
+class MemoryBackend(CacheBackend):
+    """进程内后端：只适合单 worker 部署
+
+    计数器按最近使用淘汰，最多保留 max_counters 个。被淘汰的计数器之后从“已淘汰的最大值”起算，
+    所以任何计数器读到的值仍然只增不减，不会重新命中失效前写入的条目。
+    """
+
+    name = 'memory'
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL, max_counters=CACHE_MAX_COUNTERS):
+        self._entries = LRUCache(max_entries, ttl)
+        self._counters = OrderedDict()
+        self._counter_floor = 0
+        self.max_counters = max_counters
+        self.counter_evictions = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        return self._entries.get(_key_str(key))
+
+    def set(self, key, value, ttl=None):
+        self._entries.set(_key_str(key), value, ttl)
+
+    def delete(self, key):
+        self._entries.delete(_key_str(key))
+
+    def incr(self, key):
+        key = _key_str(key)
+        with self._lock:
+            value = self._counters.pop(key, self._counter_floor) + 1
+            self._counters[key] = value
+            while len(self._counters) > self.max_counters:
+                _, evicted = self._counters.popitem(last=False)
+                self._counter_floor = max(self._counter_floor, evicted)
+                self.counter_evictions += 1
+            return value
+
+    def get_counter(self, key):
+        key = _key_str(key)
+        with self._lock:
+            value = self._counters.get(key)
+            if value is None:
+                return self._counter_floor
+            self._counters.move_to_end(key)
+            return value
+
+    def stats(self):
+        return {
+            'backend': self.name,
+            'entries': len(self._entries),
+            'max_entries': self._entries.max_entries,
+            'evictions': self._entries.evictions,
+            'counters': len(self._counters),
+            'counter_evictions': self.counter_evictions,
+        }
+
+
+class SQLiteBackend(CacheBackend):
+    """基于共享 SQLite 文件的后端：同一台机器上的多个 worker 共享"""
+
+    name = 'sqlite'
+
+    def __init__(self, path='schedule_cache.db', max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._pool = db.ConnectionPool(db_path=path)
+        self._writes = 0
+        with self._pool.transaction() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS cache_entries (
+                    key TEXT PRIMARY KEY,
+                    value BLOB NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_cache_expires ON cache_entries(expires_at)')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS cache_counters (
+                    key TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL
+                )
+            ''')
+
+    def get(self, key):
+        with self._pool.connection() as conn:
+            row = conn.execute(
+                'SELECT value FROM cache_entries WHERE key = ? AND expires_at > ?',
+                (_key_str(key), time.time())
+            ).fetchone()
+        return loads(row[0]) if row else None
+
+    def set(self, key, value, ttl=None):
+        with self._pool.transaction() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO cache_entries (key, value, expires_at) VALUES (?, ?, ?)',
+                (_key_str(key), dumps(value), time.time() + (ttl or self.ttl))
+            )
+            self._writes += 1
+            if self._writes % 100 == 0:
+                self._evict(conn)
+
+    def _evict(self, conn):
+        """删除过期条目，超出容量时删除最早过期的条目"""
+        conn.execute('DELETE FROM cache_entries WHERE expires_at <= ?', (time.time(),))
+        conn.execute('''
+            DELETE FROM cache_entries WHERE key IN (
+                SELECT key FROM cache_entries ORDER BY expires_at DESC LIMIT -1 OFFSET ?
+            )
+        ''', (self.max_entries,))
+
+    def delete(self, key):
+        with self._pool.transaction() as conn:
+            conn.execute('DELETE FROM cache_entries WHERE key = ?', (_key_str(key),))
+
+    def incr(self, key):
+        with self._pool.transaction() as conn:
+            conn.execute('''
+                INSERT INTO cache_counters (key, value) VALUES (?, 1)
+                ON CONFLICT(key) DO UPDATE SET value = value + 1
+            ''', (_key_str(key),))
+            return conn.execute('SELECT value FROM cache_counters WHERE key = ?', (_key_str(key),)).fetchone()[0]
+
+    def get_counter(self, key):
+        with self._pool.connection() as conn:
+            row = conn.execute('SELECT value FROM cache_counters WHERE key = ?', (_key_str(key),)).fetchone()
+        return row[0] if row else 0
+
+    def stats(self):
+        with self._pool.connection() as conn:
+            entries = conn.execute('SELECT COUNT(*) FROM cache_entries').fetchone()[0]
+        return {'backend': self.name, 'entries': entries, 'max_entries': self.max_entries}
+
+
+class RedisError(Exception):
+    """Redis 服务端返回的错误"""
+
+
+class RedisBackend(CacheBackend):
+    """Redis 协议（RESP）后端：跨机器共享；任何兼容 RESP 的服务都可以使用
+
+    每个线程持有一条独立的 socket 连接，不依赖第三方客户端库。
+    """
+
+    name = 'redis'
+
+    def __init__(self, url='redis://localhost:6379/0', ttl=CACHE_TTL, timeout=2.0):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 6379
+        self.db_index = int(parsed.path.lstrip('/') or 0)
+        self.password = parsed.password
+        self.ttl = ttl
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            conn = (sock, sock.makefile('rb'))
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+            if self.password:
+                self._command('AUTH', self.password)
+            if self.db_index:
+                self._command('SELECT', self.db_index)
+        return conn
+
+    def _command(self, *args):
+        sock, reader = self._connection()
+        parts = [f'*{len(args)}\r\n'.encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode('utf-8')
+            parts.append(b'$%d\r\n%s\r\n' % (len(data), data))
+        try:
+            sock.sendall(b''.join(parts))
+            return self._read_reply(reader)
+        except (OSError, ConnectionError):
+            # 连接失效时丢弃，下次调用重新建立
+            self._local.conn = None
+            raise
+
+    def _read_reply(self, reader):
+        line = reader.readline()
+        if not line:
+            raise ConnectionError('Redis 连接已关闭')
+        prefix, payload = line[:1], line[1:-2]
+        if prefix == b'+':
+            return payload.decode('utf-8')
+        if prefix == b'-':
+            raise RedisError(payload.decode('utf-8'))
+        if prefix == b':':
+            return int(payload)
+        if prefix == b'$':
+            length = int(payload)
+            if length < 0:
+                return None
+            data = reader.read(length + 2)
+            return data[:-2]
+        if prefix == b'*':
+            count = int(payload)
+            return None if count < 0 else [self._read_reply(reader) for _ in range(count)]
+        raise RedisError(f'无法识别的响应: {line!r}')
+
+    def get(self, key):
+        data = self._command('GET', _key_str(key))
+        return loads(data) if data is not None else None
+
+    def set(self, key, value, ttl=None):
+        self._command('SET', _key_str(key), dumps(value), 'PX', int((ttl or self.ttl) * 1000))
+
+    def delete(self, key):
+        self._command('DEL', _key_str(key))
+
+    def incr(self, key):
+        return self._command('INCR', _key_str(key))
+
+    def get_counter(self, key):
+        data = self._command('GET', _key_str(key))
+        return int(data) if data is not None else 0
+
+    def stats(self):
+        return {'backend': self.name, 'host': self.host, 'port': self.port, 'db': self.db_index}
+
+
+def create_backend(spec=CACHE_BACKEND):
+    """根据配置字符串创建后端"""
+    if spec.startswith('redis://'):
+        return RedisBackend(spec)
+    if spec.startswith('sqlite'):
+        path = spec[len('sqlite:///'):] if spec.startswith('sqlite:///') else 'schedule_cache.db'
+        return SQLiteBackend(path)
+    return MemoryBackend()
+
+
+class VersionedCache:
+    """带版本戳的缓存：键里带上所依赖标签的版本号
+
+    失效时只需把标签的版本号加一，任何 worker 之后读到的都是新版本下的键，
+    旧条目不会再被命中，等待过期即可。这也避免了“读旧数据-失效-写回旧数据”的竞态。
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def stamp(self, key, tags=()):
+        """取得带版本号的键；必须在读取数据库之前调用，回源后用同一个键写入"""
+        try:
+            versions = tuple(self.backend.get_counter(('ver',) + tuple(tag)) for tag in tags)
+        except Exception as e:
+            logger.warning(f"读取缓存版本失败: {str(e)}")
+            self.errors += 1
+            return None
+        return tuple(key) + ('v',) + versions
+
+    def get(self, stamped_key):
+        value = None
+        if stamped_key is not None:
+            try:
+                value = self.backend.get(stamped_key)
+            except Exception as e:
+                # 缓存不可用时直接回源，不影响业务
+                logger.warning(f"读取缓存失败: {str(e)}")
+                self.errors += 1
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, stamped_key, value, ttl=None):
+        if stamped_key is None:
+            return
+        try:
+            self.backend.set(stamped_key, value, ttl)
+        except Exception as e:
+            logger.warning(f"写入缓存失败: {str(e)}")
+            self.errors += 1
+
+    def get_or_compute(self, key, tags, compute, ttl=None):
+        stamped_key = self.stamp(key, tags)
+        value = self.get(stamped_key)
+        if value is None:
+            value = compute()
+            self.set(stamped_key, value, ttl)
+        return value
+
+    def invalidate_tag(self, tag):
+        try:
+            self.backend.incr(('ver',) + tuple(tag))
+        except Exception as e:
+            logger.error(f"失效缓存失败: {str(e)}")
+            self.errors += 1
+
+    def stats(self):
+        data = self.backend.stats()
+        with self._lock:
+            data.update({'hits': self.hits, 'misses': self.misses, 'errors': self.errors})
+        return data
+
+
+def month_tag(user_id, year, month):
+    return ('month', user_id, year, month)
+
+
+def months_between(start, end):
+    """start 到 end 覆盖的所有 (year, month)"""
+    year, month = start.year, start.month
+    while (year, month) <= (end.year, end.month):
+        yield year, month
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def make_etag(body):
+    return hashlib.sha1(body if isinstance(body, bytes) else body.encode('utf-8')).hexdigest()
+
+
+# 月视图、图表数据和会话状态共用同一个后端；第一次使用时才创建，导入本模块不会连接 Redis 或生成缓存文件
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def _get_shared():
+    global _shared
+    if _shared is None:
+        with _shared_lock:
+            if _shared is None:
+                backend = create_backend()
+                _shared = (backend, VersionedCache(backend))
+    return _shared
+
+
+def get_backend():
+    return _get_shared()[0]
+
+
+def get_month_cache():
+    return _get_shared()[1]
+
+
+def __getattr__(name):
+    # cache.backend / cache.month_cache 延迟到第一次访问时创建
+    if name == 'backend':
+        return get_backend()
+    if name == 'month_cache':
+        return get_month_cache()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def invalidate_event_span(user_id, start, end=None):
+    """日程写入后失效它覆盖的所有月份的缓存（start/end 为 datetime）"""
+    end = end if end is not None and end > start else start
+    month_cache = get_month_cache()
+    for year, month in months_between(start, end):
+        month_cache.invalidate_tag(month_tag(user_id, year, month))
@@ -0,0 +1,72 @@
+import time
+import logging
+
+import db
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+# 按 message_id 倒序取一页，参数为 (user_id, before_id, 条数)
+PAGE_SQL = '''
+    SELECT message_id, role, content, created_at
+    FROM ChatMessages
+    WHERE user_id = ? AND message_id < ?
+    ORDER BY message_id DESC
+    LIMIT ?
+'''
+
+
+def append(user_id, role, content):
+    """追加一条聊天记录，返回 message_id"""
+    try:
+        with db.transaction() as conn:
+            cursor = conn.execute('''
+                INSERT INTO ChatMessages (user_id, role, content, created_at)
+                VALUES (?, ?, ?, ?)
+            ''', (user_id, role, content, time.time()))
+            return cursor.lastrowid
+    except Exception as e:
+        logger.error(f"保存聊天记录失败: {str(e)}")
+        return None
+
+
+def page(user_id, before_id=None, limit=DEFAULT_PAGE_SIZE):
+    """按 message_id 倒序取一页聊天记录
+
+    返回 {'messages': [...], 'next_before': ...}；messages 按时间从早到晚排列，
+    next_before 传给下一次调用可以继续取更早的记录，没有更多记录时为 None。
+    """
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    try:
+        with db.connection() as conn:
+            rows = conn.execute(PAGE_SQL, (user_id, before_id if before_id is not None else 1 << 62, limit + 1)).fetchall()
+    except Exception as e:
+        logger.error(f"读取聊天记录失败: {str(e)}")
+        return {'messages': [], 'next_before': None}
+
+    # 多取一条用来判断是否还有更早的记录
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    messages = [{
+        'id': row[0],
+        'role': row[1],
+        'content': row[2],
+        'created_at': row[3]
+    } for row in reversed(rows)]
+    return {
+        'messages': messages,
+        'next_before': messages[0]['id'] if has_more else None
+    }
+
+
+def clear(user_id):
+    """删除用户的全部聊天记录（走 idx_chat_messages_user 索引）"""
+    try:
+        with db.transaction() as conn:
+            return conn.execute('DELETE FROM ChatMessages WHERE user_id = ?', (user_id,)).rowcount
+    except Exception as e:
+        logger.error(f"清除聊天记录失败: {str(e)}")
+        return 0
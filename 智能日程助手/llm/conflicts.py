@@ -0,0 +1,95 @@
+import logging
+from datetime import datetime
+
+import db
+from time_range import TIME_FORMAT
+
+logger = logging.getLogger(__name__)
+
+# 时间冲突检测：EventSpans 是 Events 的 R*Tree 索引（rtree_i32），
+# 两个维度分别是 user_id 和以分钟计的 [开始, 结束] 区间，由触发器与 Events 保持同步。
+# “哪些日程与 [start, end) 重叠”因此是 O(log n + k) 的范围查找，而不是逐条扫描。
+#
+# 分钟数以 1900-01-01 为起点，保证为正数且在 32 位整数范围内。开始时间向下取整、
+# 结束时间多加一分钟，R*Tree 只做保守的粗筛，精确的重叠判断仍按 Events 上的原始时间比较。
+
+_EPOCH = datetime(1900, 1, 1)
+_EPOCH_JULIANDAY = 2415020.5
+
+MAX_CONFLICTS = 5
+
+
+def minutes_sql(column):
+    """SQL 表达式：把时间列换算为分钟数（向下取整）"""
+    return f"CAST((julianday({column}) - {_EPOCH_JULIANDAY}) * 1440 AS INTEGER)"
+
+
+def span_values_sql(prefix):
+    """触发器和回填中写入 EventSpans 的 (id, user_min, user_max, start_min, end_min)"""
+    start = f"COALESCE({minutes_sql(f'{prefix}start_time')}, 0)"
+    end = f"COALESCE({minutes_sql(f'{prefix}end_time')}, 0) + 1"
+    return f"{prefix}event_id, {prefix}user_id, {prefix}user_id, {start}, max({start}, {end})"
+
+
+def to_minutes(value):
+    if not isinstance(value, datetime):
+        value = datetime.strptime(str(value), TIME_FORMAT)
+    return int((value - _EPOCH).total_seconds() // 60)
+
+
+OVERLAP_SQL = '''
+    SELECT e.event_id, e.title, e.start_time, e.end_time, e.location
+    FROM EventSpans s
+    JOIN Events e ON e.event_id = s.id
+    WHERE s.user_min <= ? AND s.user_max >= ?
+      AND s.start_min < ? AND s.end_min > ?
+      AND e.start_time < ? AND e.end_time > ?
+      AND e.event_id != ?
+    ORDER BY e.start_time
+    LIMIT ?
+'''
+
+
+def overlap_params(user_id, start, end, exclude_id=None, limit=MAX_CONFLICTS):
+    start_str = start.strftime(TIME_FORMAT) if isinstance(start, datetime) else str(start)
+    end_str = end.strftime(TIME_FORMAT) if isinstance(end, datetime) else str(end)
+    return (
+        user_id, user_id,
+        to_minutes(end) + 1, to_minutes(start) - 1,
+        end_str, start_str,
+        exclude_id if exclude_id is not None else -1,
+        limit
+    )
+
+
+def find_overlaps(user_id, start, end, exclude_id=None, limit=MAX_CONFLICTS):
+    """返回与 [start, end) 重叠的日程 (event_id, title, start_time, end_time, location)
+
+    exclude_id 用于修改日程时排除它自己；出错时返回空列表，不影响保存。
+    """
+    try:
+        with db.connection() as conn:
+            return conn.execute(OVERLAP_SQL, overlap_params(user_id, start, end, exclude_id, limit)).fetchall()
+    except Exception as e:
+        logger.error(f"检测日程冲突时出错: {str(e)}")
+        return []
+
+
+def _display_time(value, fmt):
+    """按 fmt 显示保存的时间；旧数据中无法解析的格式原样显示"""
+    try:
+        return datetime.fromisoformat(value).strftime(fmt)
+    except (TypeError, ValueError):
+        return str(value)
+
+
+def format_warning(overlaps):
+    """冲突提示文本，没有冲突时返回空字符串"""
+    if not overlaps:
+        return ''
+    lines = ["\n⚠️ 与以下日程时间冲突："]
+    for _, title, start_time, end_time, _ in overlaps:
+        start = _display_time(start_time, '%m-%d %H:%M')
+        end = _display_time(end_time, '%H:%M')
+        lines.append(f"- {title} ({start} - {end})")
+    return '\n'.join(lines)
@@ -0,0 +1,113 @@
+import os
+import time
+import logging
+
+import db
+import cache
+
+logger = logging.getLogger(__name__)
+
+# 每个用户放进提示词的最近对话轮数，以及这些对话的总字数上限
+MEMORY_WINDOW = int(os.getenv("SCHEDULE_MEMORY_WINDOW", "6"))
+MEMORY_MAX_CHARS = int(os.getenv("SCHEDULE_MEMORY_MAX_CHARS", "2000"))
+# 超过该时间没有对话的用户，其窗口从缓存后端淘汰；更早的对话不再放入提示词
+MEMORY_IDLE_TTL = float(os.getenv("SCHEDULE_MEMORY_IDLE_TTL", "1800"))
+MEMORY_MAX_AGE = float(os.getenv("SCHEDULE_MEMORY_MAX_AGE", str(7 * 24 * 3600)))
+
+# 最近的若干轮对话（倒序），参数为 (user_id, 最早时间戳, 轮数)
+WINDOW_SQL = '''
+    SELECT human, ai
+    FROM ConversationTurns
+    WHERE user_id = ? AND created_at > ?
+    ORDER BY turn_id DESC
+    LIMIT ?
+'''
+
+
+class ConversationMemoryStore:
+    """按用户隔离的滑动窗口对话记忆
+
+    每个用户只保留最近 MEMORY_WINDOW 轮对话并持久化在 ConversationTurns 表中，
+    提示词长度不随服务运行时间增长；活跃用户的窗口缓存在共享缓存后端中
+    （与会话状态相同，多个 worker 之间一致），空闲 idle_ttl 秒后淘汰。
+    """
+
+    def __init__(self, window=MEMORY_WINDOW, max_chars=MEMORY_MAX_CHARS,
+                 idle_ttl=MEMORY_IDLE_TTL, max_age=MEMORY_MAX_AGE, backend=None):
+        self.window = window
+        self.max_chars = max_chars
+        self.idle_ttl = idle_ttl
+        self.max_age = max_age
+        self.backend = backend or cache.backend
+
+    def _get_cached(self, user_id):
+        try:
+            return self.backend.get(('memory', user_id))
+        except Exception as e:
+            logger.warning(f"读取对话记忆缓存失败: {str(e)}")
+            return None
+
+    def _set_cached(self, user_id, turns):
+        try:
+            if turns is None:
+                self.backend.delete(('memory', user_id))
+            else:
+                self.backend.set(('memory', user_id), turns, self.idle_ttl)
+        except Exception as e:
+            logger.warning(f"写入对话记忆缓存失败: {str(e)}")
+
+    def load(self, user_id):
+        """返回用户最近的对话 [(human, ai), ...]，按时间从早到晚排列"""
+        turns = self._get_cached(user_id)
+        if turns is not None:
+            return turns
+        try:
+            with db.connection() as conn:
+                rows = conn.execute(WINDOW_SQL, (user_id, time.time() - self.max_age, self.window)).fetchall()
+        except Exception as e:
+            logger.error(f"读取对话记忆失败: {str(e)}")
+            return []
+        turns = [(row[0], row[1]) for row in reversed(rows)]
+        self._set_cached(user_id, turns)
+        return turns
+
+    def history_text(self, user_id):
+        """格式化为提示词中的对话历史，超出字数上限时丢弃最早的轮次"""
+        lines = []
+        total = 0
+        for human, ai in reversed(self.load(user_id)):
+            turn = f"Human: {human}\nAI: {ai}"
+            if lines and total + len(turn) > self.max_chars:
+                break
+            lines.append(turn)
+            total += len(turn)
+        return '\n'.join(reversed(lines))
+
+    def append(self, user_id, human, ai):
+        """保存一轮对话，并删除窗口之外的旧对话；缓存的窗口随之失效，下次从数据库重新读取"""
+        try:
+            with db.transaction() as conn:
+                conn.execute('''
+                    INSERT INTO ConversationTurns (user_id, human, ai, created_at)
+                    VALUES (?, ?, ?, ?)
+                ''', (user_id, human, ai, time.time()))
+                conn.execute('''
+                    DELETE FROM ConversationTurns
+                    WHERE user_id = ? AND turn_id <= (
+                        SELECT turn_id FROM ConversationTurns
+                        WHERE user_id = ?
+                        ORDER BY turn_id DESC
+                        LIMIT 1 OFFSET ?
+                    )
+                ''', (user_id, user_id, self.window))
+        except Exception as e:
+            logger.error(f"保存对话记忆失败: {str(e)}")
+        self._set_cached(user_id, None)
+
+    def clear(self, user_id):
+        self._set_cached(user_id, None)
+        try:
+            with db.transaction() as conn:
+                conn.execute('DELETE FROM ConversationTurns WHERE user_id = ?', (user_id,))
+        except Exception as e:
+            logger.error(f"清除对话记忆失败: {str(e)}")
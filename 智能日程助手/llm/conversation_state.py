@@ -0,0 +1,155 @@
+import os
+import time
+import threading
+import logging
+from collections import OrderedDict
+
+import cache
+
+logger = logging.getLogger(__name__)
+
+STATE_TTL = float(os.getenv("SCHEDULE_STATE_TTL", "1800"))
+STATE_MAX_ENTRIES = int(os.getenv("SCHEDULE_STATE_MAX_ENTRIES", "10000"))
+STATE_STRIPES = 16
+
+
+class PendingSelection:
+    """一个用户待确认的删除/修改操作：只保存日程 ID，不保存整行数据"""
+
+    __slots__ = ('operation', 'event_ids', 'selected_id', 'expires_at')
+
+    def __init__(self, operation, event_ids, selected_id=None, expires_at=0.0):
+        self.operation = operation
+        self.event_ids = tuple(event_ids)
+        self.selected_id = selected_id
+        self.expires_at = expires_at
+
+    def to_tuple(self):
+        return (self.operation, self.event_ids, self.selected_id, self.expires_at)
+
+    @classmethod
+    def from_tuple(cls, data):
+        return cls(*data)
+
+
+class _Stripe:
+    __slots__ = ('lock', 'entries')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()   # user_id -> PendingSelection，按写入顺序排列
+
+
+class ConversationStateStore:
+    """多轮操作的会话状态，带过期时间和容量上限
+
+    单进程部署时状态保存在本进程：按 user_id 分成 STATE_STRIPES 段，每段一把锁，
+    不同用户的读写互不阻塞；每段各自按写入顺序淘汰最早的条目。
+    配置了共享缓存后端（sqlite/redis）时，条目序列化为元组存入后端，多个 worker 共享。
+    """
+
+    def __init__(self, ttl=STATE_TTL, max_entries=STATE_MAX_ENTRIES, backend=None, stripes=STATE_STRIPES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.backend = backend if backend is not None else cache.backend
+        self.shared = not isinstance(self.backend, cache.MemoryBackend)
+        self._stripes = [_Stripe() for _ in range(stripes)]
+        self._per_stripe = max(1, max_entries // stripes)
+        self._metrics_lock = threading.Lock()
+        self.expired = 0
+        self.evicted = 0
+
+    def _stripe(self, user_id):
+        return self._stripes[hash(user_id) % len(self._stripes)]
+
+    def get(self, user_id):
+        """返回用户未过期的 PendingSelection，没有时返回 None"""
+        now = time.time()
+        if self.shared:
+            try:
+                data = self.backend.get(('state', user_id))
+            except Exception as e:
+                logger.error(f"读取会话状态失败: {str(e)}")
+                return None
+            entry = PendingSelection.from_tuple(data) if data else None
+            return entry if entry and entry.expires_at > now else None
+
+        stripe = self._stripe(user_id)
+        with stripe.lock:
+            entry = stripe.entries.get(user_id)
+            if entry is None:
+                return None
+            if entry.expires_at > now:
+                return entry
+            del stripe.entries[user_id]
+        self._count(expired=1)
+        return None
+
+    def set(self, user_id, operation, event_ids, selected_id=None):
+        now = time.time()
+        entry = PendingSelection(operation, event_ids, selected_id, now + self.ttl)
+        if self.shared:
+            try:
+                self.backend.set(('state', user_id), entry.to_tuple(), self.ttl)
+            except Exception as e:
+                logger.error(f"保存会话状态失败: {str(e)}")
+            return entry
+
+        stripe = self._stripe(user_id)
+        expired = evicted = 0
+        with stripe.lock:
+            stripe.entries.pop(user_id, None)
+            stripe.entries[user_id] = entry
+            # 段内条目按写入顺序排列且 TTL 相同，过期的一定在最前面
+            while stripe.entries:
+                oldest = next(iter(stripe.entries.values()))
+                if oldest.expires_at > now:
+                    break
+                stripe.entries.popitem(last=False)
+                expired += 1
+            while len(stripe.entries) > self._per_stripe:
+                stripe.entries.popitem(last=False)
+                evicted += 1
+        if expired or evicted:
+            self._count(expired=expired, evicted=evicted)
+        return entry
+
+    def select(self, user_id, event_id):
+        """记录用户选中了哪个日程（用于接下来的修改），保留原有的候选列表"""
+        entry = self.get(user_id)
+        operation, event_ids = (entry.operation, entry.event_ids) if entry else ('modify', (event_id,))
+        return self.set(user_id, operation, event_ids, selected_id=event_id)
+
+    def clear(self, user_id):
+        if self.shared:
+            try:
+                self.backend.delete(('state', user_id))
+            except Exception as e:
+                logger.error(f"清除会话状态失败: {str(e)}")
+            return
+        stripe = self._stripe(user_id)
+        with stripe.lock:
+            stripe.entries.pop(user_id, None)
+
+    def _count(self, expired=0, evicted=0):
+        with self._metrics_lock:
+            self.expired += expired
+            self.evicted += evicted
+
+    def stats(self):
+        """仪表盘指标：当前会话数（共享后端时无法在本进程统计）、过期和淘汰次数"""
+        live = None
+        if not self.shared:
+            live = 0
+            for stripe in self._stripes:
+                with stripe.lock:
+                    live += len(stripe.entries)
+        with self._metrics_lock:
+            return {
+                'backend': self.backend.name,
+                'live_sessions': live,
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'expired': self.expired,
+                'evicted': self.evicted,
+            }
@@ -0,0 +1,231 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = os.getenv("SCHEDULE_DB_PATH", "schedule_manager.db")
+POOL_SIZE = int(os.getenv("SCHEDULE_DB_POOL_SIZE", "8"))
+POOL_TIMEOUT = float(os.getenv("SCHEDULE_DB_POOL_TIMEOUT", "10"))
+# 连接最长存活时间（秒），超过后归还时关闭并重建
+CONNECTION_MAX_LIFETIME = float(os.getenv("SCHEDULE_DB_CONN_LIFETIME", "3600"))
+# 每个连接缓存的预编译语句数量，SQL 文本相同即可复用
+STATEMENT_CACHE_SIZE = 256
+# 每个新连接执行的 PRAGMA；journal_mode=WAL 是持久设置，由 migrations 负责开启
+CONNECTION_PRAGMAS = (
+    ('synchronous', 'NORMAL'),   # WAL 模式下 NORMAL 足够安全，且避免每次提交都 fsync
+    ('cache_size', '-16000'),    # 页缓存约 16MB（负数表示 KB）
+    ('mmap_size', '67108864'),   # 64MB 内存映射读取
+    ('temp_store', 'MEMORY'),
+)
+
+
+class PoolTimeout(Exception):
+    """在等待时间内没有可用连接"""
+
+
+class PoolMetrics:
+    """连接池运行指标：借出次数、等待时间、连接存活时间"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self.connections_created = 0
+        self.connections_closed = 0
+        self.lifetime_total = 0.0
+        self.lifetime_max = 0.0
+
+    def record_checkout(self, waited):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_time_total += waited
+            self.wait_time_max = max(self.wait_time_max, waited)
+
+    def record_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def record_created(self):
+        with self._lock:
+            self.connections_created += 1
+
+    def record_closed(self, lifetime):
+        with self._lock:
+            self.connections_closed += 1
+            self.lifetime_total += lifetime
+            self.lifetime_max = max(self.lifetime_max, lifetime)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'wait_time_total_ms': round(self.wait_time_total * 1000, 3),
+                'wait_time_avg_ms': round(self.wait_time_total * 1000 / self.checkouts, 3) if self.checkouts else 0.0,
+                'wait_time_max_ms': round(self.wait_time_max * 1000, 3),
+                'connections_created': self.connections_created,
+                'connections_closed': self.connections_closed,
+                'lifetime_avg_s': round(self.lifetime_total / self.connections_closed, 3) if self.connections_closed else 0.0,
+                'lifetime_max_s': round(self.lifetime_max, 3),
+            }
+
+
+class ConnectionPool:
+    """有上限的 SQLite 连接池
+
+    - 每个连接同一时间只借给一个线程；同一线程嵌套借用时复用已借出的连接
+    - 连接在进程内复用，语句缓存随连接保留，避免反复建连和解析 schema
+    - fork 出的新 worker 进程会丢弃继承来的连接，重新建立自己的池
+    """
+
+    def __init__(self, db_path=DB_PATH, max_size=POOL_SIZE, timeout=POOL_TIMEOUT,
+                 max_lifetime=CONNECTION_MAX_LIFETIME):
+        self.db_path = db_path
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.metrics = PoolMetrics()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.max_size)
+        self._created_at = {}
+        self._local = threading.local()
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.timeout,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE
+        )
+        conn.row_factory = sqlite3.Row
+        for name, value in CONNECTION_PRAGMAS:
+            conn.execute(f'PRAGMA {name}={value}')
+        self._created_at[id(conn)] = time.monotonic()
+        self.metrics.record_created()
+        return conn
+
+    def _close(self, conn):
+        created = self._created_at.pop(id(conn), time.monotonic())
+        self.metrics.record_closed(time.monotonic() - created)
+        try:
+            conn.close()
+        except sqlite3.Error as e:
+            logger.warning(f"关闭数据库连接时出错: {str(e)}")
+
+    def _acquire(self):
+        if os.getpid() != self._pid:
+            # 继承自父进程的连接不能跨进程使用
+            self._reset()
+
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            self.metrics.record_timeout()
+            raise PoolTimeout(f"等待数据库连接超过 {self.timeout} 秒")
+        self.metrics.record_checkout(time.monotonic() - started)
+
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            return self._connect()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _release(self, conn):
+        try:
+            if conn.in_transaction:
+                # 借用方未提交的事务一律回滚，避免脏状态带给下一个使用者
+                conn.rollback()
+            age = time.monotonic() - self._created_at.get(id(conn), time.monotonic())
+            if self.max_lifetime and age > self.max_lifetime:
+                self._close(conn)
+            else:
+                self._idle.put(conn)
+        except sqlite3.Error:
+            self._close(conn)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """借出一个连接，退出上下文时归还"""
+        held = getattr(self._local, 'conn', None)
+        if held is not None and self._local.pid == os.getpid():
+            self._local.depth += 1
+            try:
+                yield held
+            finally:
+                self._local.depth -= 1
+            return
+
+        conn = self._acquire()
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        self._local.depth = 1
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            self._release(conn)
+
+    @contextmanager
+    def transaction(self):
+        """借出连接并在一个事务内执行，正常退出提交，异常回滚"""
+        with self.connection() as conn:
+            if getattr(self._local, 'in_tx', False):
+                # 嵌套在外层事务中，由外层负责提交
+                yield conn
+                return
+            self._local.in_tx = True
+            try:
+                yield conn
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                self._local.in_tx = False
+
+    def stats(self):
+        data = self.metrics.snapshot()
+        data.update({
+            'max_size': self.max_size,
+            'idle': self._idle.qsize(),
+            'open': len(self._created_at),
+        })
+        return data
+
+    def close_all(self):
+        """关闭所有空闲连接（用于测试或进程退出）"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._close(conn)
+
+
+pool = ConnectionPool()
+
+
+def connection():
+    """从全局连接池借出连接"""
+    return pool.connection()
+
+
+def transaction():
+    """从全局连接池借出连接并开启事务"""
+    return pool.transaction()
@@ -0,0 +1,124 @@
+import json
+import base64
+
+import db
+import fts
+import json_stream
+from event_record import EventRecord, decode_time
+from time_range import RANGE_PREDICATE
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# 没有指定范围时的上下界；时间字符串按字典序比较
+_MIN_TIME = ''
+_MAX_TIME = '9999-12-31 23:59:59'
+
+
+# 参数为 (user_id, 下界, 上界, 上一页最后的开始时间, 上一页最后的 event_id[, MATCH 表达式], 页大小 + 1)
+_PAGE_SELECT = f'''
+    SELECT event_id, title, start_time, end_time, location, description
+    FROM Events
+    WHERE user_id = ? AND {RANGE_PREDICATE}
+      AND (start_time > ? OR event_id > ?)
+'''
+_PAGE_ORDER = '''
+    ORDER BY start_time, event_id
+    LIMIT ?
+'''
+PAGE_SQL = _PAGE_SELECT + _PAGE_ORDER
+PAGE_MATCH_SQL = (_PAGE_SELECT
+                  + '      AND event_id IN (SELECT rowid FROM EventsFts WHERE EventsFts MATCH ?)\n'
+                  + _PAGE_ORDER)
+
+
+def encode_cursor(start_time, event_id):
+    """把一页最后一条日程的 (start_time, event_id) 编码为不透明的游标"""
+    raw = f"{start_time}|{int(event_id)}".encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """解析游标，格式错误时抛出 ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode('utf-8')
+        start_time, event_id = raw.rsplit('|', 1)
+        decode_time(start_time)
+        return start_time, int(event_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"无效的游标：{token}") from e
+
+
+def fetch(user_id, cursor=None, limit=DEFAULT_PAGE_SIZE, start=None, end=None, keywords=None):
+    """按 (start_time, event_id) 键集分页读取一页日程
+
+    cursor 为上一页返回的 next_cursor；start/end 为存储格式的时间，限定 [start, end)；
+    keywords 非空时只返回全文索引命中的日程。返回 (rows, next_cursor)，
+    rows 的字段与 get_event 相同，没有更多数据时 next_cursor 为 None。
+    每页都从索引上的游标位置开始读取，耗时与用户的日程总数无关。
+    """
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    last_start, last_id = decode_cursor(cursor) if cursor else (_MIN_TIME, 0)
+    lower = max(last_start, start or _MIN_TIME)
+    upper = end or _MAX_TIME
+
+    sql = PAGE_SQL
+    params = [user_id, lower, upper, last_start, last_id]
+    if keywords:
+        match = fts.match_query(user_id, keywords)
+        if not match:
+            return [], None
+        sql = PAGE_MATCH_SQL
+        params.append(match)
+    # 多取一条用来判断是否还有下一页
+    params.append(limit + 1)
+
+    with db.connection() as conn:
+        rows = conn.execute(sql, params).fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = encode_cursor(rows[-1][2], rows[-1][0]) if has_more else None
+    return rows, next_cursor
+
+
+def iter_json(rows, next_cursor, chunk_rows=50):
+    """把一页结果逐段编码为 JSON：{"events": [...], "next_cursor": ...}"""
+    yield '{"events": ['
+    for index in range(0, len(rows), chunk_rows):
+        chunk = ', '.join(json_stream.dumps(EventRecord.from_event_row(row).to_json())
+                          for row in rows[index:index + chunk_rows])
+        yield (', ' if index else '') + chunk
+    yield f'], "next_cursor": {json.dumps(next_cursor)}}}'
+
+
+def benchmark(user_id, limit=DEFAULT_PAGE_SIZE):
+    """逐页读取用户的全部日程，返回页数以及第一页、最后一页和最慢一页的耗时（毫秒）"""
+    import time
+
+    timings = []
+    total = 0
+    cursor = None
+    while True:
+        began = time.perf_counter()
+        rows, cursor = fetch(user_id, cursor, limit)
+        timings.append((time.perf_counter() - began) * 1000)
+        total += len(rows)
+        if cursor is None:
+            break
+    return {
+        'events': total,
+        'pages': len(timings),
+        'first_page_ms': round(timings[0], 3),
+        'last_page_ms': round(timings[-1], 3),
+        'max_page_ms': round(max(timings), 3),
+    }
+
+
+if __name__ == '__main__':
+    # python event_pages.py <user_id>：在 SCHEDULE_DB_PATH 指向的数据库上测量各页耗时
+    import sys
+
+    if len(sys.argv) != 2:
+        print("用法: python event_pages.py <user_id>")
+        sys.exit(1)
+    print(benchmark(int(sys.argv[1])))
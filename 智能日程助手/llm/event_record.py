@@ -0,0 +1,86 @@
+from datetime import datetime
+
+
+# Events 表的时间列是定长字符串 'YYYY-MM-DD HH:MM:SS'（见 time_range.TIME_FORMAT），
+# 因此显示用的日期、时刻直接按位置切片，不需要 strptime 解析再 strftime 格式化。
+
+def minute_text(value):
+    """'2026-01-05 09:30:00' -> '2026-01-05 09:30'"""
+    return value[:16]
+
+
+def clock_text(value):
+    """'2026-01-05 09:30:00' -> '09:30'"""
+    return value[11:16]
+
+
+def decode_time(value):
+    """把存储格式的时间解码为 datetime；fromisoformat 比 strptime 快一个数量级"""
+    return datetime.fromisoformat(value)
+
+
+def to_fullcalendar(row):
+    """(event_id, title, start_time, end_time, location, description, is_all_day) -> FullCalendar 事件对象
+
+    时间直接由存储格式改写为 ISO 8601，不经过 datetime；全天日程只保留日期部分。
+    """
+    event_id, title, start_time, end_time, location, description, is_all_day = row
+    if is_all_day:
+        start, end = start_time[:10], end_time[:10]
+    else:
+        start, end = start_time.replace(' ', 'T'), end_time.replace(' ', 'T')
+    return {
+        'id': event_id,
+        'title': title,
+        'start': start,
+        'end': end,
+        'allDay': bool(is_all_day),
+        'extendedProps': {'location': location, 'description': description}
+    }
+
+
+class EventRecord:
+    """一条日程，在数据库边界解码一次
+
+    start_time/end_time 保留存储格式的字符串，直接用于 JSON 输出和回复文本；
+    start/end 是解码后的 datetime，用于按天分桶等需要计算的地方。
+    """
+
+    __slots__ = ('id', 'title', 'start_time', 'end_time', 'location', 'description', 'start', 'end')
+
+    def __init__(self, title, start_time, end_time, location, description, id=None):
+        self.id = id
+        self.title = title
+        self.start_time = start_time
+        self.end_time = end_time
+        self.location = location
+        self.description = description
+        self.start = decode_time(start_time)
+        self.end = decode_time(end_time)
+
+    @classmethod
+    def from_row(cls, row):
+        """query_events 形状的行：(title, start_time, end_time, location, description)"""
+        return cls(row[0], row[1], row[2], row[3], row[4])
+
+    @classmethod
+    def from_event_row(cls, row):
+        """get_event 形状的行：(event_id, title, start_time, end_time, location, description)"""
+        return cls(row[1], row[2], row[3], row[4], row[5], id=row[0])
+
+    def to_json(self):
+        return {
+            'id': self.id,
+            'title': self.title,
+            'start_time': self.start_time,
+            'end_time': self.end_time,
+            'location': self.location,
+            'description': self.description
+        }
+
+    def __repr__(self):
+        return f"EventRecord({self.title!r}, {self.start_time!r}, {self.end_time!r})"
+
+
+def from_rows(rows):
+    return [EventRecord.from_row(row) for row in rows]
@@ -0,0 +1,84 @@
+import os
+import time
+import random
+import threading
+
+
+# 本地模拟的大模型：不访问 DashScope，按配置注入延迟和错误，
+# 用于在没有 API Key 的环境中运行，以及对 llm_gateway 做压力测试。
+# 设置 SCHEDULE_LLM_BACKEND=fake 后 ScheduleManager 使用它代替 ChatTongyi。
+
+FAKE_LATENCY = float(os.getenv("SCHEDULE_FAKE_LLM_LATENCY", "0.2"))
+FAKE_JITTER = float(os.getenv("SCHEDULE_FAKE_LLM_JITTER", "0.1"))
+FAKE_ERROR_RATE = float(os.getenv("SCHEDULE_FAKE_LLM_ERROR_RATE", "0"))
+
+
+class FakeMessage:
+    __slots__ = ('content',)
+
+    def __init__(self, content):
+        self.content = content
+
+
+class FakeLLMError(RuntimeError):
+    """模拟的上游错误（例如 DashScope 返回 5xx）"""
+
+
+class FakeLLM:
+    """与 ChatTongyi 相同的 invoke/stream 接口
+
+    latency/jitter 以秒计；error_rate 为随机失败的比例；
+    reply 可以是字符串或 prompt -> 字符串的函数。运行时可以直接修改这些属性来模拟上游变慢或故障。
+    """
+
+    def __init__(self, latency=FAKE_LATENCY, jitter=FAKE_JITTER, error_rate=FAKE_ERROR_RATE, reply=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.reply = reply
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def _respond(self, prompt):
+        if callable(self.reply):
+            return self.reply(prompt)
+        if self.reply is not None:
+            return self.reply
+        if '仅返回 JSON' in prompt:
+            return '{"is_schedule": false, "events": []}'
+        return "（本地模拟回复）好的，我已经了解了。"
+
+    def _enter(self):
+        with self._lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def _exit(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def _delay(self):
+        time.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+        if self.error_rate and random.random() < self.error_rate:
+            raise FakeLLMError("模拟的上游错误")
+
+    def invoke(self, prompt):
+        self._enter()
+        try:
+            self._delay()
+            return FakeMessage(self._respond(str(prompt)))
+        finally:
+            self._exit()
+
+    def stream(self, prompt):
+        self._enter()
+        try:
+            self._delay()
+            text = self._respond(str(prompt))
+            for start in range(0, len(text), 8):
+                yield FakeMessage(text[start:start + 8])
+        finally:
+            self._exit()
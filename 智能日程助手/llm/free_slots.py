@@ -0,0 +1,219 @@
+import os
+import time
+import logging
+from datetime import datetime, timedelta
+
+import db
+import recurrence
+from time_range import TIME_FORMAT, MAX_EVENT_SPAN_DAYS, days_range
+
+logger = logging.getLogger(__name__)
+
+# 默认只在工作时间内找空闲，格式 "HH:MM-HH:MM"；空闲时段短于 MIN_SLOT_MINUTES 的不返回
+WORK_HOURS = os.getenv("SCHEDULE_WORK_HOURS", "09:00-18:00")
+MIN_SLOT_MINUTES = int(os.getenv("SCHEDULE_MIN_SLOT_MINUTES", "30"))
+# 单次查询最多覆盖的天数
+MAX_RANGE_DAYS = 31
+
+# 消息中的时段词对应的时间窗口，优先于工作时间
+PERIOD_HOURS = {
+    '上午': ((6, 0), (12, 0)),
+    '早上': ((6, 0), (12, 0)),
+    '中午': ((11, 0), (14, 0)),
+    '下午': ((12, 0), (18, 0)),
+    '晚上': ((18, 0), (23, 0)),
+}
+
+
+def parse_hours(spec):
+    """把 "09:00-18:00" 解析为 ((9, 0), (18, 0))；格式错误时抛出 ValueError"""
+    start, end = spec.split('-')
+    start = tuple(int(part) for part in start.strip().split(':'))
+    end = tuple(int(part) for part in end.strip().split(':'))
+    if len(start) != 2 or len(end) != 2 or not (0, 0) <= start < end <= (24, 0):
+        raise ValueError(f"无效的时间范围：{spec}")
+    return start, end
+
+
+def _at(day, hour_minute):
+    hour, minute = hour_minute
+    return datetime(day.year, day.month, day.day) + timedelta(hours=hour, minutes=minute)
+
+
+def merge_intervals(intervals):
+    """扫描线合并：intervals 需按开始时间排序，重叠或首尾相接的区间合并为一个"""
+    merged = []
+    for start, end in intervals:
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def gaps(busy, window_start, window_end, min_length):
+    """在 [window_start, window_end) 内取出 busy（已合并、有序）之间不短于 min_length 的空隙"""
+    slots = []
+    cursor = window_start
+    for start, end in busy:
+        if end <= cursor:
+            continue
+        if start >= window_end:
+            break
+        if start - cursor >= min_length:
+            slots.append((cursor, start))
+        cursor = max(cursor, end)
+        if cursor >= window_end:
+            return slots
+    if window_end - cursor >= min_length:
+        slots.append((cursor, window_end))
+    return slots
+
+
+def busy_intervals_sql(user_count):
+    """多个用户的忙碌区间，参数为 (*user_ids, 回看起点, 范围结束, 范围开始)"""
+    placeholders = ', '.join('?' * user_count)
+    return f'''
+        SELECT user_id, start_time, end_time
+        FROM Events
+        WHERE user_id IN ({placeholders})
+          AND start_time >= ? AND start_time < ? AND end_time > ?
+        ORDER BY user_id, start_time
+    '''
+
+
+def busy_intervals(user_ids, first_day, last_day):
+    """一次查询取出多个用户在 [first_day, last_day] 内的忙碌区间，返回 {user_id: [(start, end), ...]}
+
+    区间按开始时间排序，包括重复日程在范围内的各次发生；
+    往前多看 MAX_EVENT_SPAN_DAYS 天以包含之前开始、延续到范围内的日程。
+    """
+    user_ids = list(dict.fromkeys(user_ids))
+    busy = {user_id: [] for user_id in user_ids}
+    if not user_ids:
+        return busy
+    range_start, range_end = days_range(first_day, last_day)
+    lookback = (datetime.strptime(range_start, TIME_FORMAT) - timedelta(days=MAX_EVENT_SPAN_DAYS)).strftime(TIME_FORMAT)
+    with db.connection() as conn:
+        rows = conn.execute(busy_intervals_sql(len(user_ids)),
+                            (*user_ids, lookback, range_end, range_start)).fetchall()
+        # 重复日程在范围内的各次发生同样算忙碌
+        occurrences = [(user_id, row[1], row[2])
+                       for user_id in user_ids
+                       for row in recurrence.expand(user_id, range_start, range_end, conn)]
+    if occurrences:
+        rows = sorted(list(rows) + occurrences, key=lambda row: (row[0], row[1]))
+    for user_id, start_time, end_time in rows:
+        busy[user_id].append((datetime.strptime(start_time, TIME_FORMAT), datetime.strptime(end_time, TIME_FORMAT)))
+    return busy
+
+
+def _windows(first_day, last_day, hours, now):
+    """每天的查询窗口 [(day, start, end)]，已经过去的时间不算空闲"""
+    windows = []
+    day = first_day
+    while day <= last_day:
+        start, end = _at(day, hours[0]), _at(day, hours[1])
+        if now is not None and start < now:
+            start = now.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        if start < end:
+            windows.append((day, start, end))
+        day += timedelta(days=1)
+    return windows
+
+
+def _normalize_args(first_day, last_day, hours, min_minutes):
+    if isinstance(first_day, datetime):
+        first_day = first_day.date()
+    last_day = last_day or first_day
+    if isinstance(last_day, datetime):
+        last_day = last_day.date()
+    if last_day < first_day:
+        raise ValueError("结束日期不能早于开始日期")
+    if (last_day - first_day).days >= MAX_RANGE_DAYS:
+        raise ValueError(f"查询范围不能超过 {MAX_RANGE_DAYS} 天")
+    hours = hours or parse_hours(WORK_HOURS)
+    min_length = timedelta(minutes=min_minutes if min_minutes is not None else MIN_SLOT_MINUTES)
+    return first_day, last_day, hours, min_length
+
+
+def find_free_slots(user_ids, first_day, last_day=None, hours=None, min_minutes=None, now=None):
+    """批量计算多个用户在若干天内的空闲时段
+
+    hours 为每天的时间窗口 ((时, 分), (时, 分))，默认工作时间；now 之前的时间不计入。
+    返回 {user_id: [(day, start, end), ...]}，时段按时间排序。
+    """
+    first_day, last_day, hours, min_length = _normalize_args(first_day, last_day, hours, min_minutes)
+    busy = busy_intervals(user_ids, first_day, last_day)
+    windows = _windows(first_day, last_day, hours, now)
+    result = {}
+    for user_id, intervals in busy.items():
+        merged = merge_intervals(intervals)
+        result[user_id] = [(day, start, end)
+                           for day, window_start, window_end in windows
+                           for start, end in gaps(merged, window_start, window_end, min_length)]
+    return result
+
+
+def find_common_free_slots(user_ids, first_day, last_day=None, hours=None, min_minutes=None, now=None):
+    """所有用户都空闲的时段：把各用户的忙碌区间合在一起做一次扫描线合并"""
+    first_day, last_day, hours, min_length = _normalize_args(first_day, last_day, hours, min_minutes)
+    busy = busy_intervals(user_ids, first_day, last_day)
+    merged = merge_intervals(sorted(interval for intervals in busy.values() for interval in intervals))
+    return [(day, start, end)
+            for day, window_start, window_end in _windows(first_day, last_day, hours, now)
+            for start, end in gaps(merged, window_start, window_end, min_length)]
+
+
+def to_json(slots):
+    return [{
+        'date': day.isoformat(),
+        'start': start.strftime(TIME_FORMAT),
+        'end': end.strftime(TIME_FORMAT),
+        'minutes': int((end - start).total_seconds() // 60)
+    } for day, start, end in slots]
+
+
+def format_slots(slots, first_day, last_day, min_minutes=None):
+    """把空闲时段格式化为聊天回复"""
+    min_minutes = min_minutes if min_minutes is not None else MIN_SLOT_MINUTES
+    span = first_day.strftime('%m月%d日') if first_day == last_day else \
+        f"{first_day.strftime('%m月%d日')} 至 {last_day.strftime('%m月%d日')}"
+    if not slots:
+        return f"{span} 没有不少于 {min_minutes} 分钟的空闲时间。"
+    response = f"{span} 的空闲时间：\n"
+    current_day = None
+    for day, start, end in slots:
+        if day != current_day and first_day != last_day:
+            response += f"\n📅 {day.strftime('%m月%d日')}\n"
+            current_day = day
+        response += f"🕘 {start.strftime('%H:%M')} - {end.strftime('%H:%M')}\n"
+    return response.rstrip('\n')
+
+
+def benchmark(users=200, events_per_user=400, days=7):
+    """合成数据上测量批量计算的耗时（仅在内存中执行扫描线部分）"""
+    import random
+    base = datetime(2026, 1, 5)
+    busy = {}
+    for user_id in range(users):
+        intervals = []
+        for _ in range(events_per_user):
+            start = base + timedelta(minutes=random.randrange(0, days * 24 * 60, 15))
+            intervals.append((start, start + timedelta(minutes=random.choice((30, 60, 90)))))
+        busy[user_id] = sorted(intervals)
+    hours = parse_hours(WORK_HOURS)
+    windows = _windows(base.date(), base.date() + timedelta(days=days - 1), hours, None)
+    began = time.perf_counter()
+    for intervals in busy.values():
+        merged = merge_intervals(intervals)
+        for _, window_start, window_end in windows:
+            gaps(merged, window_start, window_end, timedelta(minutes=MIN_SLOT_MINUTES))
+    elapsed = time.perf_counter() - began
+    return {'users': users, 'events': users * events_per_user, 'seconds': round(elapsed, 4)}
+
+
+if __name__ == '__main__':
+    result = benchmark()
+    print(f"{result['users']} 个用户 / {result['events']} 个日程: {result['seconds'] * 1000:.1f} ms")
@@ -0,0 +1,96 @@
+import re
+
+# 索引和查询共用的 n-gram 规则
+#
+# FTS5 自带的 unicode61 分词器把一整段连续的汉字当作一个词，trigram 分词器又要求
+# 查询词至少 3 个字，都不适合“会议”“上课”这样的中文关键词。这里把每段连续汉字
+# 拆成重叠的二元组，并在末尾补上最后一个字：
+#     "开项目会议" -> "开项 项目 目会 会议 议"
+# 任意长度的中文子串都能转换成这些词元上的短语查询。
+#
+# 词元在 Python 中生成：Events 上的触发器只把变更的 event_id 写入 EventsFtsQueue（纯 SQL，
+# sqlite3 命令行等其他连接也能正常写入 Events），sync 再把队列中的日程写入 EventsFts。
+# 应用的写路径在同一事务内调用 sync，顺带处理其他连接留下的变更；应用启动时也处理一次。
+# 搜索和分页等读路径不调用 sync，不会因为补索引而开启写事务。
+
+_CJK = re.compile(r'[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+')
+_WORD = re.compile(r'\w+')
+
+
+def _bigrams(run):
+    return [run[i:i + 2] for i in range(len(run) - 1)]
+
+
+def ngram_text(text):
+    """把文本中的汉字段替换为二元组序列，其他字符原样保留，交给 unicode61 分词"""
+    if not text:
+        return ''
+    parts, last = [], 0
+    for match in _CJK.finditer(text):
+        run = match.group()
+        parts.append(text[last:match.start()])
+        parts.append(' ' + ' '.join(_bigrams(run) + [run[-1]]) + ' ')
+        last = match.end()
+    parts.append(text[last:])
+    return ''.join(parts)
+
+
+def sync(conn):
+    """把 EventsFtsQueue 中的日程写入全文索引，返回写入的条数；调用方负责提交
+
+    conn 可以是连接或游标。队列为空时只执行一次读取，不开启写事务。
+    """
+    if conn.execute('SELECT 1 FROM EventsFtsQueue LIMIT 1').fetchone() is None:
+        return 0
+    # 第一条写语句取得写锁，之后其他连接无法再写入队列，最后可以整表清空
+    conn.execute('DELETE FROM EventsFts WHERE rowid IN (SELECT event_id FROM EventsFtsQueue)')
+    rows = conn.execute('''
+        SELECT e.event_id, e.user_id, e.title, e.description, e.location
+        FROM EventsFtsQueue q
+        JOIN Events e ON e.event_id = q.event_id
+    ''').fetchall()
+    conn.executemany('''
+        INSERT INTO EventsFts (rowid, owner, title, description, location)
+        VALUES (?, ?, ?, ?, ?)
+    ''', [(event_id, f'u{user_id}', ngram_text(title), ngram_text(description), ngram_text(location))
+          for event_id, user_id, title, description, location in rows])
+    conn.execute('DELETE FROM EventsFtsQueue')
+    return len(rows)
+
+
+def keyword_phrase(keyword):
+    """把一个关键词转换为 FTS5 短语查询，相当于对原文做子串匹配
+
+    关键词末尾的汉字段在原文中可能还有后续汉字，所以不带补充的单字；
+    末尾只有一个汉字时用前缀查询匹配以它开头的二元组或单字。
+    """
+    tokens, prefix, last = [], False, 0
+    matches = list(_CJK.finditer(keyword))
+    for index, match in enumerate(matches):
+        tokens.extend(token.lower() for token in _WORD.findall(keyword[last:match.start()]))
+        run = match.group()
+        at_end = index == len(matches) - 1 and not _WORD.search(keyword[match.end():])
+        if not at_end:
+            tokens.extend(_bigrams(run) + [run[-1]])
+        elif len(run) > 1:
+            tokens.extend(_bigrams(run))
+        else:
+            tokens.append(run)
+            prefix = True
+        last = match.end()
+    trailing = [token.lower() for token in _WORD.findall(keyword[last:])]
+    if trailing:
+        # 末尾是英文或数字时同样按前缀匹配，“meet”可以匹配“meeting”
+        tokens.extend(trailing)
+        prefix = True
+    if not tokens:
+        return None
+    return '"' + ' '.join(tokens) + '"' + (' *' if prefix else '')
+
+
+def match_query(user_id, keywords):
+    """生成 MATCH 表达式：限定用户，并在标题/描述/地点中匹配任一关键词"""
+    phrases = [phrase for phrase in (keyword_phrase(keyword) for keyword in keywords) if phrase]
+    if not phrases:
+        return None
+    return f'owner : u{int(user_id)} AND {{title description location}} : ({" OR ".join(phrases)})'
@@ -0,0 +1,184 @@
+import re
+import time
+
+# 意图规则，按优先级排列：靠前的意图优先，与 process_message 原来的判断顺序一致。
+# 每条规则可以有多个模式，模式中的命名分组 (?P<slot>...) 会作为槽位返回。
+INTENT_RULES = [
+    # 空闲时间查询在本地计算，优先于需要 AI 解析的 smart_query
+    ('free_slots', [
+        r"有空|空闲|空档|闲着",
+        r"(什么时候|何时|哪天|几点|有没有)(有)?时间",
+    ]),
+    ('smart_query', [
+        r"(什么时候|何时|哪天).*?(有|的|是).*?(课|课程|会议|安排)",
+        r"(\d{1,2})月.*?(有|的).*?(课|课程|会议|安排)",
+        r"(今天|明天|下周|这周|本周).*?(有|的).*?(课|课程|会议|安排)",
+    ]),
+    # 序号选择只匹配整条消息：\A 使前面的 [\s\S]*? 只能匹配空串
+    ('select', [
+        r"\A\s*(?P<index>\d+)\s*\Z",
+    ]),
+    ('delete', [
+        r"删除.*日程",
+        r"删掉.*日程",
+        r"取消.*日程",
+        r"删除.*安排",
+        r"删掉.*安排",
+        r"取消.*安排",
+        r"删.*",
+        r"取消.*",
+    ]),
+    ('modify', [
+        r"修改.*日程",
+        r"更改.*日程",
+        r"调整.*日程",
+        r"改一下.*日程",
+        r"把.*日程.*改成",
+        r"将.*日程.*改为",
+        r"修改.*行程",
+        r"更改.*行程",
+        r"调整.*行程",
+        r"改.*时间",
+        r"改.*地点",
+        r"换.*时间",
+        r"换.*地点",
+        r"改到.*",
+        r"调到.*",
+        r"改成.*",
+        r"改为.*",
+        # 消息里同时出现“改”和时间词
+        r"(?=[\s\S]*?改)[\s\S]*?(明天|今天|后天|早上|下午|晚上)",
+    ]),
+    ('search', [
+        r"搜索|查找|查询",
+    ]),
+    ('query_today', [
+        r"(今天|今日).*日程",
+    ]),
+    ('query_tomorrow', [
+        r"(明天|明日).*日程",
+    ]),
+    ('query_week', [
+        r"(本周|这周|一周|未来一周).*日程",
+    ]),
+    ('query_all', [
+        r"(所有|全部).*日程",
+    ]),
+    ('query_date', [
+        r"(?:(?P<year>\d{4})年)?(?P<month>\d{1,2})月(?P<day>\d{1,2})日.*日程",
+    ]),
+    ('query_month', [
+        r"(?:(?P<year>\d{4})年)?(?P<month>\d{1,2})月.*日程",
+    ]),
+]
+
+# 修改请求中用引号标出的日程标题
+TITLE_PATTERN = re.compile(r"「(?P<title>.+?)」|[\"“](?P<quoted>.+?)[\"”]")
+
+_SLOT_GROUP = re.compile(r"\(\?P<(\w+)>")
+
+
+class IntentRouter:
+    """把所有意图规则预编译成一个正则，一次匹配同时得到意图和槽位
+
+    每个意图是一个锚定在消息开头的分支：[\\s\\S]*?(模式1|模式2|...)。
+    正则引擎按顺序尝试分支，第一个能匹配的分支就是优先级最高的意图，
+    与逐条 re.search 的结果相同，但只调用一次、无需在 Python 层循环。
+    """
+
+    def __init__(self, rules=INTENT_RULES):
+        self.intents = [intent for intent, _ in rules]
+        self._slots = {}
+        branches = []
+        for intent, patterns in rules:
+            slots = []
+
+            def rename(match, intent=intent, slots=slots):
+                # 分组名在整个正则中必须唯一，加上意图前缀
+                slots.append(match.group(1))
+                return f"(?P<{intent}__{match.group(1)}>"
+
+            body = '|'.join(_SLOT_GROUP.sub(rename, pattern) for pattern in patterns)
+            self._slots[intent] = [(f"{intent}__{slot}", slot) for slot in dict.fromkeys(slots)]
+            branches.append(f"(?P<{intent}>[\\s\\S]*?(?:{body}))")
+        self.pattern = re.compile(r"\A(?:" + "|".join(branches) + ")")
+
+    def route(self, message):
+        """返回 (intent, slots)；没有规则匹配时返回 (None, {})"""
+        match = self.pattern.match(message)
+        if not match:
+            return None, {}
+        # 意图分组最后闭合，lastgroup 即为命中的意图
+        intent = match.lastgroup
+        slots = {}
+        for group, slot in self._slots[intent]:
+            value = match.group(group)
+            if value is not None:
+                slots[slot] = value
+        return intent, slots
+
+    def route_naive(self, message):
+        """逐条 re.search 的参考实现，用于基准对比和一致性检查"""
+        for intent, patterns in INTENT_RULES:
+            for pattern in patterns:
+                match = re.search(pattern, message)
+                if match:
+                    return intent, {k: v for k, v in match.groupdict().items() if v is not None}
+        return None, {}
+
+
+router = IntentRouter()
+
+
+def route(message):
+    return router.route(message)
+
+
+def extract_title(message):
+    """提取用引号标出的日程标题，没有时返回 None"""
+    match = TITLE_PATTERN.search(message)
+    if not match:
+        return None
+    return match.group('title') or match.group('quoted')
+
+
+BENCHMARK_MESSAGES = [
+    "明天下午3点在会议室A开项目会",
+    "今天有什么日程",
+    "删除明天的日程",
+    "把明天的会议改到下午4点",
+    "2",
+    "搜索 项目 会议",
+    "12月25日的日程",
+    "3月有哪些日程",
+    "什么时候有数学课",
+    "明天下午有空吗",
+    "你好，帮我看看最近安排得怎么样",
+]
+
+
+def benchmark(messages=BENCHMARK_MESSAGES, rounds=20000):
+    """单条消息的路由耗时（微秒）：合并正则 vs 逐条匹配"""
+    for message in messages:
+        expected = router.route_naive(message)
+        actual = router.route(message)
+        if expected != actual:
+            raise AssertionError(f"路由结果不一致: {message!r} {expected} != {actual}")
+
+    results = {}
+    for name, func in (('combined', router.route), ('naive', router.route_naive)):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for message in messages:
+                func(message)
+        elapsed = time.perf_counter() - start
+        results[name] = elapsed / (rounds * len(messages)) * 1e6
+    return results
+
+
+if __name__ == '__main__':
+    for message in BENCHMARK_MESSAGES:
+        print(f"{message!r:40} -> {router.route(message)}")
+    result = benchmark()
+    print(f"合并正则: {result['combined']:.2f} µs/条")
+    print(f"逐条匹配: {result['naive']:.2f} µs/条")
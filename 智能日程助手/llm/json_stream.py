@@ -0,0 +1,45 @@
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 安装了 orjson 时用它编码（快数倍），否则退回标准库 json；输出都是 UTF-8 文本，不转义中文
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+ENCODER = 'orjson' if orjson is not None else 'json'
+
+# 每次产出的片段大约包含的元素数；太小会增加 WSGI 写出次数，太大则失去流式的意义
+CHUNK_ITEMS = 100
+
+
+def dumps(obj):
+    if orjson is not None:
+        return orjson.dumps(obj).decode('utf-8')
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+
+
+def iter_array(items, chunk_items=CHUNK_ITEMS):
+    """把可迭代对象逐段编码为 JSON 数组，不在内存中构建完整的列表或字符串
+
+    items 可以是逐页读取数据库的生成器；中途出错时已经发出的部分无法撤回，
+    记录日志后重新抛出且不闭合数组，客户端得到的是无法解析的 JSON，不会把不完整的结果当作完整数据。
+    """
+    yield '['
+    buffer = []
+    first = True
+    try:
+        for item in items:
+            buffer.append(dumps(item))
+            if len(buffer) >= chunk_items:
+                yield ('' if first else ',') + ','.join(buffer)
+                first = False
+                buffer = []
+    except Exception as e:
+        logger.error(f"流式输出 JSON 时出错：{str(e)}")
+        raise
+    if buffer:
+        yield ('' if first else ',') + ','.join(buffer)
+    yield ']'
@@ -0,0 +1,182 @@
+import os
+import re
+import time
+import hashlib
+import logging
+import threading
+import unicodedata
+from datetime import date
+
+import db
+from cache import LRUCache
+from time_parser import resolve_relative_dates
+
+logger = logging.getLogger(__name__)
+
+LLM_CACHE_PATH = os.getenv("SCHEDULE_LLM_CACHE_PATH", "llm_cache.db")
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("SCHEDULE_LLM_CACHE_MAX_ENTRIES", "5000"))
+LLM_CACHE_TTL = float(os.getenv("SCHEDULE_LLM_CACHE_TTL", "86400"))
+# 进程内热点层的条目数
+LLM_CACHE_MEMORY_ENTRIES = int(os.getenv("SCHEDULE_LLM_CACHE_MEMORY_ENTRIES", "512"))
+
+_TRAILING_PUNCT = re.compile(r'[\s。.!！~～?？,，;；]+$')
+_SPACES = re.compile(r'\s+')
+
+
+def normalize_message(message, today=None):
+    """把消息规范化为与当前日期无关的缓存键文本
+
+    全角转半角、合并空白、去掉句末标点，并把相对日期换算成绝对日期。
+    消息里没有日期时，AI 会按“今天”理解，所以键中带上今天的日期；
+    有日期但没写年份时，AI 会按今年理解，所以总是带上年份。
+    """
+    today = today or date.today()
+    text = unicodedata.normalize('NFKC', message).lower()
+    text = _TRAILING_PUNCT.sub('', _SPACES.sub(' ', text).strip())
+    text, has_date = resolve_relative_dates(text, today)
+    context = today.isoformat() if not has_date else str(today.year)
+    return f"{text}@{context}"
+
+
+class LLMResponseCache:
+    """AI 响应的持久化缓存：进程内 LRU + SQLite 文件
+
+    键为 (提示类型, 规范化后的消息)；按最近使用时间淘汰，超过 TTL 的条目视为失效。
+    """
+
+    def __init__(self, path=LLM_CACHE_PATH, max_entries=LLM_CACHE_MAX_ENTRIES,
+                 ttl=LLM_CACHE_TTL, memory_entries=LLM_CACHE_MEMORY_ENTRIES):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._memory = LRUCache(memory_entries, ttl)
+        self._pool = db.ConnectionPool(db_path=path)
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        with self._pool.transaction() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS llm_responses (
+                    key TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    normalized TEXT NOT NULL,
+                    response TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used REAL NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_llm_responses_last_used ON llm_responses(last_used)')
+
+    @staticmethod
+    def make_key(kind, normalized):
+        return hashlib.sha1(f"{kind}\x00{normalized}".encode('utf-8')).hexdigest()
+
+    def get(self, kind, message, today=None):
+        """返回缓存的响应文本，未命中时返回 None"""
+        key = self.make_key(kind, normalize_message(message, today))
+        value = self._memory.get(key)
+        if value is not None:
+            with self._lock:
+                self.memory_hits += 1
+            return value
+
+        try:
+            now = time.time()
+            with self._pool.transaction() as conn:
+                row = conn.execute(
+                    'SELECT response FROM llm_responses WHERE key = ? AND created_at > ?',
+                    (key, now - self.ttl)
+                ).fetchone()
+                if row:
+                    conn.execute('UPDATE llm_responses SET last_used = ? WHERE key = ?', (now, key))
+        except Exception as e:
+            logger.error(f"读取 AI 响应缓存失败: {str(e)}")
+            row = None
+
+        with self._lock:
+            if row:
+                self.disk_hits += 1
+            else:
+                self.misses += 1
+        if not row:
+            return None
+        self._memory.set(key, row[0])
+        return row[0]
+
+    def set(self, kind, message, response, today=None):
+        normalized = normalize_message(message, today)
+        key = self.make_key(kind, normalized)
+        self._memory.set(key, response)
+        try:
+            now = time.time()
+            with self._pool.transaction() as conn:
+                conn.execute('''
+                    INSERT OR REPLACE INTO llm_responses (key, kind, normalized, response, created_at, last_used)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (key, kind, normalized, response, now, now))
+                with self._lock:
+                    self.stores += 1
+                    self._writes += 1
+                    evict = self._writes % 100 == 0
+                if evict:
+                    self._evict(conn, now)
+        except Exception as e:
+            logger.error(f"写入 AI 响应缓存失败: {str(e)}")
+
+    def _evict(self, conn, now):
+        """删除过期条目，超出容量时删除最久未使用的条目"""
+        expired = conn.execute('DELETE FROM llm_responses WHERE created_at <= ?', (now - self.ttl,)).rowcount
+        overflow = conn.execute('''
+            DELETE FROM llm_responses WHERE key IN (
+                SELECT key FROM llm_responses ORDER BY last_used DESC LIMIT -1 OFFSET ?
+            )
+        ''', (self.max_entries,)).rowcount
+        with self._lock:
+            self.evictions += expired + overflow
+
+    def stats(self):
+        try:
+            with self._pool.connection() as conn:
+                entries = conn.execute('SELECT COUNT(*) FROM llm_responses').fetchone()[0]
+        except Exception as e:
+            logger.error(f"读取 AI 响应缓存统计失败: {str(e)}")
+            entries = None
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            hits = self.memory_hits + self.disk_hits
+            return {
+                'entries': entries,
+                'max_entries': self.max_entries,
+                'memory_entries': len(self._memory),
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': round(hits / lookups, 4) if lookups else 0.0,
+                'stores': self.stores,
+                'evictions': self.evictions,
+            }
+
+
+_responses = None
+_responses_lock = threading.Lock()
+
+
+def get_responses():
+    """进程共用的 LLMResponseCache，第一次使用时才创建；导入本模块不会生成缓存文件"""
+    global _responses
+    if _responses is None:
+        with _responses_lock:
+            if _responses is None:
+                _responses = LLMResponseCache()
+    return _responses
+
+
+def __getattr__(name):
+    # llm_cache.responses 延迟到第一次访问时创建
+    if name == 'responses':
+        return get_responses()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,357 @@
+import os
+import time
+import queue
+import random
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+logger = logging.getLogger(__name__)
+
+# 每个进程同时进行的大模型调用数；排队、重试和退避都计入单次调用的截止时间
+LLM_MAX_CONCURRENCY = int(os.getenv("SCHEDULE_LLM_MAX_CONCURRENCY", "4"))
+LLM_TIMEOUT = float(os.getenv("SCHEDULE_LLM_TIMEOUT", "30"))
+LLM_PARSE_TIMEOUT = float(os.getenv("SCHEDULE_LLM_PARSE_TIMEOUT", "10"))
+LLM_RETRIES = int(os.getenv("SCHEDULE_LLM_RETRIES", "2"))
+LLM_BACKOFF_BASE = float(os.getenv("SCHEDULE_LLM_BACKOFF_BASE", "0.2"))
+LLM_BACKOFF_CAP = float(os.getenv("SCHEDULE_LLM_BACKOFF_CAP", "2"))
+# 连续失败 LLM_BREAKER_THRESHOLD 次后熔断，LLM_BREAKER_COOLDOWN 秒后放一个探测请求；
+# 网关使用的阈值不超过并发上限，上游卡住时占满全部名额的那批调用超时就足以触发熔断
+LLM_BREAKER_THRESHOLD = int(os.getenv("SCHEDULE_LLM_BREAKER_THRESHOLD", "5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("SCHEDULE_LLM_BREAKER_COOLDOWN", "30"))
+
+# 延迟直方图的桶上限（毫秒）
+LATENCY_BUCKETS_MS = (100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+_STREAM_END = object()
+
+
+class LLMUnavailable(Exception):
+    """大模型暂时不可用（熔断、并发已满或超过截止时间），调用方应走本地兜底逻辑"""
+
+
+class CircuitBreaker:
+    """连续失败计数熔断器：closed -> open -> half_open（一次探测）-> closed/open"""
+
+    def __init__(self, threshold=LLM_BREAKER_THRESHOLD, cooldown=LLM_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opened_count = 0
+        self._probing = False
+
+    def allow(self):
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = 'half_open'
+            if self.state == 'half_open' and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == 'half_open' or self.failures >= self.threshold:
+                if self.state != 'open':
+                    self.opened_count += 1
+                    logger.warning(f"大模型调用连续失败 {self.failures} 次，熔断 {self.cooldown} 秒")
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+    def release(self):
+        """探测请求没有真正发出（例如提交到线程池失败）时归还探测名额"""
+        with self._lock:
+            self._probing = False
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self.failures,
+                'opened': self.opened_count,
+            }
+
+
+class LatencyHistogram:
+    """按提示类型统计调用结果和延迟分布"""
+
+    OUTCOMES = ('ok', 'error', 'timeout', 'rejected', 'short_circuited')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._kinds = {}
+
+    def record(self, kind, outcome, seconds=None):
+        with self._lock:
+            entry = self._kinds.get(kind)
+            if entry is None:
+                entry = self._kinds[kind] = {
+                    'outcomes': dict.fromkeys(self.OUTCOMES, 0),
+                    'buckets': [0] * (len(LATENCY_BUCKETS_MS) + 1),
+                    'total_ms': 0.0,
+                    'max_ms': 0.0,
+                }
+            entry['outcomes'][outcome] += 1
+            if seconds is not None:
+                ms = seconds * 1000
+                index = next((i for i, bound in enumerate(LATENCY_BUCKETS_MS) if ms <= bound), len(LATENCY_BUCKETS_MS))
+                entry['buckets'][index] += 1
+                entry['total_ms'] += ms
+                entry['max_ms'] = max(entry['max_ms'], ms)
+
+    def snapshot(self):
+        labels = [f"<={bound}ms" for bound in LATENCY_BUCKETS_MS] + [f">{LATENCY_BUCKETS_MS[-1]}ms"]
+        with self._lock:
+            result = {}
+            for kind, entry in self._kinds.items():
+                timed = sum(entry['buckets'])
+                result[kind] = {
+                    'outcomes': dict(entry['outcomes']),
+                    'latency': dict(zip(labels, entry['buckets'])),
+                    'avg_ms': round(entry['total_ms'] / timed, 1) if timed else 0.0,
+                    'max_ms': round(entry['max_ms'], 1),
+                }
+            return result
+
+
+class LLMGateway:
+    """包在 ChatTongyi（或 FakeLLM）外的调用网关
+
+    - 每个进程最多 max_concurrency 个调用在执行，其余排队，排队时间计入截止时间；
+    - 每次调用有截止时间，超时后立即返回给调用方，底层请求结束后才归还并发名额，
+      所以上游变慢时真实并发依然有上限；
+    - 失败后按指数退避加全抖动重试，重试不会超过截止时间；
+    - 连续失败触发熔断，熔断期间直接抛出 LLMUnavailable，由调用方走本地解析兜底。
+
+    llm 可以直接传入客户端，也可以传入 factory 在第一次调用时再创建（避免启动时导入 LangChain）。
+    """
+
+    def __init__(self, llm=None, max_concurrency=LLM_MAX_CONCURRENCY, timeout=LLM_TIMEOUT, retries=LLM_RETRIES,
+                 backoff_base=LLM_BACKOFF_BASE, backoff_cap=LLM_BACKOFF_CAP, breaker=None, factory=None):
+        if llm is None and factory is None:
+            raise ValueError("llm 和 factory 至少需要提供一个")
+        self._llm = llm
+        self._factory = factory
+        self._llm_lock = threading.Lock()
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.breaker = breaker or CircuitBreaker(threshold=min(LLM_BREAKER_THRESHOLD, max_concurrency))
+        self.histogram = LatencyHistogram()
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='llm')
+        self._lock = threading.Lock()
+        self.in_flight = 0
+
+    @property
+    def llm(self):
+        if self._llm is None:
+            with self._llm_lock:
+                if self._llm is None:
+                    started = time.monotonic()
+                    self._llm = self._factory()
+                    logger.info(f"大模型客户端初始化完成，耗时 {(time.monotonic() - started) * 1000:.0f} ms")
+        return self._llm
+
+    @llm.setter
+    def llm(self, llm):
+        self._llm = llm
+
+    @property
+    def initialized(self):
+        return self._llm is not None
+
+    def _acquire(self, kind, deadline):
+        if not self.breaker.allow():
+            self.histogram.record(kind, 'short_circuited')
+            raise LLMUnavailable("AI 服务熔断中")
+        if not self._slots.acquire(timeout=max(0.0, deadline - time.monotonic())):
+            # 名额只在底层调用返回后归还，排队超时说明所有名额都被卡住的调用占着，同样计入熔断；
+            # 否则上游挂起时熔断器一直是 closed，之后的每个请求都要等满截止时间
+            self.breaker.record_failure()
+            self.histogram.record(kind, 'rejected')
+            raise LLMUnavailable("AI 调用排队超时")
+        with self._lock:
+            self.in_flight += 1
+
+    def _release(self, _future=None):
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    def _backoff(self, attempt, deadline, kind, error):
+        """需要重试时等待退避时间；没有重试机会时抛出 LLMUnavailable"""
+        delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * (2 ** attempt)))
+        if attempt >= self.retries or time.monotonic() + delay >= deadline:
+            raise LLMUnavailable(f"AI 调用失败（{kind}）：{error}")
+        time.sleep(delay)
+
+    def invoke(self, prompt, kind='chat', timeout=None):
+        """同步调用，返回带 content 属性的消息；不可用时抛出 LLMUnavailable"""
+        deadline = time.monotonic() + (timeout or self.timeout)
+        attempt = 0
+        while True:
+            self._acquire(kind, deadline)
+            started = time.monotonic()
+            try:
+                llm = self.llm
+            except Exception as e:
+                # 客户端创建失败（缺少依赖或配置错误）同样计入熔断
+                self._release()
+                self.histogram.record(kind, 'error')
+                self.breaker.record_failure()
+                raise LLMUnavailable(f"AI 客户端初始化失败：{e}")
+            try:
+                future = self._executor.submit(llm.invoke, prompt)
+            except Exception:
+                self._release()
+                raise
+            future.add_done_callback(self._release)
+            try:
+                result = future.result(timeout=max(0.0, deadline - time.monotonic()))
+            except FutureTimeout:
+                self.histogram.record(kind, 'timeout', time.monotonic() - started)
+                self.breaker.record_failure()
+                raise LLMUnavailable(f"AI 调用超时（{kind}）")
+            except Exception as e:
+                self.histogram.record(kind, 'error', time.monotonic() - started)
+                self.breaker.record_failure()
+                logger.warning(f"AI 调用失败（{kind}，第 {attempt + 1} 次）: {str(e)}")
+                self._backoff(attempt, deadline, kind, e)
+                attempt += 1
+                continue
+            self.histogram.record(kind, 'ok', time.monotonic() - started)
+            self.breaker.record_success()
+            return result
+
+    def stream(self, prompt, kind='chat', timeout=None):
+        """流式调用的生成器；首个片段和相邻片段之间的等待都不超过截止时间，开始输出后不再重试"""
+        timeout = timeout or self.timeout
+        deadline = time.monotonic() + timeout
+        self._acquire(kind, deadline)
+        chunks = queue.Queue()
+        cancelled = threading.Event()
+
+        def produce():
+            try:
+                for chunk in self.llm.stream(prompt):
+                    if cancelled.is_set():
+                        break
+                    chunks.put(chunk)
+                chunks.put(_STREAM_END)
+            except Exception as e:
+                chunks.put(e)
+
+        started = time.monotonic()
+        try:
+            future = self._executor.submit(produce)
+        except Exception:
+            self._release()
+            self.breaker.release()
+            raise
+        future.add_done_callback(self._release)
+
+        recorded = received = False
+        try:
+            while True:
+                try:
+                    item = chunks.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    recorded = True
+                    self.histogram.record(kind, 'timeout', time.monotonic() - started)
+                    self.breaker.record_failure()
+                    raise LLMUnavailable(f"AI 流式调用超时（{kind}）")
+                if item is _STREAM_END:
+                    break
+                if isinstance(item, Exception):
+                    recorded = True
+                    self.histogram.record(kind, 'error', time.monotonic() - started)
+                    self.breaker.record_failure()
+                    raise LLMUnavailable(f"AI 流式调用失败（{kind}）：{item}")
+                # 收到片段后重新计时，长回复不会因为总时长超过 timeout 而被截断
+                deadline = time.monotonic() + timeout
+                received = True
+                yield item
+            recorded = True
+            self.histogram.record(kind, 'ok', time.monotonic() - started)
+            self.breaker.record_success()
+        finally:
+            cancelled.set()
+            if not recorded:
+                # 调用方提前关闭了生成器（GeneratorExit）：已经收到片段说明服务正常，记为成功；
+                # 否则归还探测名额。两种情况都不能让半开状态的 _probing 一直停留在 True
+                if received:
+                    self.histogram.record(kind, 'ok', time.monotonic() - started)
+                    self.breaker.record_success()
+                else:
+                    self.breaker.release()
+
+    def stats(self):
+        with self._lock:
+            in_flight = self.in_flight
+        return {
+            'initialized': self.initialized,
+            'max_concurrency': self.max_concurrency,
+            'in_flight': in_flight,
+            'timeout': self.timeout,
+            'retries': self.retries,
+            'breaker': self.breaker.snapshot(),
+            'kinds': self.histogram.snapshot(),
+        }
+
+
+def load_test(latency=2.0, timeout=0.5, callers=16, calls=4, error_rate=0.0):
+    """用 FakeLLM 注入延迟做压力测试：返回底层最大并发、各结果计数和调用方观察到的最长等待"""
+    from fake_llm import FakeLLM
+
+    llm = FakeLLM(latency=latency, jitter=0.0, error_rate=error_rate)
+    gateway = LLMGateway(llm, max_concurrency=4, timeout=timeout, retries=1, backoff_base=0.05,
+                         breaker=CircuitBreaker(threshold=5, cooldown=60))
+    waits = []
+    waits_lock = threading.Lock()
+
+    def caller():
+        for _ in range(calls):
+            started = time.monotonic()
+            try:
+                gateway.invoke('你好', kind='chat')
+            except LLMUnavailable:
+                pass
+            with waits_lock:
+                waits.append(time.monotonic() - started)
+
+    threads = [threading.Thread(target=caller) for _ in range(callers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats = gateway.stats()
+    return {
+        'upstream_calls': llm.calls,
+        'upstream_max_in_flight': llm.max_in_flight,
+        'max_wait_seconds': round(max(waits), 3),
+        'outcomes': stats['kinds']['chat']['outcomes'],
+        'breaker': stats['breaker'],
+    }
+
+
+if __name__ == '__main__':
+    print("上游延迟 2s、截止时间 0.5s：")
+    print(load_test())
+    print("上游正常（50ms）、10% 错误：")
+    print(load_test(latency=0.05, timeout=2.0, error_rate=0.1))
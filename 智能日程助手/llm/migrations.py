@@ -0,0 +1,380 @@
+import logging
+import sqlite3
+
+import db
+import fts
+import stats
+import queries
+import bulk_io
+import conflicts
+import free_slots
+import recurrence
+import event_pages
+import chat_history
+import conversation_memory
+
+logger = logging.getLogger(__name__)
+
+# 每个迁移步骤: (版本号, 说明, 执行函数)，版本号记录在 PRAGMA user_version 中
+MIGRATIONS = []
+
+_DAY = ('2000-01-01 00:00:00', '2000-01-02 00:00:00')
+
+# ScheduleManager 和 app.py 中每条读路径的查询，用于对比迁移前后的执行计划并检查索引使用；
+# 语句引用调用处使用的同一常量，不再各自抄写一份
+_LOOKBACK = '1999-12-01 00:00:00'
+REPORT_QUERIES = {
+    'query_events': (queries.EVENTS_IN_RANGE, (0, *_DAY)),
+    'find_event_by_time': (queries.EVENT_ROWS_IN_RANGE, (0, *_DAY)),
+    'find_event_by_title_and_time': (queries.EVENTS_BY_TITLE_IN_RANGE, (0, *_DAY, '%x%')),
+    'get_month_events': (
+        queries.MONTH_EVENTS,
+        (0, _LOOKBACK, '2000-02-01 00:00:00', _DAY[0], _DAY[0])
+    ),
+    'delete_events_by_date': (queries.EVENTS_TO_DELETE_IN_RANGE, (0, *_DAY)),
+    'get_event': (queries.EVENT_BY_ID, (1, 0)),
+    'update_event': (queries.EVENT_FOR_UPDATE, (1, 0)),
+    'delete_event': (queries.EVENT_SPAN_BY_ID, (1, 0)),
+    'get_all_events': (queries.CALENDAR_EVENTS, (0, _LOOKBACK, _DAY[1], _DAY[0], '', 0, 500)),
+    'find_overlaps': (conflicts.OVERLAP_SQL, conflicts.overlap_params(0, *_DAY)),
+    'busy_intervals': (free_slots.busy_intervals_sql(2), (0, 1, _LOOKBACK, _DAY[1], _DAY[0])),
+    'recurrence_rules': (recurrence.RULES_SQL, (0, _DAY[1], _DAY[0])),
+    'recurrence_exceptions': (
+        recurrence.exceptions_sql(2),
+        (1, 2, _LOOKBACK, _DAY[1], _DAY[1], _DAY[0])
+    ),
+    'export_events_page': (bulk_io.EXPORT_PAGE_SQL, (0, _DAY[0], _DAY[0], 0, 500)),
+    'events_page': (event_pages.PAGE_SQL, (0, *_DAY, _DAY[0], 0, 51)),
+    'events_page_keywords': (
+        event_pages.PAGE_MATCH_SQL,
+        (0, *_DAY, _DAY[0], 0, 'owner : u0 AND {title description location} : ("会议")', 51)
+    ),
+    'search_events_by_keywords': (
+        queries.SEARCH_EVENTS,
+        ('owner : u0 AND {title description location} : ("会议")', 0, 20, 0)
+    ),
+    'day_events': (queries.EVENT_ROWS_IN_RANGE, (0, *_DAY)),
+    'chart_daily_histogram': (stats.DAILY_HISTOGRAM_SQL, (0, '2000-01-01', '2000-01-31')),
+    'conversation_window': (conversation_memory.WINDOW_SQL, (0, 0, 6)),
+    'chat_history_page': (chat_history.PAGE_SQL, (0, 1 << 62, 20)),
+}
+
+
+def migration(version, description):
+    """注册一个迁移步骤"""
+    def decorator(func):
+        MIGRATIONS.append((version, description, func))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return func
+    return decorator
+
+
+@migration(1, '创建 Users 和 Events 表')
+def _create_base_tables(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS Users (
+            user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS Events (
+            event_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            title TEXT NOT NULL,
+            description TEXT,
+            start_time DATETIME NOT NULL,
+            end_time DATETIME NOT NULL,
+            location TEXT,
+            is_all_day BOOLEAN DEFAULT FALSE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+@migration(2, '为 Events 添加按用户和时间的复合索引')
+def _add_event_indexes(cursor):
+    # (user_id, start_time, end_time) 覆盖按用户的时间范围查询和计数
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_events_user_start
+        ON Events(user_id, start_time, end_time)
+    ''')
+    # (user_id, end_time) 用于按结束时间判断区间重叠
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_events_user_end
+        ON Events(user_id, end_time)
+    ''')
+
+
+@migration(3, '创建按用户按天的日程数量汇总表')
+def _create_daily_counts(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS EventDailyCounts (
+            user_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            event_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, day)
+        ) WITHOUT ROWID
+    ''')
+    stats.rebuild_daily_counts(cursor)
+
+
+@migration(4, '创建按用户保存的对话记忆表')
+def _create_conversation_turns(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ConversationTurns (
+            turn_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            human TEXT NOT NULL,
+            ai TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )
+    ''')
+    # 按用户取最近几轮对话
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_conversation_user_turn
+        ON ConversationTurns(user_id, turn_id)
+    ''')
+
+
+@migration(5, '创建服务端聊天记录表')
+def _create_chat_messages(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ChatMessages (
+            message_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )
+    ''')
+    # 按用户倒序分页，以及按用户一次删除全部记录
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_chat_messages_user
+        ON ChatMessages(user_id, message_id)
+    ''')
+
+
+@migration(6, '为 Events 创建 FTS5 全文索引（中文二元组）及同步触发器')
+def _create_events_fts(cursor):
+    # rowid 即 event_id；owner 列保存 "u<user_id>"，把查询限定在单个用户的文档内
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS EventsFts USING fts5(
+            owner, title, description, location,
+            tokenize = 'unicode61'
+        )
+    ''')
+    # 词元在 Python 中生成（见 fts.sync）：触发器只记录变更的 event_id，保持为纯 SQL，
+    # sqlite3 命令行等没有注册任何函数的连接也能正常写入 Events
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS EventsFtsQueue (
+            event_id INTEGER PRIMARY KEY
+        )
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS events_fts_insert AFTER INSERT ON Events BEGIN
+            INSERT OR IGNORE INTO EventsFtsQueue (event_id) VALUES (new.event_id);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS events_fts_delete AFTER DELETE ON Events BEGIN
+            DELETE FROM EventsFts WHERE rowid = old.event_id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS events_fts_update
+        AFTER UPDATE OF user_id, title, description, location ON Events BEGIN
+            INSERT OR IGNORE INTO EventsFtsQueue (event_id) VALUES (new.event_id);
+        END
+    ''')
+    cursor.execute('DELETE FROM EventsFts')
+    cursor.execute('INSERT OR IGNORE INTO EventsFtsQueue (event_id) SELECT event_id FROM Events')
+    fts.sync(cursor)
+
+
+@migration(7, '为 Events 创建按用户和时间区间的 R*Tree 索引，用于冲突检测')
+def _create_event_spans(cursor):
+    # id 即 event_id；维度一为 user_id，维度二为以分钟计的时间区间
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS EventSpans USING rtree_i32(
+            id, user_min, user_max, start_min, end_min
+        )
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS event_spans_insert AFTER INSERT ON Events BEGIN
+            INSERT INTO EventSpans VALUES ({conflicts.span_values_sql('new.')});
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS event_spans_delete AFTER DELETE ON Events BEGIN
+            DELETE FROM EventSpans WHERE id = old.event_id;
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS event_spans_update
+        AFTER UPDATE OF user_id, start_time, end_time ON Events BEGIN
+            DELETE FROM EventSpans WHERE id = old.event_id;
+            INSERT INTO EventSpans VALUES ({conflicts.span_values_sql('new.')});
+        END
+    ''')
+    cursor.execute('DELETE FROM EventSpans')
+    cursor.execute(f'INSERT INTO EventSpans SELECT {conflicts.span_values_sql("")} FROM Events')
+
+
+@migration(8, '创建重复日程规则表和例外表')
+def _create_recurrences(cursor):
+    # 每条规则只保存一行，查询时在窗口内展开；start_time/end_time 是第一次发生的时间
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS EventRecurrences (
+            recurrence_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            start_time TEXT NOT NULL,
+            end_time TEXT NOT NULL,
+            location TEXT,
+            description TEXT,
+            freq TEXT NOT NULL CHECK (freq IN ('DAILY', 'WEEKLY', 'MONTHLY')),
+            repeat_interval INTEGER NOT NULL DEFAULT 1,
+            by_weekday TEXT,
+            until TEXT,
+            occurrence_count INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES Users (user_id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_recurrences_user_start
+        ON EventRecurrences(user_id, start_time)
+    ''')
+    # 某一次的取消或修改，occurrence_start 为该次按规则计算出的原始开始时间
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS RecurrenceExceptions (
+            recurrence_id INTEGER NOT NULL,
+            occurrence_start TEXT NOT NULL,
+            cancelled INTEGER NOT NULL DEFAULT 0,
+            title TEXT,
+            start_time TEXT,
+            end_time TEXT,
+            location TEXT,
+            description TEXT,
+            PRIMARY KEY (recurrence_id, occurrence_start),
+            FOREIGN KEY (recurrence_id) REFERENCES EventRecurrences (recurrence_id)
+        )
+    ''')
+
+
+def get_schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def explain(conn, sql, params=()):
+    """返回查询的执行计划（EXPLAIN QUERY PLAN 的 detail 列）"""
+    try:
+        return [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params)]
+    except sqlite3.OperationalError as e:
+        # 表尚未创建时无法生成执行计划
+        return [f'unavailable: {str(e)}']
+
+
+def query_plans(conn):
+    return {name: explain(conn, sql, params) for name, (sql, params) in REPORT_QUERIES.items()}
+
+
+def check_index_usage(conn):
+    """检查每条读路径是否都走索引，返回全表扫描的查询及其执行计划"""
+    failures = {}
+    for name, plan in query_plans(conn).items():
+        if any(_is_table_scan(step) for step in plan):
+            failures[name] = plan
+    return failures
+
+
+# 全表扫描时需要报警的表；虚拟表（EventsFts）的 SCAN 由其自身索引完成，不在此列
+SCAN_CHECKED_TABLES = ('Events', 'EventDailyCounts', 'ConversationTurns', 'ChatMessages')
+
+
+def _is_table_scan(step):
+    if step.startswith('unavailable'):
+        return True
+    words = step.split()
+    return len(words) >= 2 and words[0] == 'SCAN' and words[1] in SCAN_CHECKED_TABLES
+
+
+def enable_wal(conn):
+    """切换到 WAL 日志模式，读写互不阻塞；该设置会持久化到数据库文件"""
+    mode = conn.execute('PRAGMA journal_mode=WAL').fetchone()[0]
+    if mode.lower() != 'wal':
+        logger.warning(f"无法启用 WAL 模式，当前日志模式: {mode}")
+    return mode
+
+
+def latest_version():
+    return max(version for version, _, _ in MIGRATIONS)
+
+
+def migrate(pool=None, explain_plans=None):
+    """执行所有未应用的迁移，返回迁移前后的版本号和执行计划
+
+    explain_plans 为 None 时只在有迁移需要执行时生成执行计划和索引检查，
+    已是最新版本时不做任何额外查询，每个 worker 启动时调用的开销很小。
+    """
+    pool = pool or db.pool
+    with pool.connection() as conn:
+        journal_mode = enable_wal(conn)
+        before_version = get_schema_version(conn)
+        if explain_plans is None:
+            explain_plans = before_version < latest_version()
+        before_plans = query_plans(conn) if explain_plans else {}
+
+        for version, description, func in MIGRATIONS:
+            if version <= get_schema_version(conn):
+                continue
+            # BEGIN IMMEDIATE 串行化多个 worker 同时启动时的迁移
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                if version <= get_schema_version(conn):
+                    conn.rollback()
+                    continue
+                func(conn.cursor())
+                conn.execute(f'PRAGMA user_version = {int(version)}')
+                conn.commit()
+                logger.info(f"数据库迁移 v{version} 完成: {description}")
+            except Exception:
+                conn.rollback()
+                raise
+
+        after_version = get_schema_version(conn)
+        after_plans = query_plans(conn) if explain_plans else {}
+        full_scans = check_index_usage(conn) if explain_plans else {}
+
+    report = {
+        'journal_mode': journal_mode,
+        'before_version': before_version,
+        'after_version': after_version,
+        'before_plans': before_plans,
+        'after_plans': after_plans,
+        'full_scans': full_scans,
+    }
+    for name, plan in full_scans.items():
+        logger.warning(f"查询 {name} 未使用索引: {plan}")
+    if explain_plans and after_version != before_version:
+        for name in REPORT_QUERIES:
+            logger.info(f"执行计划 {name}: {before_plans[name]} -> {after_plans[name]}")
+    return report
+
+if __name__ == '__main__':
+    import sys
+
+    logging.basicConfig(level=logging.INFO)
+    result = migrate(explain_plans=True)
+    print(f"日志模式: {result['journal_mode']}")
+    print(f"数据库版本: v{result['before_version']} -> v{result['after_version']}")
+    for name in REPORT_QUERIES:
+        print(f"\n[{name}]")
+        print("  迁移前: " + "; ".join(result['before_plans'][name]))
+        print("  迁移后: " + "; ".join(result['after_plans'][name]))
+    if '--check' in sys.argv and result['full_scans']:
+        print(f"\n以下查询未使用索引: {', '.join(result['full_scans'])}")
+        sys.exit(1)
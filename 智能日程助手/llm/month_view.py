@@ -0,0 +1,54 @@
+import calendar
+from datetime import date, timedelta
+
+
+# 跨天事件结束时间为次日 00:00 时不算入次日
+_END_EPSILON = timedelta(microseconds=1)
+
+
+def build_month_view(year, month, events):
+    """把 get_month_events 返回的 EventRecord 一次遍历分到每天的桶中
+
+    时间字符串直接取自数据库，日历格子和事件列表共用同一份字符串；
+    跨天事件会出现在它覆盖的每一天（限本月内）。
+    """
+    days_in_month = calendar.monthrange(year, month)[1]
+    month_start = date(year, month, 1)
+    month_end = date(year, month, days_in_month)
+    buckets = [[] for _ in range(days_in_month)]
+    serialized = []
+
+    for event in events:
+        start, end = event.start, event.end
+        start_str = event.start_time
+        end_str = event.end_time
+
+        serialized.append({
+            'title': event.title,
+            'start_time': start_str,
+            'end_time': end_str,
+            'description': event.description,
+            'location': event.location
+        })
+        day_entry = {
+            'title': event.title,
+            'start_time': start_str[11:16],
+            'end_time': end_str[11:16],
+            'description': event.description,
+            'location': event.location
+        }
+
+        last_day = (end - _END_EPSILON).date() if end > start else start.date()
+        first = max(start.date(), month_start)
+        last = min(last_day, month_end)
+        for day in range(first.day, last.day + 1) if first <= last else ():
+            buckets[day - 1].append(day_entry)
+
+    return {
+        'calendar': {
+            'year': year,
+            'month': month,
+            'days': [{'date': day, 'events': buckets[day - 1]} for day in range(1, days_in_month + 1)]
+        },
+        'events': serialized
+    }
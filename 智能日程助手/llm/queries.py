@@ -0,0 +1,88 @@
+from time_range import RANGE_PREDICATE
+
+# ScheduleManager 读路径上的 SQL
+#
+# 调用处和 migrations.REPORT_QUERIES 共用这些常量，--check 检查的执行计划就是线上实际执行的语句。
+# 其他模块的查询放在各自模块中（conflicts.OVERLAP_SQL、event_pages.PAGE_SQL 等），同样被 REPORT_QUERIES 引用。
+# 这里不导入项目内其他模块，migrations 可以直接引用而不会形成循环导入。
+
+# query_events：某个时间范围内的日程
+EVENTS_IN_RANGE = f'''
+    SELECT title, start_time, end_time, location, description
+    FROM Events
+    WHERE user_id = ? AND {RANGE_PREDICATE}
+    ORDER BY start_time
+'''
+
+# find_event_by_time / get_day_events：带 event_id 的同一查询
+EVENT_ROWS_IN_RANGE = f'''
+    SELECT event_id, title, start_time, end_time, location, description
+    FROM Events
+    WHERE user_id = ? AND {RANGE_PREDICATE}
+    ORDER BY start_time
+'''
+
+# find_event_by_title_and_time：某天内标题包含关键词的日程
+EVENTS_BY_TITLE_IN_RANGE = f'''
+    SELECT event_id, title, start_time, end_time, location, description
+    FROM Events
+    WHERE user_id = ? AND {RANGE_PREDICATE}
+    AND title LIKE ?
+'''
+
+# get_month_events：参数为 (user_id, 回看起点, 月末, 月初, 月初)，包含从上月延续过来的跨天日程
+MONTH_EVENTS = f'''
+    SELECT title, start_time, end_time, location, description
+    FROM Events
+    WHERE user_id = ? AND {RANGE_PREDICATE}
+    AND (start_time >= ? OR end_time > ?)
+    ORDER BY start_time
+'''
+
+# delete_events_by_date：删除前取出受影响的日程
+EVENTS_TO_DELETE_IN_RANGE = f'''
+    SELECT event_id, title, start_time, end_time
+    FROM Events
+    WHERE user_id = ? AND {RANGE_PREDICATE}
+'''
+
+# get_event：按主键读取单个日程
+EVENT_BY_ID = '''
+    SELECT event_id, title, start_time, end_time, location, description
+    FROM Events
+    WHERE event_id = ? AND user_id = ?
+'''
+
+# update_event：修改前读取原值
+EVENT_FOR_UPDATE = '''
+    SELECT title, start_time, end_time, location
+    FROM Events
+    WHERE event_id = ? AND user_id = ?
+'''
+
+# delete_event：删除前读取时间，用于更新汇总表和失效缓存
+EVENT_SPAN_BY_ID = '''
+    SELECT start_time, end_time FROM Events
+    WHERE event_id = ? AND user_id = ?
+'''
+
+# search_events_by_keywords：FTS5 匹配后按 BM25 排序分页；标题权重最高，其次是地点和描述
+SEARCH_EVENTS = '''
+    SELECT e.title, e.start_time, e.end_time, e.location, e.description
+    FROM EventsFts
+    JOIN Events e ON e.event_id = EventsFts.rowid
+    WHERE EventsFts MATCH ? AND e.user_id = ?
+    ORDER BY bm25(EventsFts, 0.0, 10.0, 2.0, 5.0), e.start_time
+    LIMIT ? OFFSET ?
+'''
+
+# get_all_events：与 [start, end) 重叠的日程，按 (start_time, event_id) 键集分页；参数为
+# (user_id, 下界, 范围结束, 范围开始, 上一页最后的开始时间, 上一页最后的 event_id, 页大小)
+CALENDAR_EVENTS = f'''
+    SELECT event_id, title, start_time, end_time, location, description, is_all_day
+    FROM Events
+    WHERE user_id = ? AND {RANGE_PREDICATE} AND end_time > ?
+      AND (start_time > ? OR event_id > ?)
+    ORDER BY start_time, event_id
+    LIMIT ?
+'''
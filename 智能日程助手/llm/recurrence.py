@@ -0,0 +1,478 @@
+import re
+import logging
+from datetime import datetime, timedelta
+
+import db
+import cache
+import time_parser
+from time_range import TIME_FORMAT, MAX_EVENT_SPAN_DAYS
+
+logger = logging.getLogger(__name__)
+
+# 重复日程只在 EventRecurrences 中保存一行规则（RRULE 的 DAILY/WEEKLY/MONTHLY 子集），
+# 查询时只在查询窗口内用生成器展开，不会写入 Events；
+# RecurrenceExceptions 记录某一次的取消（cancelled=1）或改期/改内容（覆盖字段非空）。
+
+FREQUENCIES = ('DAILY', 'WEEKLY', 'MONTHLY')
+
+# 没有次数和截止日期的规则在展开时最多产出的次数，防止异常的查询窗口无限展开
+MAX_OCCURRENCES = 1000
+
+_WEEKDAYS = {'一': 0, '二': 1, '三': 2, '四': 3, '五': 4, '六': 5, '日': 6, '天': 6,
+             '1': 0, '2': 1, '3': 2, '4': 3, '5': 4, '6': 5, '7': 6}
+
+RECURRENCE_PATTERN = re.compile(
+    r'(?P<workday>每个?工作日)'
+    r'|(?P<daily>每(?:隔)?(?P<day_n>\d+|[一两二三四五六七八九十]+)?天|每日)'
+    r'|(?P<weekly>每(?:隔)?(?P<week_n>\d+|[一两二三四五六七八九十]+)?个?(?:周|星期|礼拜)'
+    r'(?P<days>[一二三四五六日天1-7](?:[、,，和及与/]?[一二三四五六日天1-7])*)?)'
+    r'|(?P<monthly>每(?:隔)?(?P<month_n>\d+|[一两二三四五六七八九十]+)?个?月'
+    r'(?P<month_day>\d{1,2}|[一二三四五六七八九十]+)[日号])'
+)
+COUNT_PATTERN = re.compile(r'(?:共|一共|重复)(?P<count>\d+|[一两二三四五六七八九十]+)次')
+UNTIL_PATTERN = re.compile(r'(?:到|至|直到)(?P<until>[^，,。\s]{2,12}?)(?:为止|结束|截止)')
+
+
+class RecurrenceRule:
+    """一条重复规则；occurrences() 按时间顺序惰性产出与窗口相交的每次发生"""
+
+    __slots__ = ('recurrence_id', 'user_id', 'title', 'start', 'end', 'location', 'description',
+                 'freq', 'interval', 'weekdays', 'until', 'count')
+
+    def __init__(self, recurrence_id, user_id, title, start, end, location, description,
+                 freq, interval=1, weekdays=None, until=None, count=None):
+        self.recurrence_id = recurrence_id
+        self.user_id = user_id
+        self.title = title
+        self.start = start
+        self.end = end
+        self.location = location
+        self.description = description
+        self.freq = freq
+        self.interval = max(1, int(interval or 1))
+        self.weekdays = tuple(sorted(set(weekdays))) if weekdays else (start.weekday(),)
+        self.until = until
+        self.count = count
+
+    @classmethod
+    def from_row(cls, row):
+        weekdays = [int(day) for day in row[9].split(',')] if row[9] else None
+        return cls(row[0], row[1], row[2],
+                   datetime.strptime(row[3], TIME_FORMAT), datetime.strptime(row[4], TIME_FORMAT),
+                   row[5], row[6], row[7], row[8], weekdays,
+                   datetime.strptime(row[10], TIME_FORMAT) if row[10] else None, row[11])
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+    def _starts(self, after):
+        """按时间顺序产出开始时间；没有次数限制时直接跳到 after 附近，不从第一次开始数"""
+        skip = after if self.count is None and after > self.start else self.start
+        time_of_day = self.start - datetime(self.start.year, self.start.month, self.start.day)
+
+        if self.freq == 'DAILY':
+            step = timedelta(days=self.interval)
+            index = (skip - self.start) // step
+            current = self.start + step * index
+            while True:
+                yield current
+                current += step
+
+        elif self.freq == 'WEEKLY':
+            week_start = datetime(self.start.year, self.start.month, self.start.day) - timedelta(days=self.start.weekday())
+            step = timedelta(weeks=self.interval)
+            week = week_start + step * ((skip - week_start) // step)
+            while True:
+                for weekday in self.weekdays:
+                    current = week + timedelta(days=weekday) + time_of_day
+                    if current >= self.start:
+                        yield current
+                week += step
+
+        else:  # MONTHLY：按第一次发生的日期每 interval 个月重复，没有该日期的月份跳过
+            months = (skip.year - self.start.year) * 12 + skip.month - self.start.month
+            index = max(0, months // self.interval)
+            while True:
+                total = self.start.month - 1 + index * self.interval
+                year, month = self.start.year + total // 12, total % 12 + 1
+                try:
+                    yield datetime(year, month, self.start.day) + time_of_day
+                except ValueError:
+                    pass
+                index += 1
+
+    def occurrences(self, window_start, window_end):
+        """产出与 [window_start, window_end) 相交的每次发生 (start, end)"""
+        duration = self.duration
+        emitted = 0
+        for index, start in enumerate(self._starts(window_start - duration)):
+            if self.count is not None and index >= self.count:
+                return
+            if self.until is not None and start > self.until:
+                return
+            if start >= window_end or emitted >= MAX_OCCURRENCES:
+                return
+            if start + duration > window_start:
+                emitted += 1
+                yield start, start + duration
+
+
+# 与窗口可能相交的规则，参数为 (user_id, 窗口结束, 窗口开始)；migrations.REPORT_QUERIES 引用同一语句
+RULES_SQL = '''
+    SELECT recurrence_id, user_id, title, start_time, end_time, location, description,
+           freq, repeat_interval, by_weekday, until, occurrence_count
+    FROM EventRecurrences
+    WHERE user_id = ? AND start_time < ? AND (until IS NULL OR until >= ?)
+'''
+
+
+def exceptions_sql(rule_count):
+    """读取若干条规则在窗口内的例外，参数为 (*rule_ids, 回看起点, 窗口结束, 窗口结束, 窗口开始)"""
+    placeholders = ', '.join('?' * rule_count)
+    return f'''
+        SELECT recurrence_id, occurrence_start, cancelled, title, start_time, end_time, location, description
+        FROM RecurrenceExceptions
+        WHERE recurrence_id IN ({placeholders})
+          AND ((occurrence_start >= ? AND occurrence_start < ?) OR (start_time < ? AND end_time > ?))
+    '''
+
+
+RULE_BY_ID_SQL = '''
+    SELECT recurrence_id, user_id, title, start_time, end_time, location, description,
+           freq, repeat_interval, by_weekday, until, occurrence_count
+    FROM EventRecurrences
+    WHERE recurrence_id = ? AND user_id = ?
+'''
+
+EXCEPTION_SQL = '''
+    SELECT recurrence_id, occurrence_start, cancelled, title, start_time, end_time, location, description
+    FROM RecurrenceExceptions
+    WHERE recurrence_id = ? AND occurrence_start = ?
+'''
+
+
+def format_occurrence_id(recurrence_id, occurrence_start):
+    """某一次发生的标识 'r<recurrence_id>@<原开始时间>'，与 Events 的整数 event_id 区分，可以存入会话状态"""
+    return f"r{recurrence_id}@{occurrence_start}"
+
+
+def parse_occurrence_id(value):
+    """occurrence_id -> (recurrence_id, 原开始时间字符串)；不是 occurrence_id 时返回 None"""
+    if not isinstance(value, str) or not value.startswith('r'):
+        return None
+    recurrence_id, _, occurrence_start = value[1:].partition('@')
+    try:
+        datetime.strptime(occurrence_start, TIME_FORMAT)
+        return int(recurrence_id), occurrence_start
+    except ValueError:
+        return None
+
+
+def _load_rules(conn, user_id, window_start, window_end):
+    rows = conn.execute(RULES_SQL, (user_id, window_end, window_start)).fetchall()
+    return [RecurrenceRule.from_row(row) for row in rows]
+
+
+def _load_exceptions(conn, rule_ids, window_start, window_end):
+    """{recurrence_id: {原发生时间: 例外行}}，包括改期到窗口内的例外"""
+    if not rule_ids:
+        return {}
+    lookback = (datetime.strptime(window_start, TIME_FORMAT) - timedelta(days=MAX_EVENT_SPAN_DAYS)).strftime(TIME_FORMAT)
+    rows = conn.execute(exceptions_sql(len(rule_ids)),
+                        (*rule_ids, lookback, window_end, window_end, window_start)).fetchall()
+    exceptions = {}
+    for row in rows:
+        exceptions.setdefault(row[0], {})[row[1]] = row
+    return exceptions
+
+
+def _apply_exception(rule, start, end, exception):
+    """返回 (title, start_time, end_time, location, description)；该次被取消时返回 None"""
+    if exception is None:
+        return (rule.title, start.strftime(TIME_FORMAT), end.strftime(TIME_FORMAT), rule.location, rule.description)
+    if exception[2]:
+        return None
+    return (exception[3] or rule.title,
+            exception[4] or start.strftime(TIME_FORMAT),
+            exception[5] or end.strftime(TIME_FORMAT),
+            exception[6] or rule.location,
+            exception[7] if exception[7] is not None else rule.description)
+
+
+def expand(user_id, window_start, window_end, conn=None, with_ids=False):
+    """展开用户的重复日程在 [window_start, window_end) 内的每次发生
+
+    返回与 query_events 相同结构的行 (title, start_time, end_time, location, description)，
+    按开始时间排序；window_start/window_end 为 'YYYY-MM-DD HH:MM:SS' 字符串或 datetime。
+    with_ids=True 时每行前面加上 occurrence_id，与 find_event_by_time 的行结构相同。
+    """
+    if isinstance(window_start, datetime):
+        window_start = window_start.strftime(TIME_FORMAT)
+    if isinstance(window_end, datetime):
+        window_end = window_end.strftime(TIME_FORMAT)
+    try:
+        if conn is None:
+            with db.connection() as conn:
+                return _expand(conn, user_id, window_start, window_end, with_ids)
+        return _expand(conn, user_id, window_start, window_end, with_ids)
+    except Exception as e:
+        logger.error(f"展开重复日程时出错：{str(e)}")
+        return []
+
+
+def _expand(conn, user_id, window_start, window_end, with_ids=False):
+    rules = _load_rules(conn, user_id, window_start, window_end)
+    if not rules:
+        return []
+    exceptions = _load_exceptions(conn, [rule.recurrence_id for rule in rules], window_start, window_end)
+    ws = datetime.strptime(window_start, TIME_FORMAT)
+    we = datetime.strptime(window_end, TIME_FORMAT)
+
+    rows = []
+    for rule in rules:
+        overrides = dict(exceptions.get(rule.recurrence_id, {}))
+        for start, end in rule.occurrences(ws, we):
+            occurrence_start = start.strftime(TIME_FORMAT)
+            row = _apply_exception(rule, start, end, overrides.pop(occurrence_start, None))
+            if row and row[1] < window_end and row[2] > window_start:
+                rows.append((format_occurrence_id(rule.recurrence_id, occurrence_start), *row) if with_ids else row)
+        # 原时间在窗口外、改期到窗口内的那些次
+        for occurrence_start, exception in overrides.items():
+            if exception[2] or not exception[4]:
+                continue
+            start = datetime.strptime(occurrence_start, TIME_FORMAT)
+            row = _apply_exception(rule, start, start + rule.duration, exception)
+            if row[1] < window_end and row[2] > window_start:
+                rows.append((format_occurrence_id(rule.recurrence_id, occurrence_start), *row) if with_ids else row)
+    rows.sort(key=lambda row: row[2] if with_ids else row[1])
+    return rows
+
+
+def get_occurrence(occurrence_id, user_id):
+    """按 occurrence_id 读取某一次发生，字段顺序同 expand(with_ids=True)；不存在或已取消时返回 None"""
+    parsed = parse_occurrence_id(occurrence_id)
+    if parsed is None:
+        return None
+    recurrence_id, occurrence_start = parsed
+    start = datetime.strptime(occurrence_start, TIME_FORMAT)
+    try:
+        with db.connection() as conn:
+            row = conn.execute(RULE_BY_ID_SQL, (recurrence_id, user_id)).fetchone()
+            if not row:
+                return None
+            rule = RecurrenceRule.from_row(row)
+            # 规则在这个时间确实有一次发生，防止凭空拼出的 ID 写入例外
+            if all(begin != start for begin, _ in rule.occurrences(start - timedelta(seconds=1), start + timedelta(seconds=1))):
+                return None
+            exception = conn.execute(EXCEPTION_SQL, (recurrence_id, occurrence_start)).fetchone()
+    except Exception as e:
+        logger.error(f"读取重复日程时出错：{str(e)}")
+        return None
+    data = _apply_exception(rule, start, start + rule.duration, exception)
+    return (occurrence_id, *data) if data else None
+
+
+def daily_counts(user_id, first_day, last_day, conn=None):
+    """first_day 到 last_day（含）之间每天重复日程的发生次数 {'YYYY-MM-DD': n}，按开始日期计"""
+    window_start = datetime(first_day.year, first_day.month, first_day.day)
+    window_end = datetime(last_day.year, last_day.month, last_day.day) + timedelta(days=1)
+    counts = {}
+    for row in expand(user_id, window_start, window_end, conn):
+        if row[1] >= window_start.strftime(TIME_FORMAT):
+            counts[row[1][:10]] = counts.get(row[1][:10], 0) + 1
+    return counts
+
+
+def recurrence_tag(user_id):
+    """用户的重复规则或例外变化时，所有月份的月视图和图表缓存都要失效"""
+    return ('recurrence', user_id)
+
+
+def _invalidate(user_id):
+    cache.month_cache.invalidate_tag(recurrence_tag(user_id))
+
+
+def add_rule(user_id, rule_data, invalidate=True):
+    """保存一条重复规则，返回 recurrence_id；rule_data 的字段同 parse_recurrence 的返回值
+
+    在外层事务中调用时传 invalidate=False，由调用方在提交之后失效 recurrence_tag，
+    否则并发的读取可能在提交前把旧数据重新写入缓存。
+    """
+    try:
+        with db.transaction() as conn:
+            cursor = conn.execute('''
+                INSERT INTO EventRecurrences (user_id, title, start_time, end_time, location, description,
+                                              freq, repeat_interval, by_weekday, until, occurrence_count)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                user_id,
+                rule_data['title'],
+                rule_data['start_time'].strftime(TIME_FORMAT),
+                rule_data['end_time'].strftime(TIME_FORMAT),
+                rule_data.get('location'),
+                rule_data.get('description', ''),
+                rule_data['freq'],
+                rule_data.get('interval', 1),
+                ','.join(str(day) for day in rule_data['weekdays']) if rule_data.get('weekdays') else None,
+                rule_data['until'].strftime(TIME_FORMAT) if rule_data.get('until') else None,
+                rule_data.get('count')
+            ))
+            recurrence_id = cursor.lastrowid
+    except Exception as e:
+        logger.error(f"保存重复日程时出错：{str(e)}")
+        return None
+    if invalidate:
+        _invalidate(user_id)
+    return recurrence_id
+
+
+def delete_rule(recurrence_id, user_id):
+    try:
+        with db.transaction() as conn:
+            conn.execute('DELETE FROM RecurrenceExceptions WHERE recurrence_id IN ('
+                         'SELECT recurrence_id FROM EventRecurrences WHERE recurrence_id = ? AND user_id = ?)',
+                         (recurrence_id, user_id))
+            deleted = conn.execute('DELETE FROM EventRecurrences WHERE recurrence_id = ? AND user_id = ?',
+                                   (recurrence_id, user_id)).rowcount
+    except Exception as e:
+        logger.error(f"删除重复日程时出错：{str(e)}")
+        return False
+    _invalidate(user_id)
+    return deleted > 0
+
+
+def set_exception(recurrence_id, user_id, occurrence_start, cancelled=False, invalidate=True, **overrides):
+    """取消某一次（cancelled=True），或修改某一次的 title/start_time/end_time/location/description
+
+    invalidate 的含义同 add_rule。
+    """
+    if isinstance(occurrence_start, datetime):
+        occurrence_start = occurrence_start.strftime(TIME_FORMAT)
+    values = {key: overrides.get(key) for key in ('title', 'start_time', 'end_time', 'location', 'description')}
+    for key in ('start_time', 'end_time'):
+        if isinstance(values[key], datetime):
+            values[key] = values[key].strftime(TIME_FORMAT)
+    try:
+        with db.transaction() as conn:
+            owner = conn.execute('SELECT 1 FROM EventRecurrences WHERE recurrence_id = ? AND user_id = ?',
+                                 (recurrence_id, user_id)).fetchone()
+            if not owner:
+                return False
+            conn.execute('''
+                INSERT OR REPLACE INTO RecurrenceExceptions
+                    (recurrence_id, occurrence_start, cancelled, title, start_time, end_time, location, description)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (recurrence_id, occurrence_start, 1 if cancelled else 0, values['title'], values['start_time'],
+                  values['end_time'], values['location'], values['description']))
+    except Exception as e:
+        logger.error(f"保存重复日程例外时出错：{str(e)}")
+        return False
+    if invalidate:
+        _invalidate(user_id)
+    return True
+
+
+def _number(text, default=1):
+    if not text:
+        return default
+    return int(text) if text.isdigit() else time_parser.cn_to_int(text.replace('两', '二'))
+
+
+def parse_recurrence(message, now=None):
+    """本地解析“每周三下午3点上课”“每天早上8点跑步”这类重复日程
+
+    返回 parse_event 的字段加上 freq/interval/weekdays/until/count，start_time 为第一次发生的时间；
+    消息中没有重复说法、没有具体时间或没有标题时返回 None。
+    """
+    match = RECURRENCE_PATTERN.search(message)
+    if not match:
+        return None
+    now = now or datetime.now()
+
+    weekdays = None
+    if match['workday']:
+        freq, interval, weekdays = 'WEEKLY', 1, [0, 1, 2, 3, 4]
+    elif match['daily']:
+        freq, interval = 'DAILY', _number(match['day_n'])
+    elif match['weekly']:
+        freq, interval = 'WEEKLY', _number(match['week_n'])
+        weekdays = [_WEEKDAYS[char] for char in match['days'] or '' if char in _WEEKDAYS] or None
+    else:
+        freq, interval = 'MONTHLY', _number(match['month_n'])
+
+    if '隔' in match.group():
+        # “每隔一周”即每两周一次
+        interval += 1
+
+    rest = message[:match.start()] + ' ' + message[match.end():]
+    count = until = None
+    count_match = COUNT_PATTERN.search(rest)
+    if count_match:
+        count = _number(count_match['count'])
+        rest = rest[:count_match.start()] + ' ' + rest[count_match.end():]
+    until_match = UNTIL_PATTERN.search(rest)
+    if until_match:
+        until_day, _, _ = time_parser.find_date(until_match['until'], now.date())
+        if until_day:
+            until = datetime(until_day.year, until_day.month, until_day.day, 23, 59, 59)
+            rest = rest[:until_match.start()] + ' ' + rest[until_match.end():]
+
+    event = time_parser.parse_event(rest, now)
+    if not event['start_time'] or not event['title'] or time_parser.QUERY_WORDS.search(message):
+        return None
+
+    # 第一次发生：从今天（或消息中指定的起始日期）起第一个符合规则的日期
+    first = event['start_time']
+    duration = event['end_time'] - first
+    if freq == 'MONTHLY':
+        month_day = _number(match['month_day'])
+        candidate = None
+        for offset in range(0, 24):
+            total = first.month - 1 + offset
+            try:
+                candidate = first.replace(year=first.year + total // 12, month=total % 12 + 1, day=month_day)
+            except ValueError:
+                continue
+            if candidate >= first.replace(hour=0, minute=0):
+                break
+        first = candidate
+    elif freq == 'WEEKLY':
+        days = weekdays or [first.weekday()]
+        offset = min((day - first.weekday()) % 7 for day in days)
+        first = first + timedelta(days=offset)
+        weekdays = days
+
+    return {
+        'title': event['title'],
+        'start_time': first,
+        'end_time': first + duration,
+        'location': event['location'],
+        'description': '',
+        'freq': freq,
+        'interval': interval,
+        'weekdays': weekdays,
+        'until': until,
+        'count': count,
+    }
+
+
+def describe(rule_data):
+    """重复规则的中文说明，用于确认消息"""
+    names = '一二三四五六日'
+    interval = rule_data.get('interval', 1)
+    if rule_data['freq'] == 'DAILY':
+        text = '每天' if interval == 1 else f'每{interval}天'
+    elif rule_data['freq'] == 'WEEKLY':
+        weekdays = rule_data.get('weekdays') or [rule_data['start_time'].weekday()]
+        if list(weekdays) == [0, 1, 2, 3, 4] and interval == 1:
+            text = '每个工作日'
+        else:
+            text = ('每周' if interval == 1 else f'每{interval}周') + '、'.join(names[day] for day in weekdays)
+    else:
+        text = ('每月' if interval == 1 else f'每{interval}个月') + f"{rule_data['start_time'].day}日"
+    if rule_data.get('count'):
+        text += f"，共{rule_data['count']}次"
+    if rule_data.get('until'):
+        text += f"，到{rule_data['until'].strftime('%Y-%m-%d')}为止"
+    return text
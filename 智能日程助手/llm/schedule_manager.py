@@ -1,152 +1,166 @@
-from langchain_community.chat_models.tongyi import ChatTongyi 
-from langchain.chains import ConversationChain
-from langchain.memory import ConversationBufferMemory
-from langchain.prompts import PromptTemplate
 from datetime import datetime, timedelta
 import os
-from dotenv import load_dotenv
-import sqlite3
 import re
+import json
+import heapq
+from dotenv import load_dotenv
 import logging
+import db
+import stats
+import cache
+import intent_router
+import time_parser
+import llm_cache
+import conversation_memory
+import conversation_state
+import fts
+import conflicts
+import free_slots
+import recurrence
+import bulk_io
+import event_record
+import event_pages
+import queries
+import llm_gateway
+from fake_llm import FakeLLM
+from event_record import EventRecord, minute_text, clock_text
+from time_range import RANGE_PREDICATE, TIME_FORMAT, MAX_EVENT_SPAN_DAYS, day_range, days_range, month_range
 
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 load_dotenv()
 
-class ScheduleManager:
-    def __init__(self):
-        self.api_error = False
-        self.user_states = {}  # 添加用户状态管理
-        try:
-            api_key = os.getenv("DASHSCOPE_API_KEY")
-            
-            self.llm = ChatTongyi(
-                model="qwen-plus",
-                dashscope_api_key=api_key
-            )
-            
-            # 初始化数据库
-            self.init_database()
-            
-            # 创建提示模板
-            template = """你是一个专业的日程管理助手。你可以帮助用户管理他们的日程安排，包括添加、修改、删除和查询日程。会话语气要温和，不要使用命令的语气。
-            现在的时间是：{input}
+# 关键词搜索每页返回的日程数
+SEARCH_PAGE_SIZE = int(os.getenv("SCHEDULE_SEARCH_PAGE_SIZE", "50"))
+# 日历范围接口每页读取的行数，以及单次请求允许的最大天数
+CALENDAR_FETCH_SIZE = 500
+CALENDAR_MAX_RANGE_DAYS = int(os.getenv("SCHEDULE_CALENDAR_MAX_RANGE_DAYS", "366"))
+# 聊天中"查看所有日程"最多列出的日程数
+ALL_EVENTS_REPLY_LIMIT = int(os.getenv("SCHEDULE_ALL_EVENTS_REPLY_LIMIT", "20"))
+# 一条消息中最多批量添加的日程数
+MAX_BATCH_EVENTS = int(os.getenv("SCHEDULE_MAX_BATCH_EVENTS", "50"))
+# qwen：调用 DashScope；fake：本地模拟（无需 API Key，可注入延迟和错误）
+LLM_BACKEND = os.getenv("SCHEDULE_LLM_BACKEND", "qwen")
+
+# AI 不可用时聊天的回复
+LLM_UNAVAILABLE_REPLY = "抱歉，AI 助手暂时繁忙，请稍后再试。添加、查询、修改和删除日程仍然可以正常使用。"
+
+CHAT_TEMPLATE = """你是一个专业的日程管理助手。你可以帮助用户管理他们的日程安排，包括添加、修改、删除和查询日程。会话语气要温和，不要使用命令的语气。
             
             当前对话历史：
             {history}
             
             人类：{input}
             AI助手："""
-            
-            self.prompt = PromptTemplate(
-                input_variables=["history", "input"],
-                template=template
-            )
-            
-            # 设置对话记忆
-            self.memory = ConversationBufferMemory()
-            
-            # 创建对话链
-            self.conversation = ConversationChain(
-                llm=self.llm,
-                memory=self.memory,
-                prompt=self.prompt,
-                verbose=True
-            )
-            
+
+
+def create_llm():
+    """创建大模型客户端：ChatTongyi 的导入（LangChain、dashscope）耗时较长，推迟到第一次调用"""
+    if LLM_BACKEND == 'fake':
+        return FakeLLM()
+    from langchain_community.chat_models.tongyi import ChatTongyi
+
+    # 重试和超时由 llm_gateway 负责：关闭 tenacity 重试（默认 10 次），并把 DashScope 的请求超时
+    # （默认 300 秒）限制在网关的截止时间内，网关放弃之后底层请求不会继续占用并发名额
+    return ChatTongyi(
+        model="qwen-plus",
+        dashscope_api_key=os.getenv("DASHSCOPE_API_KEY"),
+        max_retries=0,
+        model_kwargs={'request_timeout': llm_gateway.LLM_TIMEOUT}
+    )
+
+
+QUERY_KEYWORDS = re.compile(r'课程|课|会议|会|考试|作业')
+QUERY_MONTH = re.compile(r'(\d{1,2})\s*月')
+
+
+def local_query_intent(message, today=None):
+    """AI 不可用时按规则构造与 AI 返回相同结构的查询意图"""
+    keywords = list(dict.fromkeys(QUERY_KEYWORDS.findall(message)))
+    day, _, _ = time_parser.find_date(message, today)
+    month = QUERY_MONTH.search(message)
+    if day:
+        time_range = {'type': 'specific_date', 'date': day.strftime('%Y-%m-%d')}
+    elif month:
+        time_range = {'type': 'specific_month', 'month': int(month.group(1))}
+    else:
+        time_range = {'type': 'all'}
+    return {'keywords': keywords, 'time_range': time_range}
+
+
+class ScheduleManager:
+    def __init__(self):
+        self.api_error = False
+        # 多轮操作（选择要删除/修改的日程）的会话状态
+        self.states = conversation_state.ConversationStateStore()
+        try:
+            # 所有大模型调用都经过网关：限制并发、截止时间、重试和熔断；
+            # 客户端在第一条需要 AI 的消息到来时才创建，启动时不导入 LangChain
+            self.gateway = llm_gateway.LLMGateway(factory=create_llm)
+            self._prompt = None
+
+            # 按用户隔离的对话记忆，只保留最近几轮
+            self.memory = conversation_memory.ConversationMemoryStore()
+
         except Exception as e:
             print(f"初始化 AI 助手时出错：{str(e)}")
             self.api_error = True
-    
-    def init_database(self):
-        """初始化数据库和必要的表"""
-        try:
-            conn = sqlite3.connect('schedule_manager.db')
-            cursor = conn.cursor()
-            
-            # 创建 Events 表
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS Events (
-                    event_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    title TEXT NOT NULL,
-                    description TEXT,
-                    start_time DATETIME NOT NULL,
-                    end_time DATETIME NOT NULL,
-                    location TEXT,
-                    is_all_day BOOLEAN DEFAULT FALSE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            conn.commit()
-            print("数据库初始化成功")
-            
-        except Exception as e:
-            print(f"初始化数据库时出错：{str(e)}")
-        finally:
-            if conn:
-                conn.close()
-    
+
+    @property
+    def llm(self):
+        return self.gateway.llm
+
+    @llm.setter
+    def llm(self, llm):
+        self.gateway.llm = llm
+
+    @property
+    def prompt(self):
+        """对话提示模板，第一次使用时才导入 LangChain 创建"""
+        if self._prompt is None:
+            from langchain.prompts import PromptTemplate
+
+            self._prompt = PromptTemplate(
+                input_variables=["history", "input"],
+                template=CHAT_TEMPLATE
+            )
+        return self._prompt
+
+    def _invalidate_cache(self, user_id, start_time, end_time):
+        """日程变更后失效其覆盖月份的月视图和图表缓存"""
+        if isinstance(start_time, str):
+            start_time = datetime.strptime(start_time[:10], '%Y-%m-%d')
+        if isinstance(end_time, str):
+            end_time = datetime.strptime(end_time[:10], '%Y-%m-%d')
+        cache.invalidate_event_span(user_id, start_time, end_time)
+
     def parse_schedule(self, message):
-        """使用 AI 解析任意格式的日程信息"""
+        """解析日程信息：优先本地规则解析，无法确定时使用 AI"""
         logger.debug(f"尝试解析日程信息: {message}")
         
         try:
-            # 检查是否是简单的修改指令
-            time_patterns = {
-                r'改到下午(\d{1,2})点(\d{1,2})?分?': lambda m: f"{int(m.group(1))+12:02d}:{int(m.group(2) or '0'):02d}",
-                r'改到上午(\d{1,2})点(\d{1,2})?分?': lambda m: f"{int(m.group(1)):02d}:{int(m.group(2) or '0'):02d}",
-                r'改到(\d{1,2})[:：](\d{1,2})': lambda m: f"{int(m.group(1)):02d}:{int(m.group(2)):02d}",
-                r'改到(\d{1,2})点(\d{1,2})?分?': lambda m: f"{int(m.group(1)):02d}:{int(m.group(2) or '0'):02d}",
-            }
-            
-            location_pattern = r'改到(.*?)(室|厅|楼|层|会议室|地点|场|中心|$)'
-            location_match = re.search(location_pattern, message)
-            
-            # 如果是位置修改
-            if location_match:
+            # 简单的修改指令（改到下午3点、地点改到会议室A）直接在本地解析
+            change = time_parser.parse_change(message)
+            if change:
+                time_parser.stats.record(local=True)
+                return change
+
+            # 常见的新增说法在本地解析，置信度不足时才调用 AI
+            parsed = time_parser.parse_event(message)
+            if parsed['confidence'] >= time_parser.CONFIDENCE_THRESHOLD:
+                time_parser.stats.record(local=True)
+                logger.debug(f"本地解析结果: {parsed}")
                 return {
-                    'is_schedule': True,
-                    'location': location_match.group(1) + location_match.group(2),
-                    'title': None,  # 保持原标题
-                    'start_time': None,  # 保持原时间
-                    'end_time': None,
-                    'description': ''
+                    'title': parsed['title'],
+                    'start_time': parsed['start_time'],
+                    'end_time': parsed['end_time'],
+                    'location': parsed['location'],
+                    'description': parsed['description']
                 }
-            
-            # 如果是时间修改
-            for pattern, time_formatter in time_patterns.items():
-                time_match = re.search(pattern, message)
-                if time_match:
-                    time_str = time_formatter(time_match)
-                    hour, minute = map(int, time_str.split(':'))
-                    
-                    # 检查是否指定了日期
-                    date = self.parse_date_from_message(message)
-                    if not date:
-                        date = datetime.now()
-                    
-                    new_time = datetime(
-                        date.year,
-                        date.month,
-                        date.day,
-                        hour,
-                        minute
-                    )
-                    
-                    return {
-                        'is_schedule': True,
-                        'title': None,  # 保持原标题
-                        'start_time': new_time,
-                        'end_time': new_time + timedelta(hours=1),
-                        'location': None,  # 保持原位置
-                        'description': ''
-                    }
-            
-            # 如果不是简单修改，使用原有的 AI 解析
+            time_parser.stats.record(local=False)
+
+            # 本地无法确定时，使用 AI 解析
             parse_prompt = f"""请帮我解析这段文本中的日程信息，并按以下 JSON 格式返回（仅返回 JSON，不要其他文字）：
 {{
     "is_schedule": true/false,  // 这是否是一个日程安排
@@ -160,14 +174,26 @@ class ScheduleManager:
 用户输入: {message}
 当前时间: {datetime.now().strftime('%Y-%m-%d %H:%M')}"""
 
-            # 使用 AI 解析
-            response = self.llm.invoke(parse_prompt)
-            
+            # 使用 AI 解析；相同说法（相对日期换算后）直接使用缓存的响应
+            content = llm_cache.responses.get('parse_schedule', message)
+            from_cache = content is not None
+            if not from_cache:
+                try:
+                    content = self.gateway.invoke(parse_prompt, kind='parse_schedule',
+                                                  timeout=llm_gateway.LLM_PARSE_TIMEOUT).content
+                except llm_gateway.LLMUnavailable as e:
+                    # AI 不可用时退回本地解析结果，只要有标题和时间就先用它
+                    logger.warning(f"AI 解析不可用，使用本地解析结果: {str(e)}")
+                    if parsed['start_time'] and parsed['title']:
+                        return {key: parsed[key] for key in ('title', 'start_time', 'end_time', 'location', 'description')}
+                    return None
+
             try:
                 # 尝试解析 JSON 响应
-                import json
-                schedule_data = json.loads(response.content)
-                
+                schedule_data = json.loads(content)
+                if not from_cache:
+                    llm_cache.responses.set('parse_schedule', message, content)
+
                 logger.debug(f"AI 解析结果: {schedule_data}")
                 
                 # 验证是否为日程信息
@@ -205,81 +231,177 @@ class ScheduleManager:
             logger.error(f"调用 AI 解析时出错: {str(e)}")
             return None
     
+    def parse_schedules(self, segments, message):
+        """从一次粘贴的多条文本中解析多个日程
+
+        每条都能在本地解析时不调用 AI；否则把整条消息交给 AI 一次性返回日程列表。
+        返回 [{'source': 原文, 'data': 日程数据或 None, 'error': 失败原因}]，顺序与原文一致。
+        """
+        local_items = []
+        for segment in segments[:MAX_BATCH_EVENTS]:
+            data = recurrence.parse_recurrence(segment)
+            if data is None:
+                parsed = time_parser.parse_event(segment)
+                if parsed['confidence'] >= time_parser.CONFIDENCE_THRESHOLD:
+                    data = {key: parsed[key] for key in ('title', 'start_time', 'end_time', 'location', 'description')}
+            local_items.append({'source': segment, 'data': data,
+                                'error': None if data else "AI 暂时不可用，未能识别"})
+        if all(item['data'] for item in local_items):
+            time_parser.stats.record(local=True)
+            return local_items
+        time_parser.stats.record(local=False)
+
+        parse_prompt = f"""请从这段文本中找出所有日程安排，并按以下 JSON 格式返回（仅返回 JSON，不要其他文字）：
+{{
+    "events": [
+        {{
+            "source": "该日程对应的原文",
+            "title": "日程标题",
+            "start_time": "YYYY-MM-DD HH:mm",  // 开始时间
+            "end_time": "YYYY-MM-DD HH:mm",    // 结束时间，如果没有明确指定则设为开始时间后1小时
+            "location": "地点",                 // 如果没有则设为"未指定地点"
+            "description": "描述"              // 如果没有则设为空字符串
+        }}
+    ]
+}}
+文本中没有日程时返回 {{"events": []}}。
+
+用户输入: {message}
+当前时间: {datetime.now().strftime('%Y-%m-%d %H:%M')}"""
+
+        try:
+            content = llm_cache.responses.get('parse_schedules', message)
+            from_cache = content is not None
+            if not from_cache:
+                content = self.gateway.invoke(parse_prompt, kind='parse_schedules',
+                                              timeout=llm_gateway.LLM_PARSE_TIMEOUT).content
+            events = json.loads(content).get('events') or []
+            if not from_cache:
+                llm_cache.responses.set('parse_schedules', message, content)
+        except llm_gateway.LLMUnavailable as e:
+            # AI 不可用时只保存本地能识别的条目，其余逐条提示
+            logger.warning(f"AI 批量解析不可用，使用本地解析结果: {str(e)}")
+            return local_items
+        except Exception as e:
+            logger.error(f"AI 批量解析日程时出错: {str(e)}")
+            return []
+
+        items = []
+        for event in events[:MAX_BATCH_EVENTS]:
+            source = event.get('source') or event.get('title') or ''
+            try:
+                try:
+                    start_time = datetime.strptime(event['start_time'], '%Y-%m-%d %H:%M')
+                    end_time = (datetime.strptime(event['end_time'], '%Y-%m-%d %H:%M')
+                                if event.get('end_time') else start_time + timedelta(hours=1))
+                except (KeyError, TypeError, ValueError):
+                    raise ValueError("时间格式无效")
+                if not event.get('title'):
+                    raise ValueError("缺少标题")
+                if end_time <= start_time:
+                    raise ValueError("结束时间不晚于开始时间")
+            except ValueError as e:
+                items.append({'source': source, 'data': None, 'error': str(e)})
+                continue
+            items.append({'source': source, 'data': {
+                'title': event['title'],
+                'start_time': start_time,
+                'end_time': end_time,
+                'location': event.get('location') or time_parser.DEFAULT_LOCATION,
+                'description': event.get('description') or ''
+            }, 'error': None})
+        return items
+
+    def save_schedules(self, items, user_id):
+        """在一个事务中保存 parse_schedules 解析出的全部日程，返回带有每条结果的 items"""
+        records = []
+        for item in items:
+            if item['data'] is not None:
+                records.append(dict(item['data'], is_all_day=False))
+        if not records:
+            return items
+        result = bulk_io.import_events(user_id, records, chunk_size=len(records))
+        saved = result['failed'] == 0
+        for item in items:
+            if item['data'] is not None:
+                item['saved'] = saved
+                if not saved:
+                    item['error'] = "保存失败"
+        return items
+
+    def _batch_message(self, items):
+        saved = [item for item in items if item.get('saved')]
+        response = f"已成功添加 {len(saved)} 个日程（共 {len(items)} 条）：\n"
+        for index, item in enumerate(items, 1):
+            data = item['data']
+            if item.get('saved'):
+                when = (recurrence.describe(data) + ' ' + data['start_time'].strftime('%H:%M')
+                        if 'freq' in data else data['start_time'].strftime('%Y-%m-%d %H:%M'))
+                response += f"\n{index}. ✅ {data['title']}  ⏰ {when} - {data['end_time'].strftime('%H:%M')}"
+            else:
+                response += f"\n{index}. ❌ {item['source']}：{item['error']}"
+        return response
+
     def save_schedule(self, schedule_data, user_id):
         """保存日程到数据库"""
         try:
-            conn = sqlite3.connect('schedule_manager.db')
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                INSERT INTO Events (user_id, title, start_time, end_time, location)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (
-                user_id,  # 使用传入的 user_id
-                schedule_data['title'],
-                schedule_data['start_time'].strftime('%Y-%m-%d %H:%M:%S'),
-                schedule_data['end_time'].strftime('%Y-%m-%d %H:%M:%S'),
-                schedule_data['location']
-            ))
-            
-            conn.commit()
+            with db.transaction() as conn:
+                cursor = conn.cursor()
+
+                cursor.execute('''
+                    INSERT INTO Events (user_id, title, start_time, end_time, location)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (
+                    user_id,  # 使用传入的 user_id
+                    schedule_data['title'],
+                    schedule_data['start_time'].strftime('%Y-%m-%d %H:%M:%S'),
+                    schedule_data['end_time'].strftime('%Y-%m-%d %H:%M:%S'),
+                    schedule_data['location']
+                ))
+                stats.adjust_daily_count(cursor, user_id, schedule_data['start_time'], 1)
+                fts.sync(cursor)
+
+            self._invalidate_cache(user_id, schedule_data['start_time'], schedule_data['end_time'])
             logger.debug(f"日程保存成功: {schedule_data}")
             return True
         except Exception as e:
             logger.error(f"保存日程时出错：{str(e)}")
             return False
-        finally:
-            if conn:
-                conn.close()
     
     def query_events(self, query_type, user_id, start_date=None, end_date=None):
         """查询日程
-        query_type: 查询类型 (today/tomorrow/week/all)
+        query_type: 查询类型 (today/tomorrow/week/all)；all 最多返回 event_pages.MAX_PAGE_SIZE 条
         """
         try:
-            conn = sqlite3.connect('schedule_manager.db')
-            cursor = conn.cursor()
-            
-            current_date = datetime.now().date()
-            
-            if query_type == "today":
-                start = current_date.strftime('%Y-%m-%d 00:00:00')
-                end = current_date.strftime('%Y-%m-%d 23:59:59')
-            elif query_type == "tomorrow":
-                tomorrow = current_date + timedelta(days=1)
-                start = tomorrow.strftime('%Y-%m-%d 00:00:00')
-                end = tomorrow.strftime('%Y-%m-%d 23:59:59')
-            elif query_type == "week":
-                start = current_date.strftime('%Y-%m-%d 00:00:00')
-                end = (current_date + timedelta(days=7)).strftime('%Y-%m-%d 23:59:59')
-            elif query_type == "custom":
-                start = start_date.strftime('%Y-%m-%d 00:00:00')
-                end = end_date.strftime('%Y-%m-%d 23:59:59')
-            else:  # all
-                cursor.execute('''
-                    SELECT title, start_time, end_time, location, description
-                    FROM Events
-                    WHERE user_id = ?
-                    ORDER BY start_time
-                ''', (user_id,))
-                return cursor.fetchall()
+            with db.connection() as conn:
+                cursor = conn.cursor()
+
+                current_date = datetime.now().date()
+
+                if query_type == "today":
+                    start, end = day_range(current_date)
+                elif query_type == "tomorrow":
+                    start, end = day_range(current_date + timedelta(days=1))
+                elif query_type == "week":
+                    start, end = days_range(current_date, current_date + timedelta(days=7))
+                elif query_type == "custom":
+                    start, end = days_range(start_date, end_date)
+                else:  # all：只取第一页，完整列表通过 /api/events 分页读取
+                    rows, _ = event_pages.fetch(user_id, limit=event_pages.MAX_PAGE_SIZE)
+                    return [row[1:] for row in rows]
+
+                cursor.execute(queries.EVENTS_IN_RANGE, (user_id, start, end))
+                rows = cursor.fetchall()
+
+                # 合并查询范围内重复日程的各次发生
+                occurrences = recurrence.expand(user_id, start, end, conn)
+                if not occurrences:
+                    return rows
+                return sorted(list(rows) + occurrences, key=lambda row: row[1])
 
-            cursor.execute('''
-                SELECT title, start_time, end_time, location, description
-                FROM Events
-                WHERE start_time BETWEEN ? AND ?
-                AND user_id = ?
-                ORDER BY start_time
-            ''', (start, end, user_id))
-            
-            return cursor.fetchall()
-            
         except Exception as e:
             logger.error(f"查询日程时出错：{str(e)}")
             return []
-        finally:
-            if conn:
-                conn.close()
 
     def format_events_response(self, events):
         """格式化日程查询结果的响应"""
@@ -289,11 +411,9 @@ class ScheduleManager:
         response = "为您找到以下日程安排：\n"
         for event in events:
             title, start_time, end_time, location, description = event
-            start = datetime.strptime(start_time, '%Y-%m-%d %H:%M:%S')
-            end = datetime.strptime(end_time, '%Y-%m-%d %H:%M:%S')
-            
+
             response += f"\n📅 {title}\n"
-            response += f"⏰ {start.strftime('%Y-%m-%d %H:%M')} - {end.strftime('%H:%M')}\n"
+            response += f"⏰ {minute_text(start_time)} - {clock_text(end_time)}\n"
             if location and location != "未指定地点":
                 response += f"📍 {location}\n"
             if description:
@@ -304,19 +424,69 @@ class ScheduleManager:
 
     def process_message(self, message, user_id):
         """处理用户消息并返回响应"""
+        response = self._route_message(message, user_id)
+        if response is not None:
+            return response
+        try:
+            prompt = self._chat_prompt(message, user_id)
+            response = self.gateway.invoke(prompt, kind='chat').content
+            self.memory.append(user_id, message, response)
+            return response
+        except llm_gateway.LLMUnavailable as e:
+            logger.warning(f"AI 对话不可用: {str(e)}")
+            return LLM_UNAVAILABLE_REPLY
+        except Exception as e:
+            logger.error(f"处理消息时出错: {str(e)}")
+            return f"处理消息时出错：{str(e)}"
+
+    def stream_message(self, message, user_id):
+        """逐段产出回复的生成器
+
+        规则能直接处理的消息（增删改查）一次产出完整回复；
+        落到 AI 对话的消息通过网关的 stream 逐段产出，结束后写入该用户的对话记忆。
+        """
+        response = self._route_message(message, user_id)
+        if response is not None:
+            yield response
+            return
+        parts = []
+        try:
+            prompt = self._chat_prompt(message, user_id)
+            for chunk in self.gateway.stream(prompt, kind='chat'):
+                if chunk.content:
+                    parts.append(chunk.content)
+                    yield chunk.content
+            self.memory.append(user_id, message, ''.join(parts))
+        except llm_gateway.LLMUnavailable as e:
+            logger.warning(f"AI 流式对话不可用: {str(e)}")
+            yield ("\n" if parts else "") + LLM_UNAVAILABLE_REPLY
+        except Exception as e:
+            logger.error(f"流式处理消息时出错: {str(e)}")
+            yield f"处理消息时出错：{str(e)}"
+
+    def _chat_prompt(self, message, user_id):
+        """拼接该用户最近几轮对话和当前消息；记忆中只保存消息原文，不含时间前缀"""
+        current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        return self.prompt.format(
+            history=self.memory.history_text(user_id),
+            input=f"当前时间：{current_time}\n用户问题：{message}"
+        )
+
+    def _route_message(self, message, user_id):
+        """按规则处理消息；需要交给 AI 对话时返回 None"""
         try:
             logger.debug(f"收到消息: {message}")
-            
+
+            # 一次匹配得到意图和槽位，规则见 intent_router.INTENT_RULES
+            intent, slots = intent_router.route(message)
+            logger.debug(f"识别意图: {intent} {slots}")
+
+            # 空闲时间查询直接由本地数据计算
+            if intent == 'free_slots':
+                return self.answer_free_slots(message, user_id)
+
             # 添加智能查询处理
-            query_patterns = [
-                r"(什么时候|何时|哪天).*?(有|的|是).*?(课|课程|会议|安排)",
-                r"(\d{1,2})月.*?(有|的).*?(课|课程|会议|安排)",
-                r"(今天|明天|下周|这周|本周).*?(有|的).*?(课|课程|会议|安排)"
-            ]
-            
-            is_query = any(re.search(pattern, message) for pattern in query_patterns)
-            
-            if is_query:
+            if intent == 'smart_query':
                 # 使用 LangChain 解析查询意图
                 parse_prompt = f"""请分析这个查询请求，并返回以下 JSON 格式的结果（仅返回 JSON）：
 {{
@@ -331,12 +501,23 @@ class ScheduleManager:
 用户查询: {message}
 当前时间: {datetime.now().strftime('%Y-%m-%d %H:%M')}"""
 
-                response = self.llm.invoke(parse_prompt)
-                
+                content = llm_cache.responses.get('query_intent', message)
+                from_cache = content is not None
+                query_intent = None
+                if not from_cache:
+                    try:
+                        content = self.gateway.invoke(parse_prompt, kind='query_intent',
+                                                      timeout=llm_gateway.LLM_PARSE_TIMEOUT).content
+                    except llm_gateway.LLMUnavailable as e:
+                        logger.warning(f"AI 查询意图解析不可用，使用本地规则: {str(e)}")
+                        query_intent = local_query_intent(message)
+
                 try:
-                    import json
-                    query_intent = json.loads(response.content)
-                    
+                    if query_intent is None:
+                        query_intent = json.loads(content)
+                        if not from_cache:
+                            llm_cache.responses.set('query_intent', message, content)
+
                     # 根据意图执行查询
                     events = []
                     if query_intent.get('keywords'):
@@ -347,13 +528,12 @@ class ScheduleManager:
                     if time_range.get('type') == 'specific_month':
                         month = time_range.get('month')
                         if month:
-                            year = datetime.now().year
-                            events = [e for e in events if datetime.strptime(e[1], '%Y-%m-%d %H:%M:%S').month == month]
+                            events = [e for e in events if int(e[1][5:7]) == month]
                     elif time_range.get('type') == 'specific_date':
                         date = time_range.get('date')
                         if date:
-                            target_date = datetime.strptime(date, '%Y-%m-%d').date()
-                            events = [e for e in events if datetime.strptime(e[1], '%Y-%m-%d %H:%M:%S').date() == target_date]
+                            target_date = datetime.strptime(date, '%Y-%m-%d').strftime('%Y-%m-%d')
+                            events = [e for e in events if e[1][:10] == target_date]
                     
                     return self.format_events_response(events)
                     
@@ -361,38 +541,36 @@ class ScheduleManager:
                     logger.error("AI 响应解析失败")
                     
             # 检查是否是序号选择（用于修改或删除）
-            number_match = re.match(r'^(\d+)$', message.strip())
-            if number_match:
-                user_state = self.user_states.get(user_id, {})
-                events = user_state.get('events', [])
-                operation = user_state.get('operation')  # 新增：记录操作类型
-                
-                if not events:
+            if intent == 'select':
+                state = self.states.get(user_id)
+                if not state or not state.event_ids:
                     return "抱歉，请先告诉我您要操作哪个日程。"
-                
-                selected_index = int(number_match.group(1)) - 1
-                if selected_index < 0 or selected_index >= len(events):
+
+                selected_index = int(slots['index']) - 1
+                if selected_index < 0 or selected_index >= len(state.event_ids):
                     return "抱歉，请输入正确的序号。"
-                
-                selected_event = events[selected_index]
-                
+
+                selected_event = self.get_event(state.event_ids[selected_index], user_id)
+                if not selected_event:
+                    self.states.clear(user_id)
+                    return "该日程已不存在，请重新查询。"
+
                 # 根据操作类型处理
-                if operation == 'delete':
+                if state.operation == 'delete':
                     # 执行删除操作
                     success = self.delete_event(selected_event[0], user_id)
                     # 清除状态
-                    self.user_states[user_id] = {}
+                    self.states.clear(user_id)
                     if success:
-                        return f"已删除日程：\n📅 {selected_event[1]}\n⏰ {datetime.strptime(selected_event[2], '%Y-%m-%d %H:%M:%S').strftime('%H:%M')}"
+                        return self._deleted_message(selected_event)
                     else:
                         return "删除日程失败，请稍后重试。"
-                elif operation == 'modify':
-                    # 原有的修改逻辑
-                    self.user_states[user_id]['selected_event'] = selected_event
+                elif state.operation == 'modify':
+                    self.states.select(user_id, selected_event[0])
                     return (f"好的，您要如何修改这个日程？\n"
                            f"当前日程信息：\n"
                            f"📅 {selected_event[1]}\n"
-                           f"⏰ {datetime.strptime(selected_event[2], '%Y-%m-%d %H:%M:%S').strftime('%H:%M')}\n"
+                           f"⏰ {clock_text(selected_event[2])}\n"
                            f"📍 {selected_event[4] if selected_event[4] else '未指定地点'}\n\n"
                            f"您可以：\n"
                            f"- 改到下午3点\n"
@@ -403,20 +581,7 @@ class ScheduleManager:
                 return "请指定要执行的操作。"
 
             # 检查是否是删除请求
-            delete_patterns = [
-                r"删除.*日程",
-                r"删掉.*日程",
-                r"取消.*日程",
-                r"删除.*安排",
-                r"删掉.*安排",
-                r"取消.*安排",
-                r"删.*",
-                r"取消.*"
-            ]
-            
-            is_delete_request = any(re.search(pattern, message) for pattern in delete_patterns)
-            
-            if is_delete_request:
+            if intent == 'delete':
                 date = self.parse_date_from_message(message)
                 if not date:
                     return "请指定要删除哪一天的日程。"
@@ -426,72 +591,39 @@ class ScheduleManager:
                     return f"未找到{date.strftime('%Y-%m-%d')}的日程。"
                 elif len(events) > 1:
                     # 保存查询结果到用户状态
-                    self.user_states[user_id] = {
-                        'events': events,
-                        'operation': 'delete'  # 标记操作类型为删除
-                    }
+                    self.states.set(user_id, 'delete', [event[0] for event in events])
                     
                     response = "找到多个日程，请选择要删除哪一个：\n"
                     for idx, event in enumerate(events, 1):
-                        response += f"{idx}. {event[1]} ({datetime.strptime(event[2], '%Y-%m-%d %H:%M:%S').strftime('%H:%M')})\n"
+                        response += f"{idx}. {event[1]} ({clock_text(event[2])})\n"
                     return response
                 else:
                     # 只有一个日程时直接删除
                     event = events[0]
                     if self.delete_event(event[0], user_id):
-                        return f"已删除日程：\n📅 {event[1]}\n⏰ {datetime.strptime(event[2], '%Y-%m-%d %H:%M:%S').strftime('%H:%M')}"
+                        return self._deleted_message(event)
                     else:
                         return "删除日程失败，请稍后重试。"
             
             # 检查是否是修改请求
-            modify_patterns = [
-                r"修改.*日程",
-                r"更改.*日程",
-                r"调整.*日程",
-                r"改一下.*日程",
-                r"把.*日程.*改成",
-                r"将.*日程.*改为",
-                # 添加更多常见的修改表达方式
-                r"修改.*行程",
-                r"更改.*行程",
-                r"调整.*行程",
-                r"改.*时间",
-                r"改.*地点",
-                r"换.*时间",
-                r"换.*地点",
-                r"改到.*",
-                r"调到.*",
-                r"改成.*",
-                r"改为.*"
-            ]
-            
-            is_modify_request = (
-                any(re.search(pattern, message) for pattern in modify_patterns) or
-                ("改" in message and any(time_word in message for time_word in ["明天", "今天", "后天", "早上", "下午", "晚上"]))
-            )
-            
-            if is_modify_request:
+            if intent == 'modify':
                 # 检查是否有选中的事件需要修改
-                user_state = self.user_states.get(user_id, {})
-                selected_event = user_state.get('selected_event')
-                
-                if selected_event:
+                state = self.states.get(user_id)
+                selected_id = state.selected_id if state else None
+
+                if selected_id:
                     # 处理对已选中事件的修改
                     updated_data = self.parse_schedule(message)
                     if updated_data:
-                        success, msg = self.update_event(selected_event[0], updated_data, user_id)
+                        success, msg = self.update_event(selected_id, updated_data, user_id)
                         # 清除状态
-                        self.user_states[user_id] = {}
-                        return msg if not success else f"已成功修改日程：\n📅 {updated_data['title']}\n⏰ {updated_data['start_time'].strftime('%Y-%m-%d %H:%M')} - {updated_data['end_time'].strftime('%H:%M')}\n📍 {updated_data['location']}"
+                        self.states.clear(user_id)
+                        return msg if not success else self._modified_message(selected_id, user_id)
                 
                 # 如果没有选中的事件，继续原有的修改流程
-                title_match = (
-                    re.search(r"「(.+?)」", message) or
-                    re.search(r'"(.+?)"', message) or
-                    re.search(r'"(.+?)"', message)
-                )
-                
-                if not title_match:
+                title = intent_router.extract_title(message)
+
+                if not title:
                     date = self.parse_date_from_message(message)
                     if not date:
                         return "请指定要修改哪个日程，可以用引号括起来或者指定具体时间。"
@@ -501,11 +633,11 @@ class ScheduleManager:
                         return f"未找到{date.strftime('%Y-%m-%d')}的日程。"
                     elif len(events) > 1:
                         # 保存查询结果到用户状态
-                        self.user_states[user_id] = {'events': events}
+                        self.states.set(user_id, 'modify', [event[0] for event in events])
                         
                         response = "找到多个日程，请指定要修改哪一个：\n"
                         for idx, event in enumerate(events, 1):
-                            response += f"{idx}. {event[1]} ({datetime.strptime(event[2], '%Y-%m-%d %H:%M:%S').strftime('%H:%M')})\n"
+                            response += f"{idx}. {event[1]} ({clock_text(event[2])})\n"
                         return response
                     else:
                         event = events[0]
@@ -514,153 +646,183 @@ class ScheduleManager:
                             return "无法解析要修改的内容，请确保包含新的日程信息。"
                         
                         success, msg = self.update_event(event[0], updated_data, user_id)
-                        return msg if not success else f"已成功修改日程：\n📅 {updated_data['title']}\n⏰ {updated_data['start_time'].strftime('%Y-%m-%d %H:%M')} - {updated_data['end_time'].strftime('%H:%M')}\n📍 {updated_data['location']}"
-            
+                        return msg if not success else self._modified_message(event[0], user_id)
+            
+            # 一次粘贴多条日程（按行或分号分隔）：一次解析、一个事务保存
+            segments = time_parser.split_items(message)
+            if intent is None and len(segments) > 1 and any(time_parser.has_time_hint(segment) for segment in segments):
+                items = self.parse_schedules(segments, message)
+                if any(item['data'] for item in items):
+                    return self._batch_message(self.save_schedules(items, user_id))
+                return None
+
+            # 重复日程（每天/每周三/每月5号……）只保存一条规则
+            rule_data = recurrence.parse_recurrence(message)
+            if rule_data:
+                if recurrence.add_rule(user_id, rule_data):
+                    return (f"已成功添加重复日程：\n📅 {rule_data['title']}\n🔁 {recurrence.describe(rule_data)}\n"
+                            f"⏰ {rule_data['start_time'].strftime('%H:%M')} - {rule_data['end_time'].strftime('%H:%M')}，"
+                            f"从 {rule_data['start_time'].strftime('%Y-%m-%d')} 开始\n📍 {rule_data['location']}")
+                return "添加重复日程时出错，请稍后重试。"
+
             # 检查是否是添加日程的请求
             schedule_data = self.parse_schedule(message)
             if schedule_data:
+                # 保存前先查出与新日程重叠的已有日程，确认消息中一并提示
+                overlaps = conflicts.find_overlaps(user_id, schedule_data['start_time'], schedule_data['end_time'])
                 if self.save_schedule(schedule_data, user_id):
-                    return f"已成功添加日程：\n📅 {schedule_data['title']}\n⏰ {schedule_data['start_time'].strftime('%Y-%m-%d %H:%M')} - {schedule_data['end_time'].strftime('%H:%M')}\n📍 {schedule_data['location']}"
+                    return (f"已成功添加日程：\n📅 {schedule_data['title']}\n⏰ {schedule_data['start_time'].strftime('%Y-%m-%d %H:%M')} - {schedule_data['end_time'].strftime('%H:%M')}\n📍 {schedule_data['location']}"
+                            + conflicts.format_warning(overlaps))
                 else:
                     return "添加日程时出错，请稍后重试。"
 
             # 检查是否是关键字搜索
-            if "搜索" in message or "查找" in message or "查询" in message:
+            if intent == 'search':
                 keywords = self.extract_keywords(message)
                 if keywords:
                     events = self.search_events_by_keywords(keywords, user_id)
                     return self.format_events_response(events)
 
             # 检查是否是日期查询
-            query_patterns = {
-                "today": r"(今天|今日).*日程",
-                "tomorrow": r"(明天|明日).*日程",
-                "week": r"(本周|这周|一周|未来一周).*日程",
-                "all": r"(所有|全��).*日程",
-                "date": r"(\d{4}年)?(\d{1,2})月(\d{1,2})日.*日程",
-                "month": r"(\d{4}年)?(\d{1,2})月.*日程"
-            }
-            
-            # 检查是否是查询请求
-            for query_type, pattern in query_patterns.items():
-                if re.search(pattern, message):
-                    events = []
-                    if query_type in ["today", "tomorrow", "week", "all"]:
-                        events = self.query_events(query_type, user_id)
-                    elif query_type == "date":
-                        # 解析具体日期
-                        date_match = re.search(r"(\d{4}年)?(\d{1,2})月(\d{1,2})日", message)
-                        if date_match:
-                            year = int(date_match.group(1)[:-1]) if date_match.group(1) else datetime.now().year
-                            month = int(date_match.group(2))
-                            day = int(date_match.group(3))
-                            target_date = datetime(year, month, day).date()
-                            events = self.query_events("custom", user_id, target_date, target_date)
-                    elif query_type == "month":
-                        # 解析月份
-                        month_match = re.search(r"(\d{4}年)?(\d{1,2})月", message)
-                        if month_match:
-                            year = int(month_match.group(1)[:-1]) if month_match.group(1) else datetime.now().year
-                            month = int(month_match.group(2))
-                            start_date = datetime(year, month, 1).date()
-                            if month == 12:
-                                end_date = datetime(year + 1, 1, 1).date() - timedelta(days=1)
-                            else:
-                                end_date = datetime(year, month + 1, 1).date() - timedelta(days=1)
-                            events = self.query_events("custom", user_id, start_date, end_date)
-                    
-                    return self.format_events_response(events)
+            if intent == 'query_all':
+                rows, next_cursor = event_pages.fetch(user_id, limit=ALL_EVENTS_REPLY_LIMIT)
+                response = self.format_events_response([row[1:] for row in rows])
+                if next_cursor:
+                    response += f"\n仅显示最早的 {ALL_EVENTS_REPLY_LIMIT} 个日程，更多日程请在日历中查看。"
+                return response
+
+            if intent in ('query_today', 'query_tomorrow', 'query_week'):
+                events = self.query_events(intent[len('query_'):], user_id)
+                return self.format_events_response(events)
+
+            if intent in ('query_date', 'query_month'):
+                year = int(slots['year']) if 'year' in slots else datetime.now().year
+                month = int(slots['month'])
+                if intent == 'query_date':
+                    day = int(slots['day'])
+                    start_date = end_date = datetime(year, month, day).date()
+                else:
+                    start_date = datetime(year, month, 1).date()
+                    if month == 12:
+                        end_date = datetime(year + 1, 1, 1).date() - timedelta(days=1)
+                    else:
+                        end_date = datetime(year, month + 1, 1).date() - timedelta(days=1)
+                events = self.query_events("custom", user_id, start_date, end_date)
+                return self.format_events_response(events)
 
             # 如果不是查询请求，使用 AI 助手处理
             if self.api_error:
                 return "抱歉，AI 助手当前不可用，但您仍然可以使用日历功能来管理日程。"
-            
-            current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            message_with_time = f"当前时间：{current_time}\n用户问题：{message}"
-            
-            response = self.conversation.predict(input=message_with_time)
-            return response
-            
+            return None
+
         except Exception as e:
             logger.error(f"处理消息时出错: {str(e)}")
             return f"处理消息时出错：{str(e)}"
     
     def get_month_events(self, year, month, user_id):
-        """获取指定月份的所有事件"""
+        """获取指定月份的所有事件（结果按 (user_id, year, month) 缓存）"""
+        cache_key = cache.month_cache.stamp(('month_events', user_id, year, month),
+                                            [cache.month_tag(user_id, year, month),
+                                             recurrence.recurrence_tag(user_id)])
+        cached = cache.month_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
         try:
-            conn = sqlite3.connect('schedule_manager.db')
-            cursor = conn.cursor()
-            
-            # 构建日期范围
-            start_date = f"{year}-{month:02d}-01"
-            if month == 12:
-                end_date = f"{year + 1}-01-01"
-            else:
-                end_date = f"{year}-{month + 1:02d}-01"
-            
-            print(f"查询日期范围: {start_date} 到 {end_date}")  # 调试输出
-            
-            cursor.execute('''
-                SELECT title, start_time, end_time, description, location
-                FROM Events
-                WHERE date(start_time) >= date(?) AND date(start_time) < date(?)
-                AND user_id = ?
-                ORDER BY start_time
-            ''', (start_date, end_date, user_id))
-            
-            events = []
-            for row in cursor.fetchall():
-                event = {
-                    'title': row[0],
-                    'start_time': datetime.strptime(row[1], '%Y-%m-%d %H:%M:%S'),
-                    'end_time': datetime.strptime(row[2], '%Y-%m-%d %H:%M:%S'),
-                    'description': row[3],
-                    'location': row[4]
-                }
-                events.append(event)
-                print(f"找到事件: {event}")  # 调试输出
-            
+            # 构建日期范围；往前多看 MAX_EVENT_SPAN_DAYS 天以包含上月开始、跨入本月的事件
+            start_date, end_date = month_range(year, month)
+            lookback_start = (datetime(year, month, 1) - timedelta(days=MAX_EVENT_SPAN_DAYS)).strftime(TIME_FORMAT)
+
+            with db.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(queries.MONTH_EVENTS, (user_id, lookback_start, end_date, start_date, start_date))
+                rows = cursor.fetchall()
+                # 重复日程只展开本月内的各次发生
+                occurrences = recurrence.expand(user_id, start_date, end_date, conn)
+
+            # 每行只在这里解码一次，缓存和月视图都直接使用 EventRecord
+            events = event_record.from_rows(rows)
+            if occurrences:
+                events.extend(event_record.from_rows(occurrences))
+                events.sort(key=lambda event: event.start_time)
+
+            cache.month_cache.set(cache_key, events)
             return events
-            
+
         except Exception as e:
-            print(f"获取月度事件时出错：{str(e)}")
+            logger.error(f"获取月度事件时出错：{str(e)}")
             return []
-        finally:
-            if conn:
-                conn.close()
-    
+
+    def get_day_events(self, day, user_id):
+        """某一天的日程（含重复日程的各次发生），返回按开始时间排序的 EventRecord 列表"""
+        start_date, end_date = day_range(day)
+        with db.connection() as conn:
+            rows = conn.execute(queries.EVENT_ROWS_IN_RANGE, (user_id, start_date, end_date)).fetchall()
+            occurrences = recurrence.expand(user_id, start_date, end_date, conn)
+        events = [EventRecord.from_event_row(row) for row in rows]
+        if occurrences:
+            events.extend(event_record.from_rows(occurrences))
+            events.sort(key=lambda event: event.start_time)
+        return events
+
     def delete_test_events(self):
         """只删除测试日程（标题包含'测试会议'的日程）"""
         try:
-            conn = sqlite3.connect('schedule_manager.db')
-            cursor = conn.cursor()
-            
-            # 只删除标题包含"测试会议"的日程
-            cursor.execute("DELETE FROM Events WHERE title LIKE '%测试会议%'")
-            conn.commit()
-            
-            deleted_count = cursor.rowcount
+            with db.transaction() as conn:
+                cursor = conn.cursor()
+
+                # 先取出将被删除的日程，用于更新汇总表和失效缓存
+                cursor.execute('''
+                    SELECT user_id, start_time, end_time
+                    FROM Events
+                    WHERE title LIKE '%测试会议%'
+                ''')
+                affected = cursor.fetchall()
+
+                # 只删除标题包含"测试会议"的日程
+                cursor.execute("DELETE FROM Events WHERE title LIKE '%测试会议%'")
+                deleted_count = cursor.rowcount
+
+                for user_id, start_time, _ in affected:
+                    stats.adjust_daily_count(cursor, user_id, start_time, -1)
+
+            for user_id, start_time, end_time in affected:
+                self._invalidate_cache(user_id, start_time, end_time)
+
             logger.debug(f"已删除 {deleted_count} 个测试日程")
             return True
         except Exception as e:
             logger.error(f"删除测试日程时出错：{str(e)}")
             return False
-        finally:
-            if conn:
-                conn.close()
     
-    def get_all_events(self):
-        events = []
-        # 将您的日程数据转换为 FullCalendar 可以理解的格式
-        # 例如:
-        for schedule in self.schedules:
-            event = {
-                'title': schedule.title,
-                'start': schedule.start_time.isoformat(),
-                'end': schedule.end_time.isoformat()
-            }
-            events.append(event)
-        return events
+    def get_all_events(self, user_id, start, end):
+        """逐条产出与 [start, end) 重叠的日程（含重复日程的各次发生），格式为 FullCalendar 事件对象
+
+        start/end 为存储格式的时间字符串。数据库结果逐页读取，与重复日程按开始时间归并，
+        整个范围的日程不会同时驻留在内存中；调用方负责限制范围大小。
+        """
+        occurrences = recurrence.expand(user_id, start, end, with_ids=True)
+        # 重复日程的各次发生以 occurrence_id 作为 id，可用于取消或修改某一次
+        recurring = ((*occurrence, False) for occurrence in occurrences)
+        for row in heapq.merge(self._calendar_rows(user_id, start, end), recurring, key=lambda row: row[2]):
+            yield event_record.to_fullcalendar(row)
+
+    def _calendar_rows(self, user_id, start, end):
+        """按 (start_time, event_id) 键集逐页读取 get_all_events 的数据库部分
+
+        每页单独借用连接，读完即归还；客户端读取响应很慢时也不会一直占用连接池中的连接。
+        """
+        lookback = (event_record.decode_time(start) - timedelta(days=MAX_EVENT_SPAN_DAYS)).strftime(TIME_FORMAT)
+        last_start, last_id = '', 0
+        while True:
+            with db.connection() as conn:
+                rows = conn.execute(queries.CALENDAR_EVENTS, (
+                    user_id, max(lookback, last_start), end, start, last_start, last_id, CALENDAR_FETCH_SIZE
+                )).fetchall()
+            yield from rows
+            if len(rows) < CALENDAR_FETCH_SIZE:
+                return
+            last_start, last_id = rows[-1][2], rows[-1][0]
 
     def extract_keywords(self, message):
         """从用户消息中提取搜索关键词"""
@@ -673,56 +835,37 @@ class ScheduleManager:
         keywords = message.strip().split()
         return [keyword for keyword in keywords if keyword]
 
-    def search_events_by_keywords(self, keywords, user_id):
-        """根据关键词智能搜索日程"""
+    def search_events_by_keywords(self, keywords, user_id, limit=SEARCH_PAGE_SIZE, offset=0):
+        """根据关键词搜索日程：FTS5 全文索引匹配，按 BM25 相关度排序并分页
+
+        标题命中的权重最高，其次是地点和描述；相关度相同的按开始时间排序。
+        """
+        match = fts.match_query(user_id, keywords)
+        if not match:
+            return []
         try:
-            conn = sqlite3.connect('schedule_manager.db')
-            cursor = conn.cursor()
-            
-            # 构建基础查询
-            query = """
-                SELECT title, start_time, end_time, location, description
-                FROM Events
-                WHERE user_id = ?
-            """
-            params = [user_id]
-            
-            # 构建智能搜索条件
-            conditions = []
-            for keyword in keywords:
-                conditions.append("""
-                    (title LIKE ? OR description LIKE ? OR location LIKE ?)
-                """)
-                params.extend([f"%{keyword}%", f"%{keyword}%", f"%{keyword}%"])
-            
-            if conditions:
-                query += " AND (" + " OR ".join(conditions) + ")"
-            
-            # 按开始时间排序
-            query += " ORDER BY start_time"
-            
-            cursor.execute(query, params)
-            return cursor.fetchall()
-            
+            with db.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(queries.SEARCH_EVENTS, (match, user_id, limit, offset))
+                return cursor.fetchall()
+
         except Exception as e:
             logger.error(f"关键词搜索日程时出错：{str(e)}")
             return []
-        finally:
-            if conn:
-                conn.close()
 
     def add_event(self, event_data, user_id):
-        conn = sqlite3.connect('schedule_manager.db')
-        cur = conn.cursor()
-        
-        cur.execute('''
-            INSERT INTO Events (user_id, title, start_time, end_time, description, location)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (user_id, event_data['title'], event_data['start_time'], 
-              event_data['end_time'], event_data['description'], event_data['location']))
-        
-        conn.commit()
-        conn.close()
+        with db.transaction() as conn:
+            cur = conn.cursor()
+
+            cur.execute('''
+                INSERT INTO Events (user_id, title, start_time, end_time, description, location)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (user_id, event_data['title'], event_data['start_time'],
+                  event_data['end_time'], event_data['description'], event_data['location']))
+            stats.adjust_daily_count(cur, user_id, event_data['start_time'], 1)
+            fts.sync(cur)
+
+        self._invalidate_cache(user_id, event_data['start_time'], event_data['end_time'])
 
     def delete_events_by_date(self, date_str, user_id):
         """删除指定日期的所有日程"""
@@ -730,19 +873,13 @@ class ScheduleManager:
             # 将日期字符串转换为标准格式（YYYY-MM-DD）
             date_obj = self.parse_date(date_str)
             
-            date_start = date_obj.strftime("%Y-%m-%d 00:00:00")
-            date_end = date_obj.strftime("%Y-%m-%d 23:59:59")
+            date_start, date_end = day_range(date_obj)
             
-            with sqlite3.connect('schedule_manager.db') as conn:
+            with db.transaction() as conn:
                 cursor = conn.cursor()
                 
                 # 先获取要删除的日程列表
-                cursor.execute('''
-                    SELECT event_id, title, start_time, end_time
-                    FROM Events
-                    WHERE user_id = ?
-                    AND date(start_time) = date(?)
-                ''', (user_id, date_start))
+                cursor.execute(queries.EVENTS_TO_DELETE_IN_RANGE, (user_id, date_start, date_end))
                 
                 events_to_delete = cursor.fetchall()
                 
@@ -751,218 +888,228 @@ class ScheduleManager:
                     return 0
                     
                 # 执行删除
-                cursor.execute('''
+                cursor.execute(f'''
                     DELETE FROM Events
-                    WHERE user_id = ?
-                    AND date(start_time) = date(?)
-                ''', (user_id, date_start))
+                    WHERE user_id = ? AND {RANGE_PREDICATE}
+                ''', (user_id, date_start, date_end))
                 
                 deleted_count = cursor.rowcount
-                conn.commit()
-                
-                # 记录删除的日程信息
-                logger.info(f"已删除{date_str}的{deleted_count}个日程")
-                for event in events_to_delete:
-                    logger.debug(f"删除日程: {event[1]} ({event[2]} - {event[3]})")
-                    
-                return deleted_count
-                
+                stats.adjust_daily_count(cursor, user_id, date_start, -deleted_count)
+
+            # 记录删除的日程信息；提交之后再失效缓存，避免并发读取把旧数据写回缓存
+            logger.info(f"已删除{date_str}的{deleted_count}个日程")
+            for event in events_to_delete:
+                logger.debug(f"删除日程: {event[1]} ({event[2]} - {event[3]})")
+                self._invalidate_cache(user_id, event[2], event[3])
+
+            return deleted_count
+
         except Exception as e:
             logger.error(f"删除指定日期日程时出错：{str(e)}")
             return 0
 
     def parse_date(self, date_str):
         """解析各种格式的日期字符串"""
-        # 处理"12月25日"这样的格式
-        match = re.search(r'(\d{1,2})月(\d{1,2})日', date_str)
-        if match:
-            month, day = map(int, match.groups())
-            # 使用当前年份或上下文中的年份
-            year = datetime.now().year
-            return datetime(year, month, day)
-        
-        # 可以添加更多日期格式的解析...
-        
-        raise ValueError(f"无法解析日期格式：{date_str}")
+        day, _, _ = time_parser.find_date(date_str)
+        if day is None:
+            raise ValueError(f"无法解析日期格式：{date_str}")
+        return datetime(day.year, day.month, day.day)
 
     def update_event(self, event_id, updated_data, user_id):
-        """更新指定的日程"""
+        """更新指定的日程；event_id 是重复日程某一次的 ID 时只修改这一次"""
+        if recurrence.parse_occurrence_id(event_id):
+            return self._update_occurrence(event_id, updated_data, user_id)
         try:
-            conn = sqlite3.connect('schedule_manager.db')
-            cursor = conn.cursor()
-            
-            # 首先获取原有事件数据
-            cursor.execute('''
-                SELECT title, start_time, end_time, location
-                FROM Events 
-                WHERE event_id = ? AND user_id = ?
-            ''', (event_id, user_id))
-            
-            original_event = cursor.fetchone()
-            if not original_event:
-                return False, "未找到指定的日程"
-            
-            # 合并更新数据，保留未修改的原值
-            title = updated_data.get('title') or original_event[0]
-            start_time = updated_data.get('start_time') or datetime.strptime(original_event[1], '%Y-%m-%d %H:%M:%S')
-            end_time = updated_data.get('end_time') or datetime.strptime(original_event[2], '%Y-%m-%d %H:%M:%S')
-            location = updated_data.get('location') or original_event[3]
-            
-            # 执行更新
-            cursor.execute('''
-                UPDATE Events 
-                SET title = ?,
-                    start_time = ?,
-                    end_time = ?,
-                    location = ?,
-                    updated_at = CURRENT_TIMESTAMP
-                WHERE event_id = ? AND user_id = ?
-            ''', (
-                title,
-                start_time.strftime('%Y-%m-%d %H:%M:%S'),
-                end_time.strftime('%Y-%m-%d %H:%M:%S'),
-                location,
-                event_id,
-                user_id
-            ))
-            
-            conn.commit()
+            with db.transaction() as conn:
+                cursor = conn.cursor()
+
+                # 首先获取原有事件数据
+                cursor.execute(queries.EVENT_FOR_UPDATE, (event_id, user_id))
+
+                original_event = cursor.fetchone()
+                if not original_event:
+                    return False, "未找到指定的日程"
+
+                # 合并更新数据，保留未修改的原值
+                title = updated_data.get('title') or original_event[0]
+                start_time = updated_data.get('start_time') or event_record.decode_time(original_event[1])
+                end_time = updated_data.get('end_time') or event_record.decode_time(original_event[2])
+                location = updated_data.get('location') or original_event[3]
+
+                # 执行更新
+                cursor.execute('''
+                    UPDATE Events 
+                    SET title = ?,
+                        start_time = ?,
+                        end_time = ?,
+                        location = ?,
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE event_id = ? AND user_id = ?
+                ''', (
+                    title,
+                    start_time.strftime('%Y-%m-%d %H:%M:%S'),
+                    end_time.strftime('%Y-%m-%d %H:%M:%S'),
+                    location,
+                    event_id,
+                    user_id
+                ))
+                stats.adjust_daily_count(cursor, user_id, original_event[1], -1)
+                stats.adjust_daily_count(cursor, user_id, start_time, 1)
+                fts.sync(cursor)
+
+            self._invalidate_cache(user_id, original_event[1], original_event[2])
+            self._invalidate_cache(user_id, start_time, end_time)
             return True, "日程更新成功"
-            
+
         except Exception as e:
             logger.error(f"更新日程时出错：{str(e)}")
             return False, f"更新日程出错：{str(e)}"
-        finally:
-            if conn:
-                conn.close()
+
+    def _update_occurrence(self, occurrence_id, updated_data, user_id):
+        """把修改保存为这一次的例外；例外整行覆盖，所以未修改的字段也写入当前值"""
+        current = recurrence.get_occurrence(occurrence_id, user_id)
+        if not current:
+            return False, "未找到指定的日程"
+        recurrence_id, occurrence_start = recurrence.parse_occurrence_id(occurrence_id)
+        start, end = event_record.decode_time(current[2]), event_record.decode_time(current[3])
+        start_time = updated_data.get('start_time') or start
+        # 只改开始时间时保持原来的时长
+        end_time = updated_data.get('end_time') or start_time + (end - start)
+        if end_time < start_time:
+            return False, "结束时间不能早于开始时间"
+        if recurrence.set_exception(recurrence_id, user_id, occurrence_start,
+                                    title=updated_data.get('title') or current[1],
+                                    start_time=start_time, end_time=end_time,
+                                    location=updated_data.get('location') or current[4],
+                                    description=current[5]):
+            return True, "日程更新成功"
+        return False, "更新日程失败，请稍后重试"
 
     def find_event_by_title_and_time(self, title, date, user_id):
         """根据标题和��期查找日程"""
         try:
-            conn = sqlite3.connect('schedule_manager.db')
-            cursor = conn.cursor()
-            
             # 构建日期范围
-            date_start = f"{date.strftime('%Y-%m-%d')} 00:00:00"
-            date_end = f"{date.strftime('%Y-%m-%d')} 23:59:59"
-            
-            cursor.execute('''
-                SELECT event_id, title, start_time, end_time, location, description
-                FROM Events
-                WHERE user_id = ?
-                AND title LIKE ?
-                AND start_time BETWEEN ? AND ?
-            ''', (user_id, f"%{title}%", date_start, date_end))
-            
-            events = cursor.fetchall()
+            date_start, date_end = day_range(date)
+
+            with db.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(queries.EVENTS_BY_TITLE_IN_RANGE, (user_id, date_start, date_end, f"%{title}%"))
+
+                events = cursor.fetchall()
             return events
-            
+
         except Exception as e:
             logger.error(f"查找日程时出错：{str(e)}")
             return []
-        finally:
-            if conn:
-                conn.close()
 
     def parse_date_from_message(self, message):
-        """从用户消息中解析日期和时间"""
+        """从用户消息中解析日期和时间，没有日期时使用今天"""
         try:
-            current_date = datetime.now()
-            
-            # 处理相对日期
-            if "明天" in message:
-                target_date = current_date + timedelta(days=1)
-            elif "后天" in message:
-                target_date = current_date + timedelta(days=2)
-            elif "今天" in message:
-                target_date = current_date
-            else:
-                # 处理具体日期格式
-                date_match = re.search(r"(\d{4}年)?(\d{1,2})月(\d{1,2})日", message)
-                if date_match:
-                    year = int(date_match.group(1)[:-1]) if date_match.group(1) else current_date.year
-                    month = int(date_match.group(2))
-                    day = int(date_match.group(3))
-                    target_date = datetime(year, month, day)
-                else:
-                    # 如果没有找到日期，使用当前日期
-                    target_date = current_date
-            
-            # 处理具体时间
-            time_patterns = [
-                (r"(\d{1,2})点(\d{1,2})?分?", lambda m: f"{int(m.group(1)):02d}:{int(m.group(2) or '0'):02d}"),
-                (r"(\d{1,2}):(\d{1,2})", lambda m: f"{int(m.group(1)):02d}:{int(m.group(2)):02d}"),
-                (r"早上(\d{1,2})点(\d{1,2})?分?", lambda m: f"{int(m.group(1)):02d}:{int(m.group(2) or '0'):02d}"),
-                (r"上午(\d{1,2})点(\d{1,2})?分?", lambda m: f"{int(m.group(1)):02d}:{int(m.group(2) or '0'):02d}"),
-                (r"下午(\d{1,2})点(\d{1,2})?分?", lambda m: f"{int(m.group(1))+12:02d}:{int(m.group(2) or '0'):02d}"),
-                (r"晚上(\d{1,2})点(\d{1,2})?分?", lambda m: f"{int(m.group(1))+12:02d}:{int(m.group(2) or '0'):02d}")
-            ]
-            
-            for pattern, time_formatter in time_patterns:
-                time_match = re.search(pattern, message)
-                if time_match:
-                    time_str = time_formatter(time_match)
-                    hour, minute = map(int, time_str.split(':'))
-                    return datetime(
-                        target_date.year,
-                        target_date.month,
-                        target_date.day,
-                        hour,
-                        minute
-                    )
-            
-            # 如果没有具体时间，返回整个日期
-            return target_date
-            
+            return time_parser.parse_datetime(message)
         except Exception as e:
             logger.error(f"解析日期时间出错: {str(e)}")
             return None
 
     def find_event_by_time(self, date, user_id):
-        """根据日期查找日程"""
+        """根据日期查找日程；重复日程在这一天的各次发生也包括在内，ID 为 recurrence.format_occurrence_id"""
         try:
-            conn = sqlite3.connect('schedule_manager.db')
-            cursor = conn.cursor()
-            
             # 构建日期范围
-            date_start = f"{date.strftime('%Y-%m-%d')} 00:00:00"
-            date_end = f"{date.strftime('%Y-%m-%d')} 23:59:59"
-            
-            cursor.execute('''
-                SELECT event_id, title, start_time, end_time, location, description
-                FROM Events
-                WHERE user_id = ?
-                AND start_time BETWEEN ? AND ?
-                ORDER BY start_time
-            ''', (user_id, date_start, date_end))
-            
-            events = cursor.fetchall()
+            date_start, date_end = day_range(date)
+
+            with db.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(queries.EVENT_ROWS_IN_RANGE, (user_id, date_start, date_end))
+
+                events = cursor.fetchall()
+                occurrences = recurrence.expand(user_id, date_start, date_end, conn, with_ids=True)
+            if occurrences:
+                events = sorted(events + occurrences, key=lambda event: event[2])
             return events
-            
+
         except Exception as e:
             logger.error(f"查找日程时出错：{str(e)}")
             return []
-        finally:
-            if conn:
-                conn.close()
+
+    def answer_free_slots(self, message, user_id, now=None):
+        """回答“什么时候有空”：从消息中取日期范围、时段和最短时长，在工作时间内查找空闲时段"""
+        now = now or datetime.now()
+        today = now.date()
+        if re.search(r'下(个)?(周|星期|礼拜)(?![一二三四五六日天1-7])', message):
+            first_day = today + timedelta(days=7 - today.weekday())
+            last_day = first_day + timedelta(days=6)
+        elif re.search(r'(本|这个?)(周|星期|礼拜)(?![一二三四五六日天1-7])|一周|最近', message):
+            first_day, last_day = today, today + timedelta(days=6)
+        else:
+            day, _, _ = time_parser.find_date(message, today)
+            first_day = last_day = day or today
+
+        hours = None
+        for period, period_hours in free_slots.PERIOD_HOURS.items():
+            if period in message:
+                hours = period_hours
+                break
+        duration, _ = time_parser.find_duration(message)
+        min_minutes = int(duration.total_seconds() // 60) if duration else None
+
+        try:
+            slots = free_slots.find_free_slots([user_id], first_day, last_day, hours, min_minutes, now)[user_id]
+        except Exception as e:
+            logger.error(f"计算空闲时间时出错：{str(e)}")
+            return "计算空闲时间时出错，请稍后重试。"
+        return free_slots.format_slots(slots, first_day, last_day, min_minutes)
+
+    def _modified_message(self, event_id, user_id):
+        """修改成功后的回复；只改了部分字段时，其余字段显示数据库中的原值，并提示时间冲突"""
+        event = self.get_event(event_id, user_id)
+        if not event:
+            return "日程更新成功"
+        overlaps = conflicts.find_overlaps(user_id, event[2], event[3], exclude_id=event_id)
+        return (f"已成功修改日程：\n📅 {event[1]}\n⏰ {minute_text(event[2])} - {clock_text(event[3])}\n📍 {event[4]}"
+                + conflicts.format_warning(overlaps))
+
+    def get_event(self, event_id, user_id):
+        """按 ID 读取单个日程，字段顺序与 find_event_by_time 相同"""
+        if recurrence.parse_occurrence_id(event_id):
+            return recurrence.get_occurrence(event_id, user_id)
+        try:
+            with db.connection() as conn:
+                return conn.execute(queries.EVENT_BY_ID, (event_id, user_id)).fetchone()
+        except Exception as e:
+            logger.error(f"读取日程时出错：{str(e)}")
+            return None
+
+    def _deleted_message(self, event):
+        message = f"已删除日程：\n📅 {event[1]}\n⏰ {clock_text(event[2])}"
+        if recurrence.parse_occurrence_id(event[0]):
+            message += "\n🔁 只取消了这一次，重复日程的其他各次不受影响"
+        return message
 
     def delete_event(self, event_id, user_id):
-        """删除指定的日程"""
+        """删除指定的日程；event_id 是重复日程某一次的 ID 时只取消这一次"""
+        occurrence = recurrence.parse_occurrence_id(event_id)
+        if occurrence:
+            if not recurrence.get_occurrence(event_id, user_id):
+                return False
+            recurrence_id, occurrence_start = occurrence
+            return recurrence.set_exception(recurrence_id, user_id, occurrence_start, cancelled=True)
         try:
-            conn = sqlite3.connect('schedule_manager.db')
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                DELETE FROM Events 
-                WHERE event_id = ? AND user_id = ?
-            ''', (event_id, user_id))
-            
-            conn.commit()
+            with db.transaction() as conn:
+                cursor = conn.cursor()
+                cursor.execute(queries.EVENT_SPAN_BY_ID, (event_id, user_id))
+                row = cursor.fetchone()
+
+                cursor.execute('''
+                    DELETE FROM Events 
+                    WHERE event_id = ? AND user_id = ?
+                ''', (event_id, user_id))
+                if row:
+                    stats.adjust_daily_count(cursor, user_id, row[0], -1)
+
+            if row:
+                self._invalidate_cache(user_id, row[0], row[1])
+
             return True
-            
+
         except Exception as e:
             logger.error(f"删除日程时出错：{str(e)}")
-            return False
-        finally:
-            if conn:
-                conn.close()
\ No newline at end of file
+            return False
\ No newline at end of file
@@ -0,0 +1,70 @@
+import os
+import sys
+import json
+import tempfile
+import subprocess
+
+
+# 启动性能基准：在新的 Python 进程中分别测量
+#   - import app 的耗时（包括建连接池、执行迁移）
+#   - 第一个普通请求（登录后查询月视图）的耗时
+#   - 第一条需要 AI 的消息的耗时（此时才导入 LangChain 并创建客户端，使用本地模拟的 FakeLLM）
+# 每轮都用新进程，避免模块缓存影响结果。用法：python startup_benchmark.py [轮数]
+
+_PROBE = r'''
+import io, json, time, contextlib, logging
+started = time.perf_counter()
+with contextlib.redirect_stdout(io.StringIO()):
+    import app as appmod
+imported = time.perf_counter()
+logging.disable(logging.CRITICAL)
+client = appmod.app.test_client()
+client.post('/register', data={'username': 'bench', 'password': 'p', 'confirm_password': 'p'})
+client.post('/login', data={'username': 'bench', 'password': 'p'})
+logged_in = time.perf_counter()
+client.post('/get_calendar', json={'year': 2026, 'month': 1})
+first_request = time.perf_counter()
+lazy_before = __import__('sys').modules.get('langchain_community.chat_models.tongyi') is None
+client.post('/chat', json={'message': '你好'})
+first_chat = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'first_request_ms': (first_request - logged_in) * 1000,
+    'first_chat_ms': (first_chat - first_request) * 1000,
+    'langchain_deferred': lazy_before,
+}))
+'''
+
+
+def measure(backend='fake'):
+    """在新进程中跑一轮探测，返回各阶段耗时（毫秒）"""
+    with tempfile.TemporaryDirectory() as workdir:
+        env = dict(os.environ,
+                   SCHEDULE_DB_PATH=os.path.join(workdir, 'bench.db'),
+                   SCHEDULE_LLM_BACKEND=backend,
+                   SCHEDULE_FAKE_LLM_LATENCY='0',
+                   SCHEDULE_FAKE_LLM_JITTER='0',
+                   DASHSCOPE_API_KEY=os.getenv('DASHSCOPE_API_KEY', 'benchmark'))
+        output = subprocess.run([sys.executable, '-c', _PROBE], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def benchmark(rounds=5, backend='fake'):
+    """多轮测量取中位数"""
+    results = [measure(backend) for _ in range(rounds)]
+    summary = {}
+    for key in ('import_ms', 'first_request_ms', 'first_chat_ms'):
+        values = sorted(result[key] for result in results)
+        summary[key] = round(values[len(values) // 2], 1)
+    summary['langchain_deferred'] = all(result['langchain_deferred'] for result in results)
+    return summary
+
+
+if __name__ == '__main__':
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    result = benchmark(rounds)
+    print(f"import app:       {result['import_ms']} ms")
+    print(f"首个请求:          {result['first_request_ms']} ms")
+    print(f"首条 AI 消息:      {result['first_chat_ms']} ms")
+    print(f"LangChain 延迟导入: {'是' if result['langchain_deferred'] else '否'}")
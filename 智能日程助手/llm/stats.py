@@ -0,0 +1,128 @@
+from datetime import datetime, timedelta
+import logging
+
+import db
+import recurrence
+
+logger = logging.getLogger(__name__)
+
+
+def _day_key(value):
+    """把 datetime 或 'YYYY-MM-DD HH:MM:SS' 字符串转换为汇总表中的日期键"""
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d')
+    return str(value)[:10]
+
+
+def adjust_daily_count(cursor, user_id, start_time, delta):
+    """在调用方的事务中增减某用户某一天的日程数量"""
+    if not delta:
+        return
+    day = _day_key(start_time)
+    cursor.execute('''
+        INSERT INTO EventDailyCounts (user_id, day, event_count)
+        VALUES (?, ?, ?)
+        ON CONFLICT(user_id, day) DO UPDATE SET event_count = event_count + excluded.event_count
+    ''', (user_id, day, delta))
+    if delta < 0:
+        cursor.execute('''
+            DELETE FROM EventDailyCounts
+            WHERE user_id = ? AND day = ? AND event_count <= 0
+        ''', (user_id, day))
+
+
+def rebuild_daily_counts(cursor, user_id=None):
+    """根据 Events 表重建汇总（迁移回填或数据修复时使用）"""
+    if user_id is None:
+        cursor.execute('DELETE FROM EventDailyCounts')
+        cursor.execute('''
+            INSERT INTO EventDailyCounts (user_id, day, event_count)
+            SELECT user_id, substr(start_time, 1, 10), COUNT(*)
+            FROM Events
+            WHERE user_id IS NOT NULL
+            GROUP BY user_id, substr(start_time, 1, 10)
+        ''')
+    else:
+        cursor.execute('DELETE FROM EventDailyCounts WHERE user_id = ?', (user_id,))
+        cursor.execute('''
+            INSERT INTO EventDailyCounts (user_id, day, event_count)
+            SELECT user_id, substr(start_time, 1, 10), COUNT(*)
+            FROM Events
+            WHERE user_id = ?
+            GROUP BY user_id, substr(start_time, 1, 10)
+        ''', (user_id,))
+
+
+# 每天的日程数量，参数为 (user_id, 第一天, 最后一天)
+DAILY_HISTOGRAM_SQL = '''
+    SELECT day, SUM(event_count)
+    FROM EventDailyCounts
+    WHERE user_id = ? AND day >= ? AND day <= ?
+    GROUP BY day
+'''
+
+
+class StatisticsService:
+    """日程统计：基于按用户按天增量维护的 EventDailyCounts 汇总表，加上重复日程在窗口内的展开"""
+
+    def daily_histogram(self, user_id, first_day, last_day):
+        """first_day 到 last_day（含）之间每天的日程数量，一次 GROUP BY 查询"""
+        first = first_day.date() if isinstance(first_day, datetime) else first_day
+        last = last_day.date() if isinstance(last_day, datetime) else last_day
+
+        with db.connection() as conn:
+            rows = conn.execute(DAILY_HISTOGRAM_SQL, (user_id, first.strftime('%Y-%m-%d'), last.strftime('%Y-%m-%d'))).fetchall()
+
+        counts = {row[0]: row[1] for row in rows}
+        # 重复日程不在汇总表中，按窗口展开后计入
+        for day, count in recurrence.daily_counts(user_id, first, last).items():
+            counts[day] = counts.get(day, 0) + count
+        histogram = []
+        current = first
+        while current <= last:
+            key = current.strftime('%Y-%m-%d')
+            histogram.append({'date': key, 'count': counts.get(key, 0)})
+            current += timedelta(days=1)
+        return histogram
+
+    def chart_window(self, today):
+        """图表需要的日期窗口：覆盖本月和最近 7 天"""
+        first_day = today.replace(day=1)
+        if today.month == 12:
+            last_day = today.replace(year=today.year + 1, month=1, day=1) - timedelta(days=1)
+        else:
+            last_day = today.replace(month=today.month + 1, day=1) - timedelta(days=1)
+        return min(first_day, today - timedelta(days=6)), last_day
+
+    def chart_data(self, user_id, today=None):
+        """首页图表数据：本月每日数量（折线图）和最近 7 天分布（柱状图）"""
+        today = today or datetime.now()
+        if isinstance(today, datetime):
+            today = today.date()
+        first_day = today.replace(day=1)
+
+        # 一次查询覆盖两个图表需要的日期窗口
+        histogram = self.daily_histogram(user_id, *self.chart_window(today))
+        by_day = {item['date']: item['count'] for item in histogram}
+
+        line_data = [item for item in histogram if item['date'] >= first_day.strftime('%Y-%m-%d')]
+
+        bar_data = []
+        total_events = 0
+        for i in range(7):
+            date = today - timedelta(days=i)
+            count = by_day.get(date.strftime('%Y-%m-%d'), 0)
+            total_events += count
+            bar_data.append({
+                'date': date.strftime('%m-%d'),
+                'count': count
+            })
+
+        # 计算百分比
+        for item in bar_data:
+            item['percentage'] = round((item['count'] / total_events) * 100, 2) if total_events > 0 else 0
+
+        return {
+            'line_data': line_data,
+            'bar_data': bar_data
+        }
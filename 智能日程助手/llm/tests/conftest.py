@@ -0,0 +1,29 @@
+import os
+import sys
+import logging
+import tempfile
+
+# 模块以脚本方式互相导入（import db），测试时把 llm 目录加入搜索路径；
+# db.pool 在导入时按 SCHEDULE_DB_PATH 创建，这里先指向临时文件，避免写入仓库中的数据库；
+# AI 响应缓存文件同样放在临时目录，测试运行后源码目录中不留下 llm_cache.db
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+_TMP_DIR = tempfile.mkdtemp()
+os.environ.setdefault('SCHEDULE_DB_PATH', os.path.join(_TMP_DIR, 'test.db'))
+os.environ.setdefault('SCHEDULE_LLM_CACHE_PATH', os.path.join(_TMP_DIR, 'llm_cache.db'))
+os.environ.setdefault('SCHEDULE_LLM_BACKEND', 'fake')
+
+import pytest
+
+import db
+import migrations
+
+logging.disable(logging.CRITICAL)
+
+
+@pytest.fixture
+def pool(tmp_path):
+    """已执行全部迁移的独立连接池"""
+    pool = db.ConnectionPool(str(tmp_path / 'schedule.db'), max_size=2)
+    migrations.migrate(pool)
+    yield pool
+    pool.close_all()
@@ -0,0 +1,112 @@
+import io
+from datetime import datetime
+
+import pytest
+
+import db
+import bulk_io
+import recurrence
+
+
+@pytest.fixture
+def global_pool(pool, monkeypatch):
+    monkeypatch.setattr(db, 'pool', pool)
+    return pool
+
+
+def _ics(*events):
+    body = ''.join(f"BEGIN:VEVENT\r\n{event}END:VEVENT\r\n" for event in events)
+    return f"BEGIN:VCALENDAR\r\nVERSION:2.0\r\n{body}END:VCALENDAR\r\n"
+
+
+def _upload(user_id, text, filename):
+    return bulk_io.import_file(user_id, io.BytesIO(text.encode('utf-8')), filename)
+
+
+def _user_events(user_id):
+    return [row[1:] for row in bulk_io.iter_user_events(user_id)]
+
+
+def test_malformed_rrule_is_skipped_not_raised(global_pool):
+    text = _ics(
+        "SUMMARY:坏规则\r\nDTSTART:20260105T090000\r\nRRULE:FREQ=WEEKLY;UNTIL=garbage\r\n",
+        "SUMMARY:坏间隔\r\nDTSTART:20260105T090000\r\nRRULE:FREQ=DAILY;INTERVAL=x\r\n",
+        "SUMMARY:组会\r\nDTSTART:20260106T090000\r\nDTEND:20260106T100000\r\n",
+    )
+    result = _upload(1, text, 'a.ics')
+    assert (result['imported'], result['recurring'], result['skipped']) == (1, 0, 2)
+    assert any('坏规则' in error for error in result['errors'])
+
+
+def test_exdate_becomes_cancelled_occurrence(global_pool):
+    text = _ics(
+        "SUMMARY:晨跑\r\nDTSTART:20260105T070000\r\nDTEND:20260105T080000\r\nRRULE:FREQ=DAILY;COUNT=4\r\n"
+        "EXDATE:20260106T070000,20260107T070000\r\nEXDATE;VALUE=DATE:20260108\r\n",
+    )
+    assert _upload(2, text, 'a.ics')['recurring'] == 1
+    rows = recurrence.expand(2, datetime(2026, 1, 1), datetime(2026, 2, 1))
+    assert [row[1] for row in rows] == ['2026-01-05 07:00:00']
+
+
+def test_recurrence_id_is_rejected_explicitly(global_pool):
+    text = _ics(
+        "UID:x\r\nSUMMARY:晨跑\r\nDTSTART:20260105T070000\r\nRRULE:FREQ=DAILY;COUNT=3\r\n",
+        "UID:x\r\nRECURRENCE-ID:20260106T070000\r\nSUMMARY:晨跑（改期）\r\nDTSTART:20260106T080000\r\n",
+    )
+    result = _upload(3, text, 'a.ics')
+    assert (result['imported'], result['recurring'], result['skipped']) == (0, 1, 1)
+    assert 'RECURRENCE-ID' in result['errors'][0]
+
+
+def test_csv_round_trip(global_pool):
+    text = ('标题,开始时间,结束时间,地点,备注\n'
+            '组会,2026-01-05 09:00,2026-01-05 10:00,"会议室A, 3楼",带上"周报"\n'
+            '午饭,2026/01/05 12:00,,,\n'
+            ',2026-01-05 13:00,,,\n')
+    result = _upload(4, text, 'a.csv')
+    assert (result['imported'], result['skipped']) == (2, 1)
+
+    exported = ''.join(bulk_io.export_csv(4))
+    assert _upload(5, exported, 'b.csv')['imported'] == 2
+    assert _user_events(5) == _user_events(4) == [
+        ('组会', '2026-01-05 09:00:00', '2026-01-05 10:00:00', '会议室A, 3楼', '带上"周报"', 0),
+        ('午饭', '2026-01-05 12:00:00', '2026-01-05 13:00:00', None, '', 0),
+    ]
+
+
+def test_ics_round_trip_keeps_rules_and_exceptions(global_pool):
+    long_title = '季度评审；' + '很长的标题' * 20
+    text = _ics(
+        f"SUMMARY:{bulk_io._escape(long_title)}\r\nDTSTART:20260105T090000\r\nDTEND:20260105T100000\r\n"
+        "LOCATION:A\\, B\r\nDESCRIPTION:第一行\\n第二行\r\n",
+        "SUMMARY:春节\r\nDTSTART;VALUE=DATE:20260217\r\nDTEND;VALUE=DATE:20260218\r\n",
+        "SUMMARY:周会\r\nDTSTART:20260105T140000\r\nDTEND:20260105T150000\r\n"
+        "RRULE:FREQ=WEEKLY;INTERVAL=1;BYDAY=MO,WE;COUNT=6\r\n",
+    )
+    result = _upload(6, text, 'a.ics')
+    assert (result['imported'], result['recurring']) == (2, 1)
+    with db.connection() as conn:
+        recurrence_id = conn.execute('SELECT recurrence_id FROM EventRecurrences WHERE user_id = 6').fetchone()[0]
+    assert recurrence.set_exception(recurrence_id, 6, datetime(2026, 1, 7, 14), cancelled=True)
+    assert recurrence.set_exception(recurrence_id, 6, datetime(2026, 1, 12, 14), title='周会（改期）',
+                                    start_time=datetime(2026, 1, 13, 16), end_time=datetime(2026, 1, 13, 17))
+
+    exported = ''.join(bulk_io.export_ics(6))
+    assert all(len(line.encode('utf-8')) <= 75 for line in exported.split('\r\n'))
+    result = _upload(7, exported, 'b.ics')
+    assert (result['imported'], result['recurring'], result['skipped']) == (3, 1, 0)
+
+    assert _user_events(6) == [
+        (long_title, '2026-01-05 09:00:00', '2026-01-05 10:00:00', 'A, B', '第一行\n第二行', 0),
+        ('春节', '2026-02-17 00:00:00', '2026-02-18 00:00:00', None, '', 1),
+    ]
+    assert _user_events(7) == [
+        (long_title, '2026-01-05 09:00:00', '2026-01-05 10:00:00', 'A, B', '第一行\n第二行', 0),
+        ('周会（改期）', '2026-01-13 16:00:00', '2026-01-13 17:00:00', None, '', 0),
+        ('春节', '2026-02-17 00:00:00', '2026-02-18 00:00:00', None, '', 1),
+    ]
+    window = (datetime(2026, 1, 1), datetime(2026, 3, 1))
+    # 修改过的那一次在导出文件中是独立日程，其余各次与原规则一致
+    assert [row for row in recurrence.expand(6, *window) if row[0] != '周会（改期）'] == recurrence.expand(7, *window)
+    assert [row[1] for row in recurrence.expand(7, *window)] == [
+        '2026-01-05 14:00:00', '2026-01-14 14:00:00', '2026-01-19 14:00:00', '2026-01-21 14:00:00']
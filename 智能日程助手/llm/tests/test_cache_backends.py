@@ -0,0 +1,166 @@
+import json
+import time
+import pickle
+import threading
+import socketserver
+
+import pytest
+
+import cache
+import conversation_state
+from event_record import EventRecord
+
+
+class _FakeRedisHandler(socketserver.StreamRequestHandler):
+    """只实现 RedisBackend 用到的命令：AUTH/SELECT/GET/SET PX/DEL/INCR"""
+
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:-2])):
+            length = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def _bulk(self, value):
+        if value is None:
+            return b'$-1\r\n'
+        return b'$%d\r\n%s\r\n' % (len(value), value)
+
+    def handle(self):
+        server = self.server
+        while True:
+            args = self._read_command()
+            if args is None:
+                return
+            command, args = args[0].decode().upper(), args[1:]
+            with server.lock:
+                server.commands.append(command)
+                if command in ('AUTH', 'SELECT'):
+                    reply = b'+OK\r\n'
+                elif command == 'GET':
+                    value, expires_at = server.data.get(args[0], (None, None))
+                    if expires_at is not None and expires_at < time.monotonic():
+                        value = None
+                    reply = self._bulk(value)
+                elif command == 'SET':
+                    expires_at = time.monotonic() + int(args[3]) / 1000 if len(args) > 3 else None
+                    server.data[args[0]] = (args[1], expires_at)
+                    reply = b'+OK\r\n'
+                elif command == 'DEL':
+                    reply = b':%d\r\n' % (server.data.pop(args[0], None) is not None)
+                elif command == 'INCR':
+                    value = int(server.data.get(args[0], (b'0', None))[0]) + 1
+                    server.data[args[0]] = (str(value).encode(), None)
+                    reply = b':%d\r\n' % value
+                else:
+                    reply = b'-ERR unknown command\r\n'
+            self.wfile.write(reply)
+
+
+@pytest.fixture
+def redis_server():
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), _FakeRedisHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.data = {}
+    server.commands = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _records():
+    return [EventRecord('组会', '2026-01-05 09:00:00', '2026-01-05 10:00:00', '会议室A', '', id=3),
+            EventRecord('晨跑', '2026-01-06 07:00:00', '2026-01-06 08:00:00', None, '5 公里')]
+
+
+def _assert_round_trip(backend):
+    backend.set(('month_events', 1, 2026, 1), _records())
+    events = backend.get(('month_events', 1, 2026, 1))
+    assert [event.to_json() for event in events] == [event.to_json() for event in _records()]
+    assert events[1].start.hour == 7
+
+    backend.set(('view',), ('{"a":1}', 'etag'))
+    body, etag = backend.get(('view',))
+    assert (body, etag) == ('{"a":1}', 'etag')
+
+    assert backend.get_counter(('ver', 'month', 1)) == 0
+    assert [backend.incr(('ver', 'month', 1)) for _ in range(3)] == [1, 2, 3]
+    assert backend.get_counter(('ver', 'month', 1)) == 3
+
+    backend.delete(('view',))
+    assert backend.get(('view',)) is None
+
+
+def test_redis_backend_against_resp_server(redis_server):
+    host, port = redis_server.server_address
+    backend = cache.RedisBackend(f'redis://:secret@{host}:{port}/2')
+    _assert_round_trip(backend)
+    assert redis_server.commands[:2] == ['AUTH', 'SELECT']
+
+    # 存入服务端的是 JSON 文本
+    stored = redis_server.data[b'schedule:month_events:1:2026:1'][0]
+    assert json.loads(stored)[0]['__event__']['title'] == '组会'
+
+    backend.set(('short',), 'x', ttl=0.01)
+    time.sleep(0.05)
+    assert backend.get(('short',)) is None
+
+
+def test_redis_state_is_shared_between_workers(redis_server):
+    host, port = redis_server.server_address
+    first = conversation_state.ConversationStateStore(backend=cache.RedisBackend(f'redis://{host}:{port}/0'))
+    second = conversation_state.ConversationStateStore(backend=cache.RedisBackend(f'redis://{host}:{port}/0'))
+    first.set(5, 'delete', [11, 12])
+    entry = second.get(5)
+    assert (entry.operation, entry.event_ids) == ('delete', (11, 12))
+
+
+def test_sqlite_backend_round_trip(tmp_path):
+    _assert_round_trip(cache.SQLiteBackend(str(tmp_path / 'cache.db')))
+
+
+class _Exploit:
+    called = False
+
+    def __reduce__(self):
+        return (setattr, (_Exploit, 'called', True))
+
+
+def test_shared_backends_never_unpickle(tmp_path, redis_server):
+    backend = cache.SQLiteBackend(str(tmp_path / 'cache.db'))
+    with backend._pool.transaction() as conn:
+        conn.execute('INSERT INTO cache_entries (key, value, expires_at) VALUES (?, ?, ?)',
+                     ('schedule:evil', pickle.dumps(_Exploit()), time.time() + 60))
+    assert backend.get(('evil',)) is None
+
+    redis_server.data[b'schedule:evil'] = (pickle.dumps(_Exploit()), None)
+    host, port = redis_server.server_address
+    assert cache.RedisBackend(f'redis://{host}:{port}/0').get(('evil',)) is None
+    assert not _Exploit.called
+
+
+def test_memory_counters_are_bounded_and_monotonic():
+    backend = cache.MemoryBackend(max_counters=3)
+    for tag in range(3):
+        for _ in range(tag + 1):
+            backend.incr(('ver', tag))
+    # 读取也算使用：0 号计数器最近被读过，淘汰的是 1 号
+    assert backend.get_counter(('ver', 0)) == 1
+    backend.incr(('ver', 3))
+    assert backend.stats()['counters'] == 3
+    assert backend.stats()['counter_evictions'] == 1
+
+    # 被淘汰的计数器不会退回到更小的版本号
+    assert backend.get_counter(('ver', 1)) == 2
+    assert backend.incr(('ver', 1)) == 3
+
+    for tag in range(100, 200):
+        backend.incr(('ver', tag))
+    assert backend.stats()['counters'] == 3
+    assert backend.get_counter(('ver', 2)) >= 3
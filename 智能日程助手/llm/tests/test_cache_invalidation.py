@@ -0,0 +1,61 @@
+import sqlite3
+from datetime import datetime
+
+import pytest
+
+import db
+import cache
+import bulk_io
+import recurrence
+from schedule_manager import ScheduleManager
+
+
+@pytest.fixture
+def global_pool(pool, monkeypatch):
+    monkeypatch.setattr(db, 'pool', pool)
+    return pool
+
+
+def _committed(pool, table, user_id):
+    """用连接池之外的独立连接读取，只能看到已提交的数据"""
+    conn = sqlite3.connect(pool.db_path)
+    try:
+        return conn.execute(f'SELECT COUNT(*) FROM {table} WHERE user_id = ?', (user_id,)).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_delete_events_by_date_invalidates_after_commit(global_pool, monkeypatch):
+    manager = ScheduleManager()
+    for hour in (9, 14):
+        manager.add_event({
+            'title': f'会议{hour}', 'start_time': f'2026-01-05 {hour:02d}:00:00',
+            'end_time': f'2026-01-05 {hour + 1:02d}:00:00', 'description': '', 'location': None
+        }, 7)
+
+    seen = []
+    monkeypatch.setattr(manager, '_invalidate_cache',
+                        lambda user_id, start, end: seen.append(_committed(global_pool, 'Events', user_id)))
+
+    assert manager.delete_events_by_date('2026-01-05', 7) == 2
+    assert seen == [0, 0]
+
+
+def test_import_invalidates_recurrence_tag_after_commit(global_pool, monkeypatch):
+    seen = []
+    invalidate_tag = cache.month_cache.invalidate_tag
+
+    def record(tag):
+        if tag == recurrence.recurrence_tag(8):
+            seen.append(_committed(global_pool, 'EventRecurrences', 8))
+        invalidate_tag(tag)
+
+    monkeypatch.setattr(cache.month_cache, 'invalidate_tag', record)
+    result = bulk_io.import_events(8, [
+        {'title': '晨跑', 'start_time': datetime(2026, 1, 5, 7), 'end_time': datetime(2026, 1, 5, 8),
+         'location': None, 'description': '', 'freq': 'DAILY', 'interval': 1},
+        {'title': '组会', 'start_time': datetime(2026, 1, 6, 9), 'end_time': datetime(2026, 1, 6, 10),
+         'location': None, 'description': '', 'is_all_day': False},
+    ])
+    assert result['imported'] == 1 and result['recurring'] == 1
+    assert seen == [1]
@@ -0,0 +1,53 @@
+import json
+from datetime import datetime
+
+import pytest
+
+import db
+import json_stream
+import recurrence
+import schedule_manager
+from schedule_manager import ScheduleManager
+
+
+@pytest.fixture
+def global_pool(pool, monkeypatch):
+    monkeypatch.setattr(db, 'pool', pool)
+    return pool
+
+
+def test_iter_array_reraises_without_closing_the_array():
+    def items():
+        yield {'id': 1}
+        raise RuntimeError('cursor failed')
+
+    chunks = []
+    with pytest.raises(RuntimeError):
+        for chunk in json_stream.iter_array(items(), chunk_items=1):
+            chunks.append(chunk)
+    assert chunks == ['[', '{"id":1}']
+    with pytest.raises(ValueError):
+        json.loads(''.join(chunks))
+
+
+def test_get_all_events_pages_without_holding_a_connection(global_pool, monkeypatch):
+    monkeypatch.setattr(schedule_manager, 'CALENDAR_FETCH_SIZE', 3)
+    with global_pool.connection() as conn:
+        # 同一开始时间的日程跨越页边界，检查 (start_time, event_id) 键集不会漏读或重复
+        conn.executemany(
+            'INSERT INTO Events (user_id, title, start_time, end_time) VALUES (?, ?, ?, ?)',
+            [(5, f'日程{i}', f'2026-01-{i // 2 + 1:02d} 09:00:00', f'2026-01-{i // 2 + 1:02d} 10:00:00')
+             for i in range(10)])
+        conn.commit()
+    recurrence.add_rule(5, {
+        'title': '周会', 'start_time': datetime(2026, 1, 1, 8), 'end_time': datetime(2026, 1, 1, 9),
+        'freq': 'WEEKLY', 'weekdays': [3]
+    })
+
+    events = ScheduleManager().get_all_events(5, '2026-01-01 00:00:00', '2026-01-06 00:00:00')
+    first = next(events)
+    stats = global_pool.stats()
+    assert stats['idle'] == stats['open']
+
+    titles = [first['title']] + [event['title'] for event in events]
+    assert titles == ['周会'] + [f'日程{i}' for i in range(10)]
@@ -0,0 +1,57 @@
+import pytest
+
+import db
+import chat_history
+
+
+@pytest.fixture
+def global_pool(pool, monkeypatch):
+    monkeypatch.setattr(db, 'pool', pool)
+    return pool
+
+
+def test_pages_walk_back_without_gaps_or_duplicates(global_pool):
+    for index in range(7):
+        chat_history.append(1, 'user' if index % 2 == 0 else 'assistant', f'消息{index}')
+        # 其他用户的记录穿插其中
+        chat_history.append(2, 'user', f'其他{index}')
+
+    first = chat_history.page(1, limit=3)
+    # 每页内按时间从早到晚排列
+    assert [message['content'] for message in first['messages']] == ['消息4', '消息5', '消息6']
+    assert first['messages'][0]['role'] == 'user'
+
+    contents = [message['content'] for message in first['messages']]
+    before = first['next_before']
+    pages = 1
+    while before is not None:
+        result = chat_history.page(1, before, 3)
+        contents = [message['content'] for message in result['messages']] + contents
+        before = result['next_before']
+        pages += 1
+    assert pages == 3
+    assert contents == [f'消息{index}' for index in range(7)]
+
+
+def test_exact_page_boundary_has_no_empty_next_page(global_pool):
+    for index in range(4):
+        chat_history.append(1, 'user', f'消息{index}')
+    first = chat_history.page(1, limit=2)
+    second = chat_history.page(1, first['next_before'], 2)
+    assert [message['content'] for message in second['messages']] == ['消息0', '消息1']
+    assert second['next_before'] is None
+
+
+def test_limit_is_clamped(global_pool):
+    for index in range(chat_history.MAX_PAGE_SIZE + 5):
+        chat_history.append(1, 'user', str(index))
+    assert len(chat_history.page(1, limit=10_000)['messages']) == chat_history.MAX_PAGE_SIZE
+    assert len(chat_history.page(1, limit=0)['messages']) == 1
+
+
+def test_clear_only_touches_one_user(global_pool):
+    chat_history.append(1, 'user', 'a')
+    chat_history.append(2, 'user', 'b')
+    assert chat_history.clear(1) == 1
+    assert chat_history.page(1) == {'messages': [], 'next_before': None}
+    assert [message['content'] for message in chat_history.page(2)['messages']] == ['b']
@@ -0,0 +1,63 @@
+import threading
+
+import pytest
+
+import db
+import chat_history
+
+SSE = {'Accept': 'text/event-stream'}
+
+
+@pytest.fixture
+def app_module(pool, monkeypatch):
+    monkeypatch.setattr(db, 'pool', pool)
+    import app
+    app.app.config['TESTING'] = True
+    monkeypatch.setattr(app, 'chat_streams', threading.BoundedSemaphore(1))
+    monkeypatch.setattr(app.schedule_manager, 'stream_message', lambda message, user_id: iter(['你好', '！']))
+    return app
+
+
+def _client(app_module, user_id=1):
+    client = app_module.app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = user_id
+    return client
+
+
+def _contents(user_id):
+    return [(message['role'], message['content']) for message in chat_history.page(user_id)['messages']]
+
+
+def test_streams_beyond_cap_are_rejected(app_module):
+    first = _client(app_module, 1).post('/chat', json={'message': '第一条'}, headers=SSE, buffered=False)
+    assert first.status_code == 200
+
+    # 第一条流还没有结束，名额已满
+    rejected = _client(app_module, 2).post('/chat', json={'message': '第二条'}, headers=SSE)
+    assert rejected.status_code == 503
+    assert rejected.headers['Retry-After'] == '5'
+    assert rejected.get_json()['response']
+    assert _contents(2) == []
+
+    # 非流式请求不受限制
+    assert _client(app_module, 2).post('/chat', json={'message': '今天有什么日程'}).status_code == 200
+
+    body = b''.join(first.response)
+    assert '"delta": "你好"'.encode() in body
+    first.close()
+    assert _contents(1) == [('user', '第一条'), ('assistant', '你好！')]
+
+    # 响应关闭后名额归还
+    second = _client(app_module, 2).post('/chat', json={'message': '第二条'}, headers=SSE)
+    assert second.status_code == 200
+    second.close()
+
+
+def test_slot_released_when_client_disconnects_early(app_module):
+    response = _client(app_module).post('/chat', json={'message': '第一条'}, headers=SSE, buffered=False)
+    # 一个字节都没有读就断开
+    response.close()
+    retry = _client(app_module).post('/chat', json={'message': '第二条'}, headers=SSE)
+    assert retry.status_code == 200
+    retry.close()
@@ -0,0 +1,17 @@
+import conflicts
+
+
+def test_format_warning():
+    warning = conflicts.format_warning([(1, '周会', '2026-01-05 09:00:00', '2026-01-05 10:00:00', None)])
+    assert '- 周会 (01-05 09:00 - 10:00)' in warning
+
+
+def test_format_warning_keeps_unparseable_legacy_times():
+    warning = conflicts.format_warning([
+        (1, '旧日程', '2026/01/05 9:00', '下午', None),
+        (2, '无时间', None, None, None),
+        (3, '分钟精度', '2026-01-05T09:30', '2026-01-05 10:30', None),
+    ])
+    assert '- 旧日程 (2026/01/05 9:00 - 下午)' in warning
+    assert '- 无时间 (None - None)' in warning
+    assert '- 分钟精度 (01-05 09:30 - 10:30)' in warning
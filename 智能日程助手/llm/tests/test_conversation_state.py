@@ -0,0 +1,86 @@
+import pytest
+
+import cache
+import conversation_state
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(conversation_state.time, 'time', clock.time)
+    return clock
+
+
+def _store(**kwargs):
+    kwargs.setdefault('backend', cache.MemoryBackend())
+    return conversation_state.ConversationStateStore(**kwargs)
+
+
+def test_entries_expire_after_ttl(clock):
+    store = _store(ttl=60)
+    store.set(1, 'delete', [11, 12])
+    clock.now += 59
+    assert store.get(1).event_ids == (11, 12)
+    clock.now += 2
+    assert store.get(1) is None
+    assert store.stats()['expired'] == 1
+    assert store.stats()['live_sessions'] == 0
+
+
+def test_expired_entries_are_swept_on_write(clock):
+    store = _store(ttl=60, stripes=1)
+    store.set(1, 'delete', [11])
+    store.set(2, 'delete', [21])
+    clock.now += 61
+    store.set(3, 'modify', [31])
+    stats = store.stats()
+    assert (stats['live_sessions'], stats['expired'], stats['evicted']) == (1, 2, 0)
+
+
+def test_each_stripe_evicts_oldest_entry(clock):
+    # 两段，每段最多两个用户；偶数和奇数用户落在不同的段
+    store = _store(max_entries=4, stripes=2)
+    for user_id in (2, 4, 1, 6):
+        store.set(user_id, 'delete', [user_id])
+        clock.now += 1
+    assert store.get(2) is None
+    assert [store.get(user_id).event_ids for user_id in (4, 6, 1)] == [(4,), (6,), (1,)]
+    assert store.stats()['evicted'] == 1
+
+    # 重新写入的用户移到最后，不会先被淘汰
+    store.set(4, 'modify', [40])
+    store.set(8, 'delete', [8])
+    assert store.get(6) is None and store.get(4).event_ids == (40,)
+
+
+def test_select_keeps_candidates_and_clear(clock):
+    store = _store()
+    store.set(1, 'modify', [11, 12, 13])
+    entry = store.select(1, 12)
+    assert (entry.operation, entry.event_ids, entry.selected_id) == ('modify', (11, 12, 13), 12)
+    # 没有候选列表时直接记录选中的日程
+    assert store.select(2, 21).event_ids == (21,)
+    store.clear(1)
+    assert store.get(1) is None and store.get(2) is not None
+
+
+def test_shared_backend_round_trip(clock, tmp_path):
+    backend = cache.SQLiteBackend(str(tmp_path / 'cache.db'))
+    first, second = _store(backend=backend, ttl=60), _store(backend=backend, ttl=60)
+    first.set(1, 'delete', [11, 'r3@2026-01-05 07:00:00'])
+    entry = second.get(1)
+    assert (entry.operation, entry.event_ids) == ('delete', (11, 'r3@2026-01-05 07:00:00'))
+    clock.now += 61
+    assert second.get(1) is None
+    second.set(1, 'modify', [12])
+    first.clear(1)
+    assert second.get(1) is None
+    assert second.stats()['live_sessions'] is None
@@ -0,0 +1,77 @@
+import json
+
+import pytest
+
+import db
+import event_pages
+
+
+@pytest.fixture
+def global_pool(pool, monkeypatch):
+    monkeypatch.setattr(db, 'pool', pool)
+    return pool
+
+
+def _insert(pool, rows):
+    with pool.connection() as conn:
+        conn.executemany('INSERT INTO Events (user_id, title, start_time, end_time) VALUES (?, ?, ?, ?)', rows)
+        conn.commit()
+
+
+def _walk(user_id, limit, **kwargs):
+    titles, cursor, pages = [], None, 0
+    while True:
+        rows, cursor = event_pages.fetch(user_id, cursor, limit, **kwargs)
+        titles += [row[1] for row in rows]
+        pages += 1
+        if cursor is None:
+            return titles, pages
+
+
+def test_cursor_round_trip():
+    token = event_pages.encode_cursor('2026-01-05 09:00:00', 42)
+    assert '=' not in token and '/' not in token and '+' not in token
+    assert event_pages.decode_cursor(token) == ('2026-01-05 09:00:00', 42)
+    # 查询参数中的 event_id 是字符串时同样编码为整数
+    assert event_pages.decode_cursor(event_pages.encode_cursor('2026-01-05 09:00:00', '7')) == ('2026-01-05 09:00:00', 7)
+
+
+@pytest.mark.parametrize('token', ['', 'not base64!', 'MjAyNg', event_pages.encode_cursor('明天', 1),
+                                   'MjAyNi0wMS0wNSAwOTowMDowMHx4'])
+def test_invalid_cursor(token):
+    with pytest.raises(ValueError):
+        event_pages.decode_cursor(token)
+
+
+def test_ties_on_start_time_across_page_boundaries(global_pool):
+    # 五个日程开始时间相同，按 event_id 决定先后；另一个用户的数据不混入
+    _insert(global_pool, [(1, f'同时{i}', '2026-01-05 09:00:00', '2026-01-05 10:00:00') for i in range(5)]
+            + [(2, '别人', '2026-01-05 09:00:00', '2026-01-05 10:00:00')]
+            + [(1, '更早', '2026-01-04 09:00:00', '2026-01-04 10:00:00'),
+               (1, '更晚', '2026-01-06 09:00:00', '2026-01-06 10:00:00')])
+    expected = ['更早'] + [f'同时{i}' for i in range(5)] + ['更晚']
+    for limit in (1, 2, 3, 7, 8):
+        titles, pages = _walk(1, limit)
+        assert titles == expected
+        assert pages == max(1, -(-len(expected) // limit))
+
+
+def test_range_and_limits(global_pool):
+    _insert(global_pool, [(1, f'第{day}天', f'2026-01-{day:02d} 09:00:00', f'2026-01-{day:02d} 10:00:00')
+                          for day in range(1, 11)])
+    titles, _ = _walk(1, 2, start='2026-01-03 00:00:00', end='2026-01-06 00:00:00')
+    assert titles == ['第3天', '第4天', '第5天']
+
+    rows, cursor = event_pages.fetch(1, limit=10_000)
+    assert len(rows) == 10 and cursor is None
+    rows, cursor = event_pages.fetch(1, limit=0)
+    assert len(rows) == 1 and event_pages.decode_cursor(cursor)[0] == '2026-01-01 09:00:00'
+
+
+def test_iter_json_is_valid(global_pool):
+    _insert(global_pool, [(1, f'日程"{i}"', '2026-01-05 09:00:00', '2026-01-05 10:00:00') for i in range(5)])
+    rows, cursor = event_pages.fetch(1, limit=3)
+    data = json.loads(''.join(event_pages.iter_json(rows, cursor, chunk_rows=2)))
+    assert [event['title'] for event in data['events']] == ['日程"0"', '日程"1"', '日程"2"']
+    assert data['next_cursor'] == cursor
+    assert json.loads(''.join(event_pages.iter_json([], None))) == {'events': [], 'next_cursor': None}
@@ -0,0 +1,86 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+
+import db
+import free_slots
+import recurrence
+from schedule_manager import ScheduleManager
+
+DAY = date(2026, 1, 5)
+
+
+@pytest.fixture
+def global_pool(pool, monkeypatch):
+    monkeypatch.setattr(db, 'pool', pool)
+    return pool
+
+
+def _at(hour, minute=0, day=DAY):
+    return datetime(day.year, day.month, day.day, hour, minute)
+
+
+def _add(user_id, start, end, title='日程'):
+    ScheduleManager().add_event({'title': title, 'start_time': start.strftime('%Y-%m-%d %H:%M:%S'),
+                                 'end_time': end.strftime('%Y-%m-%d %H:%M:%S'),
+                                 'description': '', 'location': None}, user_id)
+
+
+def _spans(slots):
+    return [(start.strftime('%m-%d %H:%M'), end.strftime('%H:%M')) for _, start, end in slots]
+
+
+def test_merge_intervals_and_gaps():
+    merged = free_slots.merge_intervals([
+        (_at(9), _at(10)), (_at(9, 30), _at(11)), (_at(11), _at(11, 30)), (_at(13), _at(14)), (_at(13, 15), _at(13, 45)),
+    ])
+    assert merged == [[_at(9), _at(11, 30)], [_at(13), _at(14)]]
+    slots = free_slots.gaps(merged, _at(8), _at(18), timedelta(minutes=60))
+    assert slots == [(_at(8), _at(9)), (_at(11, 30), _at(13)), (_at(14), _at(18))]
+    # 短于最短时长的空隙不返回
+    assert free_slots.gaps(merged, _at(8), _at(18), timedelta(minutes=100)) == [(_at(14), _at(18))]
+    assert free_slots.gaps([], _at(9), _at(10), timedelta(minutes=30)) == [(_at(9), _at(10))]
+
+
+def test_parse_hours():
+    assert free_slots.parse_hours('09:00-18:30') == ((9, 0), (18, 30))
+    for spec in ('18:00-09:00', '9-18', '09:00-25:00'):
+        with pytest.raises(ValueError):
+            free_slots.parse_hours(spec)
+
+
+def test_free_slots_include_recurring_and_overnight_events(global_pool):
+    _add(1, _at(9), _at(10, 30))
+    _add(1, _at(12), _at(13))
+    # 前一天开始、延续到当天上午的日程
+    _add(1, _at(22, day=date(2026, 1, 4)), _at(9, 30))
+    recurrence.add_rule(1, {'title': '站会', 'start_time': _at(15), 'end_time': _at(15, 30), 'freq': 'DAILY'})
+
+    slots = free_slots.find_free_slots([1, 2], DAY, hours=((9, 0), (18, 0)), min_minutes=30)
+    assert _spans(slots[1]) == [('01-05 10:30', '12:00'), ('01-05 13:00', '15:00'), ('01-05 15:30', '18:00')]
+    assert _spans(slots[2]) == [('01-05 09:00', '18:00')]
+
+
+def test_common_slots_and_now(global_pool):
+    _add(1, _at(9), _at(11))
+    _add(2, _at(10), _at(12))
+    _add(2, _at(9, day=date(2026, 1, 6)), _at(17, day=date(2026, 1, 6)))
+    slots = free_slots.find_common_free_slots([1, 2], DAY, date(2026, 1, 6), hours=((9, 0), (18, 0)),
+                                              now=_at(14, 20))
+    # 已经过去的时间不算空闲
+    assert _spans(slots) == [('01-05 14:21', '18:00'), ('01-06 17:00', '18:00')]
+
+
+def test_range_limits():
+    with pytest.raises(ValueError):
+        free_slots.find_free_slots([1], DAY, DAY - timedelta(days=1))
+    with pytest.raises(ValueError):
+        free_slots.find_free_slots([1], DAY, DAY + timedelta(days=free_slots.MAX_RANGE_DAYS))
+
+
+def test_chat_answer(global_pool):
+    _add(3, _at(13), _at(17))
+    reply = ScheduleManager().answer_free_slots('1月5日下午有空吗', 3, now=_at(8))
+    assert reply == '01月05日 的空闲时间：\n🕘 12:00 - 13:00\n🕘 17:00 - 18:00'
+    reply = ScheduleManager().answer_free_slots('1月5日下午有两个小时的空吗', 3, now=_at(8))
+    assert reply == '01月05日 没有不少于 120 分钟的空闲时间。'
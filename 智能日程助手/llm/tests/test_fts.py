@@ -0,0 +1,88 @@
+import sqlite3
+
+import pytest
+
+import db
+import event_pages
+from schedule_manager import ScheduleManager
+
+
+@pytest.fixture
+def global_pool(pool, monkeypatch):
+    monkeypatch.setattr(db, 'pool', pool)
+    return pool
+
+
+def _plain_connect(pool):
+    """不注册任何自定义函数的连接，相当于 sqlite3 命令行"""
+    return sqlite3.connect(pool.db_path)
+
+
+def _queued(pool):
+    with pool.connection() as conn:
+        return conn.execute('SELECT COUNT(*) FROM EventsFtsQueue').fetchone()[0]
+
+
+def test_plain_connection_can_write_events(global_pool):
+    conn = _plain_connect(global_pool)
+    try:
+        conn.execute("INSERT INTO Events (user_id, title, start_time, end_time, location) "
+                     "VALUES (3, '项目周会', '2026-01-05 09:00:00', '2026-01-05 10:00:00', '会议室A')")
+        conn.execute("UPDATE Events SET description = '讨论季度目标' WHERE user_id = 3")
+        conn.commit()
+    finally:
+        conn.close()
+    assert _queued(global_pool) == 1
+
+    # 读路径不补索引，也不开启写事务
+    manager = ScheduleManager()
+    assert manager.search_events_by_keywords(['周会'], 3) == []
+    assert _queued(global_pool) == 1
+
+    # 应用的下一次写入在同一事务内处理整个队列
+    manager.add_event({
+        'title': '午餐', 'start_time': '2026-01-05 12:00:00', 'end_time': '2026-01-05 13:00:00',
+        'description': '', 'location': None
+    }, 9)
+    assert _queued(global_pool) == 0
+    assert [row[0] for row in manager.search_events_by_keywords(['周会'], 3)] == ['项目周会']
+    assert [row[0] for row in manager.search_events_by_keywords(['季度'], 3)] == ['项目周会']
+    rows, _ = event_pages.fetch(3, keywords=['会议室'])
+    assert [row[1] for row in rows] == ['项目周会']
+
+
+def test_search_does_not_wait_for_writers(global_pool):
+    ScheduleManager().add_event({
+        'title': '项目周会', 'start_time': '2026-01-05 09:00:00', 'end_time': '2026-01-05 10:00:00',
+        'description': '', 'location': None
+    }, 3)
+    writer = _plain_connect(global_pool)
+    try:
+        # 另一个连接留下已提交但未处理的队列项，然后持有写锁
+        writer.execute("INSERT INTO Events (user_id, title, start_time, end_time) "
+                       "VALUES (3, '周会纪要', '2026-01-06 09:00:00', '2026-01-06 10:00:00')")
+        writer.commit()
+        writer.execute('BEGIN IMMEDIATE')
+        assert [row[0] for row in ScheduleManager().search_events_by_keywords(['周会'], 3)] == ['项目周会']
+        rows, _ = event_pages.fetch(3, keywords=['周会'])
+        assert [row[1] for row in rows] == ['项目周会']
+    finally:
+        writer.rollback()
+        writer.close()
+
+
+def test_app_writes_are_indexed_in_the_same_transaction(global_pool):
+    manager = ScheduleManager()
+    manager.add_event({
+        'title': '论文答辩', 'start_time': '2026-01-06 14:00:00', 'end_time': '2026-01-06 16:00:00',
+        'description': '', 'location': '图书馆'
+    }, 4)
+    with global_pool.connection() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM EventsFtsQueue').fetchone()[0] == 0
+    assert [row[0] for row in manager.search_events_by_keywords(['答辩'], 4)] == ['论文答辩']
+
+    event_id = manager.find_event_by_time('2026-01-06', 4)[0][0]
+    assert manager.update_event(event_id, {'title': '开题报告'}, 4)[0]
+    assert manager.search_events_by_keywords(['答辩'], 4) == []
+    assert manager.delete_event(event_id, 4)
+    assert manager.search_events_by_keywords(['开题'], 4) == []
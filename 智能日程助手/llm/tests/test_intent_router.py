@@ -0,0 +1,57 @@
+import itertools
+
+import pytest
+
+import intent_router
+
+
+@pytest.mark.parametrize('message, intent, slots', [
+    ('明天下午有空吗', 'free_slots', {}),
+    ('下周哪天有时间', 'free_slots', {}),
+    ('什么时候有数学课', 'smart_query', {}),
+    ('3月有哪些会议安排', 'smart_query', {}),
+    ('2', 'select', {'index': '2'}),
+    (' 12 ', 'select', {'index': '12'}),
+    ('删除明天的日程', 'delete', {}),
+    ('取消下午的安排', 'delete', {}),
+    ('修改「组会」的地点', 'modify', {}),
+    ('改到下午4点', 'modify', {}),
+    ('搜索 项目 会议', 'search', {}),
+    ('今天有什么日程', 'query_today', {}),
+    ('明天的日程', 'query_tomorrow', {}),
+    ('本周日程', 'query_week', {}),
+    ('所有日程', 'query_all', {}),
+    ('12月25日的日程', 'query_date', {'month': '12', 'day': '25'}),
+    ('2026年3月5日有什么日程', 'query_date', {'year': '2026', 'month': '3', 'day': '5'}),
+    ('3月有哪些日程', 'query_month', {'month': '3'}),
+    ('2027年1月的日程', 'query_month', {'year': '2027', 'month': '1'}),
+    ('明天下午3点在会议室A开项目会', None, {}),
+    ('1 2', None, {}),
+    ('', None, {}),
+])
+def test_route(message, intent, slots):
+    assert intent_router.route(message) == (intent, slots)
+
+
+def test_combined_pattern_matches_rule_order():
+    # 合并正则与逐条 re.search 在各种组合的消息上给出相同的意图和槽位
+    fragments = ['', '明天', '3月', '2026年3月5日', '删除', '改到', '有空', '的', '日程', '会议', '搜索', '所有', '本周', '7']
+    messages = [''.join(parts) for parts in itertools.product(fragments, repeat=3)]
+    messages += intent_router.BENCHMARK_MESSAGES
+    router = intent_router.router
+    mismatches = [message for message in messages if router.route(message) != router.route_naive(message)]
+    assert mismatches == []
+
+
+def test_every_intent_is_reachable():
+    hits = {intent_router.route(message)[0] for message in [
+        '有空吗', '明天有什么会议', '1', '删掉', '改到三点', '查找', '今天日程', '明天日程',
+        '本周日程', '全部日程', '5月1日日程', '5月日程']}
+    assert hits == set(intent_router.router.intents)
+
+
+def test_extract_title():
+    assert intent_router.extract_title('修改「组会」的地点') == '组会'
+    assert intent_router.extract_title('把“项目 周会”改到明天') == '项目 周会'
+    assert intent_router.extract_title('把"周报"改到明天') == '周报'
+    assert intent_router.extract_title('改到明天') is None
@@ -0,0 +1,66 @@
+import os
+import sys
+import subprocess
+from datetime import date
+
+import llm_cache
+
+MONDAY = date(2026, 1, 5)
+
+
+def _key(message, today=MONDAY):
+    return llm_cache.normalize_message(message, today)
+
+
+def test_equivalent_messages_share_a_key():
+    key = _key('明天下午三点开会')
+    # 全角数字、句末标点、相对日期与绝对日期
+    assert _key('明天下午三点开会！！') == key
+    assert _key('明天下午三点开会?') == key
+    assert _key('１月６日下午三点开会。') == key
+    assert _key('1月6日下午三点开会') == key
+    # 前一天说“后天”指的是同一天
+    assert _key('后天下午三点开会', date(2026, 1, 4)) == key
+    assert _key('  明天下午三点   开会 ') == _key('明天下午三点 开会')
+
+
+def test_date_context_in_key():
+    # 没有日期的消息按“今天”理解，键中带今天的日期
+    assert _key('下午三点开会') == '下午三点开会@2026-01-05'
+    assert _key('下午三点开会') != _key('下午三点开会', date(2026, 1, 6))
+    # 有日期时只带年份：同一年内哪天问都命中
+    assert _key('1月20日开会') == _key('1月20日开会', date(2026, 1, 10)) == '2026-01-20开会@2026'
+    assert _key('1月20日开会') != _key('1月20日开会', date(2027, 1, 10))
+    assert _key('明天开会') != _key('明天开会', date(2026, 1, 6))
+
+
+def test_response_cache_layers_and_ttl(tmp_path, monkeypatch):
+    responses = llm_cache.LLMResponseCache(str(tmp_path / 'llm.db'), memory_entries=2)
+    assert responses.get('parse_schedule', '明天开会', MONDAY) is None
+    responses.set('parse_schedule', '明天开会', '{"title": "开会"}', MONDAY)
+    assert responses.get('parse_schedule', '1月6日开会。', MONDAY) == '{"title": "开会"}'
+    # 提示类型不同的键互不影响
+    assert responses.get('query_intent', '明天开会', MONDAY) is None
+
+    # 进程内层被挤出后从文件读取
+    responses.set('parse_schedule', 'a', '1', MONDAY)
+    responses.set('parse_schedule', 'b', '2', MONDAY)
+    reopened = llm_cache.LLMResponseCache(str(tmp_path / 'llm.db'))
+    assert reopened.get('parse_schedule', '明天开会', MONDAY) == '{"title": "开会"}'
+    stats = reopened.stats()
+    assert (stats['disk_hits'], stats['entries']) == (1, 3)
+
+    expired = llm_cache.LLMResponseCache(str(tmp_path / 'llm.db'), ttl=-1)
+    assert expired.get('parse_schedule', '明天开会', MONDAY) is None
+
+
+def test_import_does_not_create_cache_files(tmp_path):
+    env = {key: value for key, value in os.environ.items()
+           if key not in ('SCHEDULE_LLM_CACHE_PATH', 'SCHEDULE_CACHE_BACKEND')}
+    env['SCHEDULE_CACHE_BACKEND'] = 'sqlite'
+    env['SCHEDULE_DB_PATH'] = str(tmp_path / 'db' / 'schedule.db')
+    env['PYTHONPATH'] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    os.mkdir(tmp_path / 'db')
+    subprocess.run([sys.executable, '-c', 'import llm_cache, cache, schedule_manager'],
+                   cwd=tmp_path, env=env, check=True)
+    assert sorted(os.listdir(tmp_path)) == ['db']
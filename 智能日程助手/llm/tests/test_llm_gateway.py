@@ -0,0 +1,135 @@
+import sys
+import time
+import types
+import threading
+
+import pytest
+
+import llm_gateway
+from llm_gateway import CircuitBreaker, LLMGateway, LLMUnavailable
+
+
+class _Message:
+    def __init__(self, content):
+        self.content = content
+
+
+class FlakyLLM:
+    """第一次 invoke 失败，之后正常；stream 不停地产出片段"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def invoke(self, prompt):
+        self.calls += 1
+        if self.calls == 1:
+            raise RuntimeError('upstream down')
+        return _Message('ok')
+
+    def stream(self, prompt):
+        for index in range(1000):
+            yield _Message(str(index))
+
+
+@pytest.fixture
+def gateway():
+    gateway = LLMGateway(llm=FlakyLLM(), retries=0, timeout=5, breaker=CircuitBreaker(threshold=1, cooldown=0))
+    yield gateway
+    gateway._executor.shutdown(wait=True)
+
+
+def test_closing_stream_during_half_open_probe_releases_breaker(gateway):
+    with pytest.raises(LLMUnavailable):
+        gateway.invoke('hi')
+    assert gateway.breaker.state == 'open'
+
+    # 冷却结束后的第一个请求就是半开探测；调用方只读一个片段就关闭生成器
+    stream = gateway.stream('hi')
+    assert next(stream).content == '0'
+    stream.close()
+
+    assert gateway.invoke('hi').content == 'ok'
+    assert gateway.breaker.state == 'closed'
+
+
+def test_probe_released_when_stream_cannot_start(gateway, monkeypatch):
+    with pytest.raises(LLMUnavailable):
+        gateway.invoke('hi')
+
+    def reject(*args, **kwargs):
+        raise RuntimeError('executor shut down')
+
+    monkeypatch.setattr(gateway._executor, 'submit', reject)
+    with pytest.raises(RuntimeError):
+        next(gateway.stream('hi'))
+    monkeypatch.undo()
+
+    assert gateway.invoke('hi').content == 'ok'
+
+
+class HungLLM:
+    """模拟卡住的上游：调用一直阻塞到测试结束"""
+
+    def __init__(self):
+        self.released = threading.Event()
+
+    def invoke(self, prompt):
+        self.released.wait()
+        return _Message('late')
+
+
+def test_hung_upstream_opens_breaker_instead_of_queueing():
+    llm = HungLLM()
+    gateway = LLMGateway(llm=llm, max_concurrency=2, retries=0, timeout=0.1)
+    try:
+        assert gateway.breaker.threshold == 2
+        for _ in range(2):
+            with pytest.raises(LLMUnavailable, match='超时'):
+                gateway.invoke('hi')
+        assert gateway.breaker.state == 'open'
+
+        # 熔断后立即返回，不再排队等满截止时间
+        started = time.monotonic()
+        with pytest.raises(LLMUnavailable, match='熔断'):
+            gateway.invoke('hi')
+        assert time.monotonic() - started < 0.05
+    finally:
+        llm.released.set()
+        gateway._executor.shutdown(wait=True)
+
+
+def test_queue_rejections_count_as_failures():
+    llm = HungLLM()
+    gateway = LLMGateway(llm=llm, max_concurrency=1, retries=0, timeout=0.05,
+                         breaker=CircuitBreaker(threshold=3, cooldown=60))
+    try:
+        with pytest.raises(LLMUnavailable, match='超时'):
+            gateway.invoke('hi')
+        # 唯一的名额被卡住的调用占着，之后的请求排队超时
+        for _ in range(2):
+            with pytest.raises(LLMUnavailable, match='排队超时'):
+                gateway.invoke('hi')
+        assert gateway.breaker.state == 'open'
+        assert gateway.stats()['kinds']['chat']['outcomes']['rejected'] == 2
+    finally:
+        llm.released.set()
+        gateway._executor.shutdown(wait=True)
+
+
+def test_tongyi_client_leaves_retries_and_deadline_to_gateway(monkeypatch):
+    import schedule_manager
+
+    created = {}
+
+    class ChatTongyi:
+        def __init__(self, **kwargs):
+            created.update(kwargs)
+
+    module = types.ModuleType('langchain_community.chat_models.tongyi')
+    module.ChatTongyi = ChatTongyi
+    monkeypatch.setitem(sys.modules, 'langchain_community.chat_models.tongyi', module)
+    monkeypatch.setattr(schedule_manager, 'LLM_BACKEND', 'qwen')
+
+    schedule_manager.create_llm()
+    assert created['max_retries'] == 0
+    assert created['model_kwargs']['request_timeout'] <= llm_gateway.LLM_TIMEOUT
@@ -0,0 +1,23 @@
+import migrations
+
+
+def _insert_events(conn, count, users=50):
+    conn.executemany(
+        'INSERT INTO Events (user_id, title, start_time, end_time) VALUES (?, ?, ?, ?)',
+        ((i % users, f'日程{i}', f'2026-01-{i % 28 + 1:02d} 09:00:00', f'2026-01-{i % 28 + 1:02d} 10:00:00')
+         for i in range(count)))
+    conn.commit()
+
+
+def test_plans_use_index_after_table_grows(pool):
+    with pool.connection() as conn:
+        _insert_events(conn, 3)
+        # 迁移不应在表很小时留下 ANALYZE 统计信息，否则表变大后规划器会按过期的估计选择全表扫描
+        stat_table = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone()
+        assert stat_table is None
+    with pool.connection() as conn:
+        _insert_events(conn, 20000)
+    pool.close_all()
+    with pool.connection() as conn:
+        assert migrations.check_index_usage(conn) == {}
+
@@ -0,0 +1,88 @@
+from datetime import datetime
+
+import pytest
+
+import db
+import stats
+import queries
+import bulk_io
+import free_slots
+import recurrence
+import event_pages
+import chat_history
+import migrations
+import conversation_memory
+from schedule_manager import ScheduleManager
+
+
+@pytest.fixture
+def statements(pool, monkeypatch):
+    """让全局连接池指向测试库，并记录其连接上执行的每条语句（参数已展开）"""
+    with pool.connection() as conn:
+        conn.executemany(
+            'INSERT INTO Events (user_id, title, start_time, end_time) VALUES (?, ?, ?, ?)',
+            ((i % 50, f'会议{i}', f'2026-01-{i % 28 + 1:02d} 09:00:00', f'2026-01-{i % 28 + 1:02d} 10:00:00')
+             for i in range(5000)))
+        conn.commit()
+    pool.close_all()
+
+    traced = []
+    connect = pool._connect
+
+    def traced_connect():
+        conn = connect()
+        conn.set_trace_callback(traced.append)
+        return conn
+
+    monkeypatch.setattr(pool, '_connect', traced_connect)
+    monkeypatch.setattr(db, 'pool', pool)
+    return traced
+
+
+def _run_hot_paths():
+    manager = ScheduleManager()
+    day = datetime(2026, 1, 5)
+    assert recurrence.add_rule(1, {
+        'title': '周会', 'start_time': datetime(2026, 1, 5, 9), 'end_time': datetime(2026, 1, 5, 10),
+        'freq': 'WEEKLY', 'weekdays': [0]
+    })
+    manager.query_events('custom', 1, day, day)
+    manager.get_month_events(2026, 1, 1)
+    manager.get_day_events(day, 1)
+    manager.find_event_by_time(day, 1)
+    manager.find_event_by_title_and_time('会议', day, 1)
+    manager.search_events_by_keywords(['会议'], 1)
+    list(manager.get_all_events(1, '2026-01-01 00:00:00', '2026-02-01 00:00:00'))
+    manager.get_event(1, 1)
+    event_pages.fetch(1)
+    event_pages.fetch(1, keywords=['会议'])
+    list(bulk_io.iter_user_events(1))
+    free_slots.find_free_slots([1, 2], day)
+    stats.StatisticsService().daily_histogram(1, day, datetime(2026, 1, 31))
+    conversation_memory.ConversationMemoryStore().load(1)
+    chat_history.page(1)
+
+
+def test_hot_paths_use_indexes(statements, pool):
+    _run_hot_paths()
+    selects = [sql for sql in statements if sql.lstrip().upper().startswith('SELECT')]
+    assert selects
+
+    with pool.connection() as conn:
+        full_scans = {sql: plan for sql in selects
+                      for plan in [migrations.explain(conn, sql)]
+                      if any(migrations._is_table_scan(step) for step in plan)}
+    assert full_scans == {}
+
+
+def test_report_uses_call_site_sql():
+    report = migrations.REPORT_QUERIES
+    assert report['query_events'][0] is queries.EVENTS_IN_RANGE
+    assert report['get_all_events'][0] is queries.CALENDAR_EVENTS
+    assert report['search_events_by_keywords'][0] is queries.SEARCH_EVENTS
+    assert report['events_page'][0] is event_pages.PAGE_SQL
+    assert report['export_events_page'][0] is bulk_io.EXPORT_PAGE_SQL
+    assert report['recurrence_rules'][0] is recurrence.RULES_SQL
+    assert report['chart_daily_histogram'][0] is stats.DAILY_HISTOGRAM_SQL
+    assert report['conversation_window'][0] is conversation_memory.WINDOW_SQL
+    assert report['chat_history_page'][0] is chat_history.PAGE_SQL
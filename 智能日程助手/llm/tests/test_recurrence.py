@@ -0,0 +1,155 @@
+from datetime import datetime
+
+import pytest
+
+import db
+import recurrence
+from schedule_manager import ScheduleManager
+
+
+@pytest.fixture
+def global_pool(pool, monkeypatch):
+    monkeypatch.setattr(db, 'pool', pool)
+    return pool
+
+
+def _rule(**fields):
+    data = {'title': '晨跑', 'start_time': datetime(2026, 1, 5, 7), 'end_time': datetime(2026, 1, 5, 8),
+            'location': '操场', 'description': '', 'freq': 'DAILY', 'interval': 1}
+    data.update(fields)
+    return data
+
+
+def _starts(user_id, first, last):
+    return [row[1] for row in recurrence.expand(user_id, first, last)]
+
+
+def test_expand_daily_weekly_monthly(global_pool):
+    recurrence.add_rule(1, _rule(interval=2, count=3))
+    assert _starts(1, datetime(2026, 1, 1), datetime(2026, 2, 1)) == [
+        '2026-01-05 07:00:00', '2026-01-07 07:00:00', '2026-01-09 07:00:00']
+
+    # 每两周的周一、周三，截止日期当天仍然包括在内
+    recurrence.add_rule(2, _rule(freq='WEEKLY', interval=2, weekdays=[0, 2], until=datetime(2026, 1, 21, 23, 59)))
+    assert _starts(2, datetime(2026, 1, 1), datetime(2026, 3, 1)) == [
+        '2026-01-05 07:00:00', '2026-01-07 07:00:00', '2026-01-19 07:00:00', '2026-01-21 07:00:00']
+
+    # 每月 31 号：没有 31 号的月份跳过
+    recurrence.add_rule(3, _rule(freq='MONTHLY', start_time=datetime(2026, 1, 31, 9), end_time=datetime(2026, 1, 31, 10)))
+    assert _starts(3, datetime(2026, 1, 1), datetime(2026, 6, 1)) == [
+        '2026-01-31 09:00:00', '2026-03-31 09:00:00', '2026-05-31 09:00:00']
+
+
+def test_expand_window_without_count_starts_near_window(global_pool):
+    recurrence.add_rule(1, _rule())
+    # 跨越窗口开始的那一次也要包括在内
+    rows = recurrence.expand(1, datetime(2030, 6, 1, 7, 30), datetime(2030, 6, 2, 7, 30))
+    assert [row[1] for row in rows] == ['2030-06-01 07:00:00', '2030-06-02 07:00:00']
+
+
+def test_exceptions_cancel_and_move(global_pool):
+    recurrence_id = recurrence.add_rule(1, _rule(count=5))
+    assert recurrence.set_exception(recurrence_id, 1, datetime(2026, 1, 6, 7), cancelled=True)
+    # 1 月 9 日那一次改到下个月，在 2 月的窗口中出现
+    assert recurrence.set_exception(recurrence_id, 1, datetime(2026, 1, 9, 7), title='补跑',
+                                    start_time=datetime(2026, 2, 2, 18), end_time=datetime(2026, 2, 2, 19))
+    assert _starts(1, datetime(2026, 1, 1), datetime(2026, 2, 1)) == [
+        '2026-01-05 07:00:00', '2026-01-07 07:00:00', '2026-01-08 07:00:00']
+    assert recurrence.expand(1, datetime(2026, 2, 1), datetime(2026, 3, 1)) == [
+        ('补跑', '2026-02-02 18:00:00', '2026-02-02 19:00:00', '操场', '')]
+
+    # 其他用户不能修改这条规则
+    assert not recurrence.set_exception(recurrence_id, 2, datetime(2026, 1, 5, 7), cancelled=True)
+    assert recurrence.delete_rule(recurrence_id, 1)
+    assert recurrence.expand(1, datetime(2026, 1, 1), datetime(2026, 3, 1)) == []
+    with db.connection() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM RecurrenceExceptions').fetchone()[0] == 0
+
+
+def test_occurrence_ids(global_pool):
+    recurrence_id = recurrence.add_rule(1, _rule(count=3))
+    occurrence_id = recurrence.format_occurrence_id(recurrence_id, '2026-01-06 07:00:00')
+    assert recurrence.parse_occurrence_id(occurrence_id) == (recurrence_id, '2026-01-06 07:00:00')
+    assert recurrence.parse_occurrence_id(12) is None
+    assert recurrence.parse_occurrence_id('r1@明天') is None
+
+    assert recurrence.get_occurrence(occurrence_id, 1) == (
+        occurrence_id, '晨跑', '2026-01-06 07:00:00', '2026-01-06 08:00:00', '操场', '')
+    assert recurrence.get_occurrence(occurrence_id, 2) is None
+    # 规则在这个时间没有发生（超出次数或时刻不对）
+    assert recurrence.get_occurrence(recurrence.format_occurrence_id(recurrence_id, '2026-01-09 07:00:00'), 1) is None
+    assert recurrence.get_occurrence(recurrence.format_occurrence_id(recurrence_id, '2026-01-06 07:30:00'), 1) is None
+
+
+def test_chat_delete_cancels_single_occurrence(global_pool):
+    manager = ScheduleManager()
+    recurrence.add_rule(1, _rule(title='周会', freq='WEEKLY', weekdays=[0],
+                                 start_time=datetime(2026, 1, 5, 10), end_time=datetime(2026, 1, 5, 11)))
+    manager.add_event({'title': '午餐', 'start_time': '2026-01-12 12:00:00', 'end_time': '2026-01-12 13:00:00',
+                       'description': '', 'location': None}, 1)
+
+    reply = manager._route_message('删除2026年1月12日的日程', 1)
+    assert '1. 周会 (10:00)' in reply and '2. 午餐 (12:00)' in reply
+    reply = manager._route_message('1', 1)
+    assert '已删除日程' in reply and '只取消了这一次' in reply
+
+    assert [row[0] for row in recurrence.expand(1, datetime(2026, 1, 5), datetime(2026, 1, 20))] == ['周会', '周会']
+    assert [row[1] for row in manager.find_event_by_time(datetime(2026, 1, 12), 1)] == ['午餐']
+
+
+def test_chat_modify_single_occurrence(global_pool):
+    manager = ScheduleManager()
+    recurrence.add_rule(1, _rule(title='周会', freq='WEEKLY', weekdays=[0],
+                                 start_time=datetime(2026, 1, 5, 10), end_time=datetime(2026, 1, 5, 11)))
+    [event] = manager.find_event_by_time(datetime(2026, 1, 12), 1)
+    assert manager.update_event(event[0], {'location': '会议室B'}, 1) == (True, '日程更新成功')
+    assert manager.update_event(event[0], {'start_time': datetime(2026, 1, 12, 15),
+                                           'end_time': datetime(2026, 1, 12, 16)}, 1)[0]
+
+    # 第二次修改保留第一次改过的地点
+    assert recurrence.expand(1, datetime(2026, 1, 5), datetime(2026, 1, 20)) == [
+        ('周会', '2026-01-05 10:00:00', '2026-01-05 11:00:00', '操场', ''),
+        ('周会', '2026-01-12 15:00:00', '2026-01-12 16:00:00', '会议室B', ''),
+        ('周会', '2026-01-19 10:00:00', '2026-01-19 11:00:00', '操场', ''),
+    ]
+    assert '会议室B' in manager._modified_message(event[0], 1)
+
+
+@pytest.fixture
+def client(global_pool):
+    import app
+    app.app.config['TESTING'] = True
+    client = app.app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = 1
+    return client
+
+
+def test_occurrence_and_rule_routes(client):
+    recurrence_id = recurrence.add_rule(1, _rule(count=3))
+    events = client.get('/api/calendar/events?start=2026-01-01&end=2026-02-01').get_json()
+    ids = [event['id'] for event in events]
+    assert ids == [recurrence.format_occurrence_id(recurrence_id, f'2026-01-0{day} 07:00:00') for day in (5, 6, 7)]
+
+    assert client.delete(f'/api/occurrences/{ids[0]}').status_code == 200
+    response = client.patch(f'/api/occurrences/{ids[1]}', json={'title': '间歇跑', 'start_time': '2026-01-06T18:00'})
+    assert response.status_code == 200
+    assert (response.get_json()['event']['start_time'], response.get_json()['event']['end_time']) == (
+        '2026-01-06 18:00:00', '2026-01-06 19:00:00')
+    assert client.patch(f'/api/occurrences/{ids[2]}', json={'start_time': '2026-01-07T09:00',
+                                                           'end_time': '2026-01-07T08:00'}).status_code == 400
+    assert client.patch(f'/api/occurrences/{ids[2]}', json={'start_time': '明天'}).status_code == 400
+    assert client.delete(f'/api/occurrences/{ids[0]}').status_code == 404
+    assert client.delete('/api/occurrences/123').status_code == 404
+
+    events = client.get('/api/calendar/events?start=2026-01-01&end=2026-02-01').get_json()
+    assert [(event['title'], event['start']) for event in events] == [
+        ('间歇跑', '2026-01-06T18:00:00'), ('晨跑', '2026-01-07T07:00:00')]
+
+    with client.session_transaction() as sess:
+        sess['user_id'] = 2
+    assert client.delete(f'/api/recurrences/{recurrence_id}').status_code == 404
+    with client.session_transaction() as sess:
+        sess['user_id'] = 1
+    assert client.delete(f'/api/recurrences/{recurrence_id}').status_code == 200
+    assert client.get('/api/calendar/events?start=2026-01-01&end=2026-02-01').get_json() == []
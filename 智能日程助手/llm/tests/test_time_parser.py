@@ -0,0 +1,46 @@
+from datetime import datetime
+
+import pytest
+
+import time_parser
+
+NOW = datetime(2026, 3, 10, 9, 0)
+
+
+@pytest.mark.parametrize('message', ['晚上12点看球赛', '夜里12点看球赛', '今晚12点看球赛'])
+def test_midnight_rolls_over_to_next_day(message):
+    event = time_parser.parse_event(message, NOW)
+    assert event['start_time'] == datetime(2026, 3, 11, 0, 0)
+    assert event['end_time'] == datetime(2026, 3, 11, 1, 0)
+
+
+def test_evening_range_ending_at_midnight():
+    event = time_parser.parse_event('明天晚上10点到12点通宵复习', NOW)
+    assert event['start_time'] == datetime(2026, 3, 11, 22, 0)
+    assert event['end_time'] == datetime(2026, 3, 12, 0, 0)
+
+
+def test_noon_is_unchanged():
+    assert time_parser.parse_event('明天中午12点吃饭', NOW)['start_time'] == datetime(2026, 3, 11, 12, 0)
+
+
+def test_bare_hour_goes_to_llm():
+    event = time_parser.parse_event('明天3点开会', NOW)
+    assert event['start_time'] == datetime(2026, 3, 11, 3, 0)
+    assert event['confidence'] < time_parser.CONFIDENCE_THRESHOLD
+
+
+@pytest.mark.parametrize('message', ['明天下午3点开会', '明天15点开会', '明天15时开会', '明晚8点看电影'])
+def test_unambiguous_hour_is_parsed_locally(message):
+    assert time_parser.parse_event(message, NOW)['confidence'] >= time_parser.CONFIDENCE_THRESHOLD
+
+
+def test_chinese_numeral_before_shi_is_not_a_time():
+    assert time_parser.find_time('收到后第一时间回复') == (None, None, None)
+    assert not time_parser.has_time_hint('请第一时间处理')
+    assert time_parser.find_time('15时30分')[0] == (15, 30)
+
+
+@pytest.mark.parametrize('message', ['昨天下午3点的会议很顺利', '前天下午3点和老师见面了'])
+def test_past_narration_goes_to_llm(message):
+    assert time_parser.parse_event(message, NOW)['confidence'] < time_parser.CONFIDENCE_THRESHOLD
@@ -0,0 +1,406 @@
+import os
+import re
+import threading
+from datetime import date, datetime, timedelta
+
+# 本地解析置信度不低于该值时直接使用结果，否则交给 AI 解析
+CONFIDENCE_THRESHOLD = float(os.getenv("SCHEDULE_PARSER_THRESHOLD", "0.8"))
+DEFAULT_DURATION = timedelta(hours=1)
+DEFAULT_LOCATION = '未指定地点'
+
+_NUM = r'(?:\d{1,2}|[零〇一二两三四五六七八九十]{1,3})'
+_CN_DIGITS = {'零': 0, '〇': 0, '一': 1, '二': 2, '两': 2, '三': 3, '四': 4,
+              '五': 5, '六': 6, '七': 7, '八': 8, '九': 9}
+_PERIOD = r'凌晨|早上|早晨|清晨|上午|中午|下午|傍晚|晚上|夜里|夜间'
+# 这些时段说的“12点”是当天结束时的午夜，记为 24 点，构造时间时进位到第二天 0 点
+_NIGHT_PERIODS = ('晚上', '夜里', '夜间')
+
+# 相对日期：偏移天数，以及隐含的时段
+_RELATIVE_DAYS = {
+    '前天': (-2, None), '昨天': (-1, None), '今天': (0, None), '今日': (0, None),
+    '今晚': (0, '晚上'), '明天': (1, None), '明日': (1, None), '明早': (1, '早上'),
+    '明晚': (1, '晚上'), '后天': (2, None), '大后天': (3, None),
+}
+_WEEKDAYS = {'一': 0, '二': 1, '三': 2, '四': 3, '五': 4, '六': 5, '日': 6, '天': 6,
+             '1': 0, '2': 1, '3': 2, '4': 3, '5': 4, '6': 5, '7': 6}
+
+DATE_PATTERN = re.compile(
+    r'(?P<iso>(?P<iso_y>\d{4})[-/.](?P<iso_m>\d{1,2})[-/.](?P<iso_d>\d{1,2}))'
+    rf'|(?P<cn>(?:(?P<cn_y>\d{{4}})年)?(?P<cn_m>{_NUM})月(?P<cn_d>{_NUM})[日号]?)'
+    # 12/25、12-25、12.25；后面紧跟“点/时/:”的是时间或时长，不当作日期
+    r'|(?P<short>(?<![\d.:：])(?P<short_m>\d{1,2})[/\-.](?P<short_d>\d{1,2})(?![\d:：点时小分]))'
+    r'|(?P<rel>大后天|前天|昨天|今天|今日|今晚|明天|明日|明早|明晚|后天)'
+    rf'|(?P<after>(?P<after_n>\d+|{_NUM})天(?:后|以后|之后))'
+    r'|(?P<week>(?P<week_prefix>下下个?|下个?|这个?|本|上个?)?(?:周|星期|礼拜)(?P<week_day>[一二三四五六日天1-7]))'
+)
+
+# “时”只接在阿拉伯数字后面（“15时”），避免把“第一时间”中的“一时”当作 1 点
+TIME_PATTERN = re.compile(
+    rf'(?P<period>{_PERIOD})?\s*(?P<hour>{_NUM})'
+    rf'(?:[:：](?P<colon_min>\d{{2}})|(?:点|(?<=\d)时)(?:(?P<half>半)|(?P<quarter>[一三])刻|(?P<minute>{_NUM})分?)?)'
+)
+
+END_TIME_PATTERN = re.compile(
+    rf'\s*(?:到|至|-|~|～|－|—)\s*(?P<period>{_PERIOD})?\s*(?P<hour>{_NUM})'
+    rf'(?:[:：](?P<colon_min>\d{{2}})|(?:点|(?<=\d)时)(?:(?P<half>半)|(?P<quarter>[一三])刻|(?P<minute>{_NUM})分?)?)?'
+)
+
+DURATION_PATTERN = re.compile(
+    r'(?:持续|共|用时)?'
+    rf'(?:(?P<hours>\d+(?:\.\d+)?|{_NUM}|半)(?P<and_half>个半)?个?(?:小时|钟头)'
+    rf'|(?P<minutes>\d+|{_NUM})分钟)'
+)
+
+LOCATION_PATTERN = re.compile(
+    r'(?:地点[是为：:]?\s*(?P<label>[^\s，,。；;！!？?]{1,20})'
+    r'|在(?P<loc>[^\s，,。；;！!？?]{1,20}?)'
+    r'(?=开|举行|召开|参加|上|进行|见|讨论|面试|吃|喝|聚|集合|有|和|与|跟|做|学|办|打|踢|玩|看|听|唱|跑|游|练|[，,。；;\s]|$))'
+)
+
+# 修改指令：“改到下午3点”“地点改到会议室A”
+CHANGE_PATTERN = re.compile(r'(?:改到|改成|改为|换到|调到|挪到|推迟到|提前到)(?P<target>[^，,。；;！!？?]+)')
+LOCATION_SUFFIX = re.compile(r'(?:室|厅|楼|层|地点|场|中心|馆|教室|线上|线下|公司|学校|家)$')
+
+# 带这些词的多半是查询或提问，不当作新增日程
+QUERY_WORDS = re.compile(r'什么|哪些|哪天|几点|吗|？|\?|查|看看|多少|有没有')
+
+# 一条消息中列出多个日程时的分隔：换行和分号；每行开头的列表序号（1. 2、- •）去掉
+ITEM_SEPARATOR = re.compile(r'[\r\n；;]+')
+LIST_MARKER = re.compile(r'^\s*(?:\d{1,3}\s*[.、)）]|[-*•·])\s*')
+
+_TITLE_PREFIX = re.compile(
+    r'^(?:请|帮我|给我|麻烦|我要|我想|我)?(?:添加|新增|创建|安排|记录|记一下|提醒我|提醒)?'
+    r'(?:一个|一下)?(?:日程|行程)?[：:，,\s]*(?:要|有个|有一个)?'
+)
+_TITLE_STRIP = '，,。；;！!：: 　的'
+
+
+def cn_to_int(text):
+    """把“十二”“两”“零五”或阿拉伯数字转换为整数"""
+    if text.isdigit():
+        return int(text)
+    if '十' in text:
+        tens, _, ones = text.partition('十')
+        return (_CN_DIGITS[tens] if tens else 1) * 10 + (_CN_DIGITS[ones] if ones else 0)
+    value = 0
+    for char in text:
+        value = value * 10 + _CN_DIGITS[char]
+    return value
+
+
+def _match_date(match, today):
+    """把 DATE_PATTERN 的一次匹配换算成 (date, 隐含时段)"""
+    kind = match.lastgroup
+    if kind == 'iso':
+        return date(int(match['iso_y']), int(match['iso_m']), int(match['iso_d'])), None
+    if kind == 'cn':
+        year = int(match['cn_y']) if match['cn_y'] else today.year
+        return date(year, cn_to_int(match['cn_m']), cn_to_int(match['cn_d'])), None
+    if kind == 'short':
+        return date(today.year, int(match['short_m']), int(match['short_d'])), None
+    if kind == 'rel':
+        offset, period = _RELATIVE_DAYS[match['rel']]
+        return today + timedelta(days=offset), period
+    if kind == 'after':
+        return today + timedelta(days=cn_to_int(match['after_n'])), None
+
+    # 周几：按周一为一周开始；不带前缀且这周已经过去时指下周
+    weekday = _WEEKDAYS[match['week_day']]
+    prefix = (match['week_prefix'] or '').rstrip('个')
+    monday = today - timedelta(days=today.weekday())
+    weeks = {'': 0, '这': 0, '本': 0, '下': 1, '下下': 2, '上': -1}[prefix]
+    target = monday + timedelta(weeks=weeks, days=weekday)
+    if not prefix and target < today:
+        target += timedelta(weeks=1)
+    return target, None
+
+
+def resolve_relative_dates(message, today=None):
+    """把“明天”“下周三”“3天后”等相对日期替换为绝对日期，返回 (新消息, 是否包含日期)
+
+    替换后的文本不再依赖当前日期，可以安全地用作缓存键。
+    """
+    today = today or date.today()
+    found = False
+    parts, last = [], 0
+    for match in DATE_PATTERN.finditer(message):
+        try:
+            day, period = _match_date(match, today)
+        except (ValueError, KeyError):
+            continue
+        found = True
+        parts.append(message[last:match.start()])
+        parts.append(day.isoformat() + (period or ''))
+        last = match.end()
+    parts.append(message[last:])
+    return ''.join(parts), found
+
+
+def _apply_period(hour, period):
+    if period in _NIGHT_PERIODS and hour == 12:
+        return 24
+    if period in ('下午', '傍晚', '晚上', '夜里', '夜间') and hour < 12:
+        return hour + 12
+    if period == '中午' and hour < 6:
+        return hour + 12
+    return hour
+
+
+def _at(day, clock):
+    """day 当天 clock=(时, 分) 的时间；24 点进位到第二天"""
+    hour, minute = clock
+    return datetime(day.year, day.month, day.day) + timedelta(hours=hour, minutes=minute)
+
+
+def _match_clock(match):
+    """把时间匹配换算成 (hour, minute)，不带时段时原样返回"""
+    hour = cn_to_int(match['hour'])
+    if match['colon_min']:
+        minute = int(match['colon_min'])
+    elif match['half']:
+        minute = 30
+    elif match['quarter']:
+        minute = 15 * cn_to_int(match['quarter'])
+    elif match['minute']:
+        minute = cn_to_int(match['minute'])
+    else:
+        minute = 0
+    return hour, minute
+
+
+def find_date(message, today=None):
+    """返回 (date, 隐含时段, 匹配到的文本片段)；没有日期时返回 (None, None, None)"""
+    today = today or date.today()
+    for match in DATE_PATTERN.finditer(message):
+        try:
+            day, period = _match_date(match, today)
+        except (ValueError, KeyError):
+            # 13月、2月30日之类的无效日期，继续找下一个
+            continue
+        return day, period, match.span()
+    return None, None, None
+
+
+def find_time(message, default_period=None):
+    """返回 ((hour, minute), 结束时间, 匹配到的文本片段)；没有时间时返回 (None, None, None)"""
+    for match in TIME_PATTERN.finditer(message):
+        hour, minute = _match_clock(match)
+        period = match['period'] or default_period
+        hour = _apply_period(hour, period)
+        if not (0 <= hour <= 24 and 0 <= minute < 60):
+            continue
+        start, span_end = (hour, minute), match.end()
+
+        end = None
+        end_match = END_TIME_PATTERN.match(message, span_end)
+        if end_match:
+            end_hour, end_minute = _match_clock(end_match)
+            if end_match['period']:
+                end_hour = _apply_period(end_hour, end_match['period'])
+            elif end_hour <= 12 and (end_hour, end_minute) <= start:
+                # “下午2点到4点”：结束时间沿用开始时间的时段；“晚上10点到12点”结束于午夜
+                end_hour += 12
+            if 0 <= end_hour <= 24 and 0 <= end_minute < 60 and (end_hour, end_minute) > start:
+                end, span_end = (end_hour, end_minute), end_match.end()
+        return start, end, (match.start(), span_end)
+    return None, None, None
+
+
+def find_duration(message):
+    """返回 (timedelta, 匹配到的文本片段)；没有时长时返回 (None, None)"""
+    match = DURATION_PATTERN.search(message)
+    if not match:
+        return None, None
+    if match['minutes']:
+        return timedelta(minutes=cn_to_int(match['minutes'])), match.span()
+    hours = match['hours']
+    if hours == '半':
+        value = 0.5
+    elif re.fullmatch(r'\d+(?:\.\d+)?', hours):
+        value = float(hours)
+    else:
+        value = cn_to_int(hours)
+    if match['and_half']:
+        value += 0.5
+    return timedelta(hours=value), match.span()
+
+
+def _remove_spans(message, spans):
+    """删除已识别的片段，剩余部分用于提取标题"""
+    result, last = [], 0
+    for start, end in sorted(span for span in spans if span):
+        if start >= last:
+            result.append(message[last:start])
+            last = end
+    result.append(message[last:])
+    return ' '.join(part for part in result if part.strip())
+
+
+def _clean_title(text):
+    text = _TITLE_PREFIX.sub('', text.strip(_TITLE_STRIP))
+    return re.sub(r'\s+', ' ', text).strip(_TITLE_STRIP)
+
+
+def parse_datetime(message, now=None):
+    """解析消息中的日期和时间；没有日期时用今天，没有时间时返回当天 00:00"""
+    now = now or datetime.now()
+    day, period, _ = find_date(message, now.date())
+    day = day or now.date()
+    clock, _, _ = find_time(message, period)
+    return _at(day, clock or (0, 0))
+
+
+def split_items(message):
+    """把一次粘贴的多条日程拆成单条文本；只有一条时返回只含它的列表"""
+    items = []
+    for part in ITEM_SEPARATOR.split(message):
+        part = LIST_MARKER.sub('', part).strip()
+        if part:
+            items.append(part)
+    return items
+
+
+def has_time_hint(message):
+    """消息中是否出现了日期或时间，用来判断一段文本是否可能是日程"""
+    return bool(DATE_PATTERN.search(message) or TIME_PATTERN.search(message))
+
+
+def parse_event(message, now=None):
+    """本地解析新增日程的消息
+
+    返回包含 title/start_time/end_time/location/description/confidence 的字典；
+    confidence 低于 CONFIDENCE_THRESHOLD 时调用方应交给 AI 解析。
+    """
+    now = now or datetime.now()
+    day, period, date_span = find_date(message, now.date())
+    clock, end_clock, time_span = find_time(message, period)
+    duration, duration_span = find_duration(message)
+
+    rest = _remove_spans(message, [date_span, time_span, duration_span])
+    location = None
+    location_match = LOCATION_PATTERN.search(rest)
+    if location_match:
+        location = location_match['label'] or location_match['loc']
+        rest = rest[:location_match.start()] + ' ' + rest[location_match.end():]
+    title = _clean_title(rest)
+
+    confidence = 0.0
+    if clock:
+        # 没有时段词的“3点”可能是凌晨也可能是下午，只给一半的分，交给 AI 结合上下文判断
+        stated_period = period or re.match(_PERIOD, message[time_span[0]:time_span[1]])
+        confidence += 0.5 if stated_period or not 1 <= clock[0] <= 12 else 0.25
+    if day:
+        confidence += 0.2
+    if title and len(title) <= 30:
+        confidence += 0.3
+    if QUERY_WORDS.search(message):
+        confidence = min(confidence, 0.3)
+    if day and day < now.date():
+        # “昨天下午3点的会议很顺利”多半是在叙述已经发生的事，而不是新增日程
+        confidence = min(confidence, 0.5)
+
+    start_time = end_time = None
+    if clock:
+        base = day or now.date()
+        start_time = _at(base, clock)
+        if end_clock:
+            end_time = _at(base, end_clock)
+        else:
+            end_time = start_time + (duration or DEFAULT_DURATION)
+
+    return {
+        'title': title or None,
+        'start_time': start_time,
+        'end_time': end_time,
+        'location': location or DEFAULT_LOCATION,
+        'description': '',
+        'confidence': round(confidence, 2),
+    }
+
+
+def parse_change(message, now=None):
+    """解析“改到下午3点”“地点改到会议室A”这类修改指令
+
+    返回只包含被修改字段的日程数据（其余为 None，由 update_event 保留原值）；
+    无法确定修改内容时返回 None。
+    """
+    match = CHANGE_PATTERN.search(message)
+    if not match:
+        return None
+    now = now or datetime.now()
+    target = match['target'].strip()
+
+    clock, end_clock, _ = find_time(target)
+    if clock:
+        day, _, _ = find_date(target, now.date())
+        if not day:
+            day, _, _ = find_date(message, now.date())
+        day = day or now.date()
+        start_time = _at(day, clock)
+        end_time = _at(day, end_clock) if end_clock else start_time + DEFAULT_DURATION
+        return {
+            'is_schedule': True,
+            'title': None,  # 保持原标题
+            'start_time': start_time,
+            'end_time': end_time,
+            'location': None,  # 保持原位置
+            'description': ''
+        }
+
+    if '地点' in message[:match.start()] or LOCATION_SUFFIX.search(target):
+        return {
+            'is_schedule': True,
+            'location': target,
+            'title': None,
+            'start_time': None,
+            'end_time': None,
+            'description': ''
+        }
+    return None
+
+
+class ParserStats:
+    """本地解析与 AI 解析的次数，用于观察有多少请求跳过了 AI"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.local = 0
+        self.llm = 0
+
+    def record(self, local):
+        with self._lock:
+            if local:
+                self.local += 1
+            else:
+                self.llm += 1
+
+    def snapshot(self):
+        with self._lock:
+            total = self.local + self.llm
+            return {
+                'local': self.local,
+                'llm': self.llm,
+                'skip_rate': round(self.local / total, 4) if total else 0.0,
+                'threshold': CONFIDENCE_THRESHOLD,
+            }
+
+
+stats = ParserStats()
+
+
+if __name__ == '__main__':
+    samples = [
+        "明天下午3点在会议室A开项目会",
+        "下周三上午十点半和张老师讨论论文",
+        "周五晚上7点到9点在体育馆打球",
+        "12月25日14:00圣诞聚餐，持续两个小时",
+        "3天后早上8点去机场",
+        "今晚八点一刻看电影",
+        "今天有什么日程",
+        "帮我安排一下",
+    ]
+    for sample in samples:
+        result = parse_event(sample)
+        print(f"{sample}\n  -> {result}")
+    print(parse_change("改到明天下午2点"))
+    print(parse_change("地点改到会议室B"))
@@ -0,0 +1,51 @@
+from datetime import date, datetime, timedelta
+
+# Events 表中时间列的存储格式，字符串按字典序比较即按时间比较
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# 半开区间 [start, end) 谓词：列上不套函数，(user_id, start_time) 索引可以直接按范围查找
+RANGE_PREDICATE = 'start_time >= ? AND start_time < ?'
+
+# 跨天事件的最长跨度；按月查询时向前多扫描这么多天，以包含从上月延续过来的事件
+MAX_EVENT_SPAN_DAYS = 31
+
+
+def _as_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(str(value)[:10], '%Y-%m-%d').date()
+
+
+def format_time(value):
+    return value.strftime(TIME_FORMAT)
+
+
+def days_range(first_day, last_day):
+    """first_day 到 last_day（含）之间所有日程的半开区间边界"""
+    start = _as_date(first_day)
+    end = _as_date(last_day) + timedelta(days=1)
+    return start.strftime(TIME_FORMAT), end.strftime(TIME_FORMAT)
+
+
+def day_range(day):
+    """某一天的半开区间边界"""
+    return days_range(day, day)
+
+
+def month_range(year, month):
+    """某个月的半开区间边界"""
+    start = date(year, month, 1)
+    end = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+    return start.strftime(TIME_FORMAT), end.strftime(TIME_FORMAT)
+
+
+def parse_iso_bound(value):
+    """把 FullCalendar 传来的 start/end（'2026-01-01' 或 '2026-01-01T00:00:00+08:00'）转为存储格式
+
+    时区后缀被忽略，按本地时间处理；格式错误时抛出 ValueError。
+    """
+    text = str(value).strip().replace('T', ' ')
+    text = text[:19] if len(text) > 10 else text + ' 00:00:00'
+    return datetime.strptime(text, TIME_FORMAT).strftime(TIME_FORMAT)
@@ -102,9 +102,11 @@ CREATE TABLE EventTags (
 );
  
  
- /*5. 索引优化*/
-CREATE INDEX idx_start_time ON Events(start_time);
-CREATE INDEX idx_end_time ON Events(end_time);
+ /*5. 索引优化
+ SQLite 中的实际索引由 migrations.py 创建：查询都按用户过滤，
+ 因此使用 (user_id, start_time) 开头的复合索引代替单列索引*/
+CREATE INDEX idx_events_user_start ON Events(user_id, start_time, end_time);
+CREATE INDEX idx_events_user_end ON Events(user_id, end_time);
 
 
 